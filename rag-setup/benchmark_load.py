@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga de rag_api_service.py sin ChromaDB ni LLM reales
+
+Levanta en procesos separados:
+  - un LLM stub OpenAI-compatible con latencia y velocidad de generación
+    configurables (con y sin streaming)
+  - el servicio RAG real (misma main() y flags) sobre un índice local
+    sintético con embeddings por hashing, en lugar de ChromaDB
+
+y lanza carga contra /search, /generate y /health con la concurrencia
+indicada. El resultado (RPS, p50/p95/p99 y tasa de errores por endpoint) se
+imprime en JSON para comparar ejecuciones.
+
+Uso:
+    python benchmark_load.py
+    python benchmark_load.py --concurrency 32 --duration 20 --stream
+    python benchmark_load.py --service-args "--server async --llm-concurrency 16"
+    python benchmark_load.py --endpoints generate --llm-latency 0.5 --output base.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import requests
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+EMBEDDING_DIM = 256
+
+TOPICS = {
+    'concentración': "atención foco distracciones estudio tareas largas temporizador",
+    'organización': "agenda rutinas listas calendario objetos recordatorios hábitos",
+    'procrastinación': "empezar tareas aburridas motivación pomodoro plazos recompensas",
+    'emociones': "frustración impulsividad regulación emocional calma respiración",
+    'medicación': "metilfenidato estimulantes dosis efectos secundarios tratamiento",
+    'sueño': "descanso insomnio horarios pantallas energía cansancio"
+}
+
+QUESTIONS = [
+    "¿Cómo mejorar la {topic} con TDAH?",
+    "¿Qué técnicas de {topic} recomiendan los libros?",
+    "Tengo problemas de {topic}, ¿qué puedo hacer?",
+    "¿Por qué el TDAH afecta a la {topic}?"
+]
+
+
+# === EMBEDDINGS Y CORPUS SINTÉTICOS ===
+
+def hash_embed(texts: List[str]) -> 'np.ndarray':
+    """
+    Embeddings por hashing de términos (deterministas entre procesos)
+
+    Sustituyen al modelo de ChromaDB: son baratos y textos con palabras en
+    común quedan cerca, suficiente para ejercitar el camino de búsqueda.
+    """
+    from rag_service.bm25 import tokenize
+
+    vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for term in tokenize(text):
+            h = zlib.crc32(term.encode('utf-8'))
+            vectors[row, h % EMBEDDING_DIM] += 1.0 if h & 0x80000000 else -1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def write_synthetic_index(index_dir: str, n_documents: int, seed: int) -> None:
+    """Índice en el formato de --export-index con chunks sintéticos sobre TDAH"""
+    from rag_service.local_index import INDEX_CHUNKS_FILE, INDEX_EMBEDDINGS_FILE
+
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    ids, documents, metadatas = [], [], []
+
+    for i in range(n_documents):
+        topic = topics[i % len(topics)]
+        words = TOPICS[topic].split()
+        sentences = [
+            f"En adultos con TDAH la {topic} mejora con "
+            f"{' y '.join(rng.sample(words, 3))} (sección {i + 1}, idea {j + 1})."
+            for j in range(6)
+        ]
+        source = f"libro-{i % 5 + 1}.pdf"
+        page = i // 5 + 1
+        ids.append(f"{source}_{page}")
+        documents.append(" ".join(sentences))
+        metadatas.append({'source': source, 'page': page, 'type': 'pdf'})
+
+    np.save(os.path.join(index_dir, INDEX_EMBEDDINGS_FILE), hash_embed(documents))
+    with open(os.path.join(index_dir, INDEX_CHUNKS_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'ids': ids, 'documents': documents, 'metadatas': metadatas}, f, ensure_ascii=False)
+
+
+# === PROCESOS AUXILIARES (--role llm / --role service) ===
+
+def run_stub_llm(args: argparse.Namespace) -> None:
+    """
+    LLM stub OpenAI-compatible
+
+    Espera --llm-latency segundos (prefill / primer token) y genera
+    --completion-tokens tokens a --token-rate tokens por segundo, en SSE si la
+    petición lleva "stream": true.
+    """
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, body: Dict) -> None:
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.send_json({'status': 'ok'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length))
+
+            n_tokens = max(1, min(payload.get('max_tokens') or args.completion_tokens, args.completion_tokens))
+            prompt_tokens = sum(len(m['content'].split()) for m in payload['messages'])
+            usage = {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': n_tokens,
+                'total_tokens': prompt_tokens + n_tokens
+            }
+            token_delay = 1.0 / args.token_rate if args.token_rate > 0 else 0.0
+
+            time.sleep(args.llm_latency)
+
+            if not payload.get('stream'):
+                time.sleep(token_delay * n_tokens)
+                self.send_json({
+                    'choices': [{'message': {'role': 'assistant', 'content': ' token' * n_tokens}}],
+                    'usage': usage
+                })
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            for _ in range(n_tokens):
+                chunk = {'choices': [{'delta': {'content': ' token'}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(token_delay)
+            self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode('utf-8'))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubHandler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def run_service(args: argparse.Namespace) -> None:
+    """Servicio RAG real con el índice sintético y embeddings por hashing"""
+    import rag_api_service as rag
+    from rag_service import retrieval
+
+    class StubVectorIndex(retrieval.LocalVectorIndex):
+        def __init__(self, index_dir: str, embedding_function=None):
+            super().__init__(index_dir, embedding_function or hash_embed)
+
+    # init_local_index crea el índice con este nombre de rag_service.retrieval
+    retrieval.LocalVectorIndex = StubVectorIndex
+
+    sys.argv = [
+        'rag_api_service.py',
+        '--index-dir', args.index_dir,
+        '--llm-url', f"http://127.0.0.1:{args.llm_port}/v1/chat/completions",
+        '--host', '127.0.0.1',
+        '--port', str(args.port)
+    ] + shlex.split(args.service_args)
+    rag.main()
+
+
+# === GENERADOR DE CARGA ===
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn(role_args: List[str], log) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)] + role_args,
+        stdout=log,
+        stderr=subprocess.STDOUT
+    )
+
+
+def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El servicio terminó al arrancar (código {process.returncode})")
+        try:
+            # Con --fast-start /health responde 'starting' hasta terminar de inicializar
+            if requests.get(f"{base_url}/health", timeout=1).json().get('status') != 'starting':
+                return
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"El servicio no respondió en {timeout:.0f}s")
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Percentil por rango más cercano"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class QuerySource:
+    """Preguntas de la carga: un pool fijo (--query-pool) o todas distintas"""
+
+    def __init__(self, pool_size: int, seed: int):
+        self.pool_size = pool_size
+        self.rng = random.Random(seed)
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def next(self) -> str:
+        with self.lock:
+            self.counter += 1
+            n = self.rng.randrange(self.pool_size) if self.pool_size else self.counter
+        topics = list(TOPICS)
+        question = QUESTIONS[n % len(QUESTIONS)].format(topic=topics[n // len(QUESTIONS) % len(topics)])
+        # Sufijo para que las preguntas no se repitan (y no salgan del caché)
+        return f"{question} ({n})"
+
+
+def make_request(endpoint: str, args: argparse.Namespace, queries: QuerySource):
+    """(method, path, body) de la siguiente petición a `endpoint`"""
+    if endpoint == 'health':
+        return 'GET', '/health', None
+    if endpoint == 'search':
+        return 'POST', '/search', {'query': queries.next(), 'n_results': args.n_results}
+    return 'POST', '/generate', {
+        'message': queries.next(),
+        'n_results': args.n_results,
+        'max_tokens': args.completion_tokens,
+        'stream': args.stream,
+        'cache': args.cache
+    }
+
+
+def run_scenario(
+    base_url: str,
+    endpoint: str,
+    args: argparse.Namespace,
+    duration: float,
+    queries: QuerySource
+) -> Dict:
+    """Mantiene --concurrency peticiones en curso contra `endpoint` durante `duration` s"""
+    latencies: List[float] = []
+    first_event: List[float] = []
+    status_codes: Dict[str, int] = {}
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker() -> None:
+        nonlocal errors
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            method, path, body = make_request(endpoint, args, queries)
+            start = time.perf_counter()
+            ttfb = None
+            try:
+                with session.request(method, base_url + path, json=body,
+                                     timeout=args.timeout, stream=True) as response:
+                    for _ in response.iter_content(chunk_size=None):
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - start
+                    status = str(response.status_code)
+                    failed = response.status_code >= 400
+            except requests.exceptions.RequestException as e:
+                status = type(e).__name__
+                failed = True
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                status_codes[status] = status_codes.get(status, 0) + 1
+                if failed:
+                    errors += 1
+                else:
+                    latencies.append(elapsed)
+                    if ttfb is not None:
+                        first_event.append(ttfb)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(args.concurrency)]:
+            future.result()
+    wall = time.perf_counter() - start
+
+    total = len(latencies) + errors
+    latencies.sort()
+    result = {
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'rps': round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        'latency_ms': latency_summary(latencies),
+        'status_codes': status_codes
+    }
+    if endpoint == 'generate' and args.stream:
+        result['first_event_ms'] = latency_summary(sorted(first_event))
+    return result
+
+
+def latency_summary(sorted_values: List[float]) -> Dict:
+    if not sorted_values:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'mean': 0.0, 'max': 0.0}
+    return {
+        'p50': round(percentile(sorted_values, 50) * 1000, 2),
+        'p95': round(percentile(sorted_values, 95) * 1000, 2),
+        'p99': round(percentile(sorted_values, 99) * 1000, 2),
+        'mean': round(sum(sorted_values) / len(sorted_values) * 1000, 2),
+        'max': round(sorted_values[-1] * 1000, 2)
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict:
+    llm_port, service_port = free_port(), free_port()
+    base_url = f"http://127.0.0.1:{service_port}"
+    log = open(args.service_log, 'w') if args.service_log else subprocess.DEVNULL
+
+    with tempfile.TemporaryDirectory(prefix='rag-bench-') as index_dir:
+        write_synthetic_index(index_dir, args.documents, args.seed)
+
+        llm = spawn([
+            '--role', 'llm',
+            '--port', str(llm_port),
+            '--llm-latency', str(args.llm_latency),
+            '--token-rate', str(args.token_rate),
+            '--completion-tokens', str(args.completion_tokens)
+        ], log)
+        service = spawn([
+            '--role', 'service',
+            '--port', str(service_port),
+            '--llm-port', str(llm_port),
+            '--index-dir', index_dir,
+            f'--service-args={args.service_args}'
+        ], log)
+
+        try:
+            wait_until_ready(base_url, service)
+            queries = QuerySource(args.query_pool, args.seed)
+
+            results = {}
+            for endpoint in args.endpoints:
+                if args.warmup > 0:
+                    run_scenario(base_url, endpoint, args, args.warmup, queries)
+                results[endpoint] = run_scenario(base_url, endpoint, args, args.duration, queries)
+        finally:
+            for process in (service, llm):
+                process.terminate()
+            for process in (service, llm):
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            if log is not subprocess.DEVNULL:
+                log.close()
+
+    return {
+        'config': {
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'documents': args.documents,
+            'n_results': args.n_results,
+            'llm_latency': args.llm_latency,
+            'token_rate': args.token_rate,
+            'completion_tokens': args.completion_tokens,
+            'stream': args.stream,
+            'cache': args.cache,
+            'query_pool': args.query_pool,
+            'service_args': args.service_args
+        },
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de carga de rag_api_service.py con LLM e índice stub",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument('--endpoints', nargs='+', choices=['search', 'generate', 'health'],
+                        default=['search', 'generate', 'health'],
+                        help='Endpoints a medir, uno tras otro (default: los tres)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Peticiones simultáneas (default: 16)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Segundos de carga por endpoint (default: 10)')
+    parser.add_argument('--warmup', type=float, default=1.0, help='Segundos de calentamiento sin medir (default: 1)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Timeout de cada petición (default: 60)')
+    parser.add_argument('--documents', type=int, default=500, help='Chunks del índice sintético (default: 500)')
+    parser.add_argument('--n-results', type=int, default=3, help='n_results de /search y /generate (default: 3)')
+    parser.add_argument('--query-pool', type=int, default=0,
+                        help='Preguntas distintas que se repiten (default: 0 = todas distintas)')
+    parser.add_argument('--llm-latency', type=float, default=0.2,
+                        help='Segundos del LLM stub hasta el primer token (default: 0.2)')
+    parser.add_argument('--token-rate', type=float, default=50.0,
+                        help='Tokens por segundo del LLM stub, 0 = instantáneo (default: 50)')
+    parser.add_argument('--completion-tokens', type=int, default=32,
+                        help='Tokens que genera el LLM stub por respuesta (default: 32)')
+    parser.add_argument('--stream', action='store_true', help='/generate con "stream": true')
+    parser.add_argument('--cache', action='store_true', help='Permitir el caché de respuestas en /generate')
+    parser.add_argument('--service-args', type=str, default='',
+                        help='Flags extra para rag_api_service.py (ej: --service-args="--server async")')
+    parser.add_argument('--service-log', type=str, help='Fichero para la salida del servicio y del stub')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del corpus y las preguntas (default: 42)')
+    parser.add_argument('--output', type=str, help='Guardar el JSON también en este fichero')
+
+    # Procesos hijos (uso interno)
+    parser.add_argument('--role', choices=['bench', 'llm', 'service'], default='bench', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--llm-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--index-dir', type=str, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.role == 'llm':
+        run_stub_llm(args)
+        return
+
+    if np is None:
+        print("❌ NumPy no instalado. Ejecuta: pip install numpy")
+        sys.exit(1)
+
+    if args.role == 'service':
+        run_service(args)
+        return
+
+    report = run_benchmark(args)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n⚠️  Interrumpido por el usuario")
+        sys.exit(0)
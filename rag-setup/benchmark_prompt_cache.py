@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Benchmark del layout del prompt frente al prefix cache del LLM
+
+Levanta un LLM stub local (OpenAI-compatible) que simula el prefix caching de
+vLLM / llama.cpp: recuerda los prompts recientes y cuenta como cacheados los
+tokens del prefijo común más largo, redondeado a bloques del KV cache. Envía
+la misma carga con los layouts 'classic' y 'prefix' de rag_api_service.py y
+compara los tokens de prefill que el LLM tendría que calcular.
+
+Uso:
+    python benchmark_prompt_cache.py
+    python benchmark_prompt_cache.py --requests 500 --json
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+from rag_service.llm import generate_with_llm, init_llm_client
+from rag_service.settings import config
+
+
+# Aproximación de tokenizador: palabras y signos de puntuación sueltos
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+TOPICS = {
+    'concentración': [
+        "¿Cómo mejorar la concentración con TDAH?",
+        "Tengo TDAH y no logro concentrarme al estudiar, ¿qué hago?",
+        "¿Qué técnicas ayudan a mantener la atención en el trabajo?"
+    ],
+    'organización': [
+        "¿Qué técnicas de organización funcionan para el TDAH?",
+        "¿Cómo organizo mi semana si tengo TDAH?",
+        "Siempre pierdo mis cosas, ¿algún sistema de organización?"
+    ],
+    'procrastinación': [
+        "¿Por qué procrastino tanto con TDAH?",
+        "¿Cómo empiezo tareas que me aburren?",
+        "¿Sirve la técnica Pomodoro para el TDAH?"
+    ],
+    'emociones': [
+        "¿Cómo manejo la frustración cuando algo sale mal?",
+        "¿Es normal tener cambios de humor con TDAH?",
+        "¿Qué hago cuando me siento abrumado?"
+    ]
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text)
+
+
+def render_prompt(messages: List[Dict]) -> str:
+    """Aplica una plantilla de chat genérica (el stub no conoce la real)"""
+    return "".join(
+        f"<|{message['role']}|>\n{message['content']}<|end|>\n"
+        for message in messages
+    ) + "<|assistant|>\n"
+
+
+class PrefixCacheSimulator:
+    """
+    Prefix cache simplificado: últimos `capacity` prompts en memoria
+
+    Los tokens cacheados de un prompt son los del prefijo común más largo con
+    cualquier prompt anterior, redondeado hacia abajo a `block_size` (vLLM
+    cachea por bloques completos del KV cache).
+    """
+
+    def __init__(self, capacity: int = 64, block_size: int = 16):
+        self.block_size = block_size
+        self.entries = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def process(self, tokens: List[str]) -> int:
+        """Registra un prompt y devuelve cuántos de sus tokens ya estaban cacheados"""
+        with self.lock:
+            longest = 0
+            for entry in self.entries:
+                common = 0
+                for a, b in zip(entry, tokens):
+                    if a != b:
+                        break
+                    common += 1
+                longest = max(longest, common)
+
+            cached = (longest // self.block_size) * self.block_size
+            self.entries.append(tuple(tokens))
+
+            self.requests += 1
+            self.prompt_tokens += len(tokens)
+            self.cached_tokens += cached
+            return cached
+
+    def stats(self) -> Dict:
+        prefill = self.prompt_tokens - self.cached_tokens
+        return {
+            'requests': self.requests,
+            'prompt_tokens': self.prompt_tokens,
+            'cached_tokens': self.cached_tokens,
+            'prefill_tokens': prefill,
+            'cache_hit_rate': round(self.cached_tokens / self.prompt_tokens, 4)
+            if self.prompt_tokens else 0.0
+        }
+
+
+def start_stub_llm(simulator: PrefixCacheSimulator) -> ThreadingHTTPServer:
+    """LLM stub en un puerto libre de localhost; responde con `usage` y cached_tokens"""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, body: Dict) -> None:
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.send_json({'status': 'ok'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length))
+
+            tokens = tokenize(render_prompt(payload['messages']))
+            cached = simulator.process(tokens)
+
+            self.send_json({
+                'choices': [{'message': {'role': 'assistant', 'content': 'ok'}}],
+                'usage': {
+                    'prompt_tokens': len(tokens),
+                    'completion_tokens': 1,
+                    'total_tokens': len(tokens) + 1,
+                    'prompt_tokens_details': {'cached_tokens': cached}
+                }
+            })
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_chunks(rng: random.Random, chunks_per_topic: int) -> Dict[str, List[Dict]]:
+    """Chunks sintéticos por tema con el formato de search_knowledge"""
+    chunks = {}
+    for topic_index, topic in enumerate(TOPICS):
+        chunks[topic] = []
+        for i in range(chunks_per_topic):
+            sentences = [
+                f"En adultos con TDAH la {topic} depende de rutinas externas y "
+                f"recordatorios visibles (sección {i + 1}, idea {j + 1})."
+                for j in range(8)
+            ]
+            chunks[topic].append({
+                'id': f"libro-{topic_index + 1}.pdf_{i + 1}",
+                'text': " ".join(sentences),
+                'metadata': {
+                    'source': f"libro-{topic_index + 1}.pdf",
+                    'page': i + 1,
+                    'type': 'pdf'
+                },
+                'relevance': round(rng.uniform(0.6, 0.95), 3)
+            })
+    return chunks
+
+
+def make_workload(
+    n_requests: int,
+    n_results: int,
+    chunks_per_topic: int,
+    seed: int
+) -> List[Tuple[str, List[Dict]]]:
+    """
+    Peticiones (pregunta, contexto recuperado) con temas de popularidad desigual
+
+    Preguntas del mismo tema recuperan fuentes parecidas pero en distinto
+    orden de relevancia, como ocurre con consultas reales.
+    """
+    rng = random.Random(seed)
+    chunks = make_chunks(rng, chunks_per_topic)
+    topics = list(TOPICS)
+    weights = [1 / (rank + 1) for rank in range(len(topics))]
+
+    workload = []
+    for _ in range(n_requests):
+        topic = rng.choices(topics, weights=weights)[0]
+        question = rng.choice(TOPICS[topic])
+        candidates = chunks[topic][:n_results + 1]
+        workload.append((question, rng.sample(candidates, n_results)))
+
+    return workload
+
+
+def run_layout(
+    layout: str,
+    workload: List[Tuple[str, List[Dict]]],
+    args: argparse.Namespace
+) -> Dict:
+    """Envía la carga con un layout a un stub nuevo (prefix cache vacío)"""
+    simulator = PrefixCacheSimulator(args.cache_capacity, args.block_size)
+    server = start_stub_llm(simulator)
+
+    try:
+        config['llm_url'] = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+        config['prompt_layout'] = layout
+        init_llm_client()
+
+        for question, context_docs in workload:
+            result = generate_with_llm(question, context_docs, max_tokens=1)
+            if 'error' in result:
+                raise RuntimeError(result['error'])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return simulator.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compara los tokens de prefill con los layouts de prompt 'classic' y 'prefix'"
+    )
+
+    parser.add_argument('--requests', type=int, default=200, help='Peticiones por layout (default: 200)')
+    parser.add_argument('--n-results', type=int, default=3, help='Fuentes por petición (default: 3)')
+    parser.add_argument('--chunks-per-topic', type=int, default=6, help='Chunks distintos por tema (default: 6)')
+    parser.add_argument('--cache-capacity', type=int, default=64, help='Prompts que recuerda el prefix cache (default: 64)')
+    parser.add_argument('--block-size', type=int, default=16, help='Tokens por bloque del KV cache (default: 16)')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla de la carga (default: 42)')
+    parser.add_argument('--json', action='store_true', help='Imprimir solo el resultado en JSON')
+
+    args = parser.parse_args()
+
+    workload = make_workload(args.requests, args.n_results, args.chunks_per_topic, args.seed)
+    results = {layout: run_layout(layout, workload, args) for layout in ('classic', 'prefix')}
+
+    saved = results['classic']['prefill_tokens'] - results['prefix']['prefill_tokens']
+    report = {
+        'requests': args.requests,
+        'layouts': results,
+        'prefill_tokens_saved': saved,
+        'prefill_reduction': round(saved / results['classic']['prefill_tokens'], 4)
+        if results['classic']['prefill_tokens'] else 0.0
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print("\n📊 Prefill por layout de prompt")
+    print("─" * 60)
+    print(f"{'layout':<10}{'prompt':>12}{'cacheados':>12}{'prefill':>12}{'hit rate':>12}")
+    for layout, stats in results.items():
+        print(
+            f"{layout:<10}{stats['prompt_tokens']:>12}{stats['cached_tokens']:>12}"
+            f"{stats['prefill_tokens']:>12}{stats['cache_hit_rate']:>12.1%}"
+        )
+    print("─" * 60)
+    print(f"✅ Tokens de prefill ahorrados: {saved} ({report['prefill_reduction']:.1%})")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n⚠️  Interrumpido por el usuario")
+        sys.exit(0)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Mide el arranque de rag_api_service.py (tiempo hasta abrir el puerto y hasta estar listo)
+
+Lanza el servicio varias veces y, en cada arranque, mide desde fuera:
+  - port_open_seconds: hasta que el puerto acepta conexiones
+  - ready_seconds: hasta que /health deja de responder 'starting'
+
+y recoge lo que el propio servicio informa en /health → startup (tiempo de
+importación del módulo, tiempo hasta estar listo e imports diferidos). Con
+--stub el servicio arranca sobre el índice sintético y el LLM stub de
+benchmark_load.py, sin ChromaDB ni LLM reales, para poder medirlo en CI.
+Con --max-ready-seconds / --max-port-open-seconds termina con código 1 si
+la mediana supera el límite.
+
+Uso:
+    python measure_startup.py --stub
+    python measure_startup.py --stub --runs 5 --service-args="--fast-start" --max-port-open-seconds 2
+    python measure_startup.py --service-args="--llm-url http://IP:8080/v1/chat/completions --fast-start"
+"""
+
+import argparse
+import json
+import os
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+from benchmark_load import free_port, spawn, write_synthetic_index
+
+
+SERVICE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rag_api_service.py')
+
+
+def port_open(port: int) -> bool:
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+def health_status(base_url: str) -> Optional[Dict]:
+    """Body de /health, o None si aún no responde"""
+    try:
+        return requests.get(f"{base_url}/health", timeout=1).json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+
+def measure(process: subprocess.Popen, port: int, started: float, timeout: float) -> Dict:
+    """Espera al puerto y a /health distinto de 'starting' (tiempos desde `started`)"""
+    base_url = f"http://127.0.0.1:{port}"
+    result: Dict = {'port_open_seconds': None, 'ready_seconds': None}
+    deadline = started + timeout
+
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El servicio terminó al arrancar (código {process.returncode})")
+
+        if result['port_open_seconds'] is None:
+            if port_open(port):
+                result['port_open_seconds'] = round(time.perf_counter() - started, 3)
+            else:
+                time.sleep(0.01)
+                continue
+
+        body = health_status(base_url)
+        if body is not None and body.get('status') != 'starting':
+            result['ready_seconds'] = round(time.perf_counter() - started, 3)
+            result['status'] = body.get('status')
+            result['service'] = body.get('startup', {})
+            return result
+        time.sleep(0.02)
+
+    raise RuntimeError(f"El servicio no estuvo listo en {timeout:.0f}s")
+
+
+def stop(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run_once(args: argparse.Namespace, index_dir: Optional[str], log) -> Dict:
+    port = free_port()
+    processes = []
+
+    if args.stub:
+        # LLM stub y servicio con el índice sintético (roles de benchmark_load.py)
+        llm_port = free_port()
+        processes.append(spawn(['--role', 'llm', '--port', str(llm_port)], log))
+        started = time.perf_counter()
+        processes.append(spawn([
+            '--role', 'service',
+            '--port', str(port),
+            '--llm-port', str(llm_port),
+            '--index-dir', index_dir,
+            f'--service-args={args.service_args}'
+        ], log))
+    else:
+        started = time.perf_counter()
+        processes.append(subprocess.Popen(
+            [sys.executable, SERVICE, '--host', '127.0.0.1', '--port', str(port)]
+            + shlex.split(args.service_args),
+            stdout=log,
+            stderr=subprocess.STDOUT
+        ))
+
+    try:
+        return measure(processes[-1], port, started, args.timeout)
+    finally:
+        stop(processes)
+
+
+def summarize(values: List[float]) -> Dict:
+    if not values:
+        return {'min': None, 'median': None, 'max': None}
+    return {
+        'min': round(min(values), 3),
+        'median': round(statistics.median(values), 3),
+        'max': round(max(values), 3)
+    }
+
+
+def service_values(runs: List[Dict], field: str) -> List[float]:
+    """Valores de /health → startup informados por el servicio en cada arranque"""
+    return [run['service'][field] for run in runs if run['service'].get(field) is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mide el tiempo de arranque de rag_api_service.py",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument('--runs', type=int, default=3, help='Arranques a medir (default: 3)')
+    parser.add_argument('--stub', action='store_true',
+                        help='Arrancar sobre el índice sintético y el LLM stub de benchmark_load.py')
+    parser.add_argument('--documents', type=int, default=500,
+                        help='Chunks del índice sintético con --stub (default: 500)')
+    parser.add_argument('--service-args', type=str, default='',
+                        help='Flags para rag_api_service.py (ej: --service-args="--fast-start")')
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help='Segundos máximos por arranque (default: 120)')
+    parser.add_argument('--max-port-open-seconds', type=float,
+                        help='Fallar (código 1) si la mediana hasta abrir el puerto lo supera')
+    parser.add_argument('--max-ready-seconds', type=float,
+                        help='Fallar (código 1) si la mediana hasta estar listo lo supera')
+    parser.add_argument('--service-log', type=str, help='Fichero para la salida del servicio')
+    parser.add_argument('--output', type=str, help='Guardar el JSON también en este fichero')
+
+    args = parser.parse_args()
+
+    log = open(args.service_log, 'w') if args.service_log else subprocess.DEVNULL
+    runs = []
+    try:
+        with tempfile.TemporaryDirectory(prefix='rag-startup-') as index_dir:
+            if args.stub:
+                write_synthetic_index(index_dir, args.documents, seed=42)
+            for run in range(args.runs):
+                result = run_once(args, index_dir, log)
+                print(f"⏱️  Arranque {run + 1}/{args.runs}: puerto {result['port_open_seconds']:.2f}s, "
+                      f"listo {result['ready_seconds']:.2f}s", file=sys.stderr)
+                runs.append(result)
+    finally:
+        if log is not subprocess.DEVNULL:
+            log.close()
+
+    summary = {
+        'port_open_seconds': summarize([r['port_open_seconds'] for r in runs]),
+        'ready_seconds': summarize([r['ready_seconds'] for r in runs]),
+        'service_import_seconds': summarize(service_values(runs, 'import_seconds')),
+        'service_ready_seconds': summarize(service_values(runs, 'ready_seconds'))
+    }
+
+    report = {
+        'config': {
+            'runs': args.runs,
+            'stub': args.stub,
+            'service_args': args.service_args
+        },
+        'summary': summary,
+        'runs': runs
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+    failed = False
+    for limit, metric in ((args.max_port_open_seconds, 'port_open_seconds'),
+                          (args.max_ready_seconds, 'ready_seconds')):
+        if limit is not None and summary[metric]['median'] > limit:
+            print(f"❌ {metric}: mediana {summary[metric]['median']:.2f}s > {limit:g}s", file=sys.stderr)
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n⚠️  Interrumpido por el usuario")
+        sys.exit(0)
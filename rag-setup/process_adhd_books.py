@@ -5,13 +5,22 @@ con ChromaDB para Retrieval Augmented Generation (RAG).
 
 Uso:
     python process_adhd_books.py --books-dir ./books --chroma-host localhost
+    python process_adhd_books.py --books-dir ./books --shards db1:8000 db2:8000
+    python process_adhd_books.py --export-index ./index
 """
 
 import os
 import argparse
+import json
 import sys
+import urllib.request
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
+
+# Mismo tokenizador que la búsqueda híbrida del servicio (--bm25-index)
+from rag_service.bm25 import BM25_INDEX_VERSION, tokenize
+# Mismo reparto de fuentes entre shards que el servicio (--shards)
+from rag_service.sharding import COLLECTION_NAME, parse_shard_spec, shard_for_source
 
 try:
     import chromadb
@@ -20,6 +29,11 @@ except ImportError:
     print("❌ ChromaDB no instalado. Ejecuta: pip install chromadb")
     sys.exit(1)
 
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Solo necesario para --export-index
+
 try:
     from langchain.text_splitter import RecursiveCharacterTextSplitter
     from langchain.document_loaders import PyPDFLoader, TextLoader
@@ -28,38 +42,72 @@ except ImportError:
     sys.exit(1)
 
 
+COLLECTION_METADATA = {
+    "description": "ADHD specialized books and resources",
+    "language": "es"
+}
+
+# Ficheros del índice local que lee rag_api_service.py --index-dir
+INDEX_EMBEDDINGS_FILE = 'embeddings.npy'
+INDEX_CHUNKS_FILE = 'chunks.json'
+
+
 class ADHDBookProcessor:
     """Procesador de libros especializados en TDAH"""
 
-    def __init__(self, chroma_host: str = "localhost", chroma_port: int = 8000):
+    def __init__(
+        self,
+        chroma_host: str = "localhost",
+        chroma_port: int = 8000,
+        bm25_index_path: str = "./bm25_index.json",
+        shards: Optional[List[str]] = None
+    ):
         """
         Inicializa el procesador
 
         Args:
             chroma_host: Host de ChromaDB
             chroma_port: Puerto de ChromaDB
+            bm25_index_path: Fichero del índice invertido BM25
+            shards: Colecciones 'HOST[:PUERTO][/COLECCIÓN]' entre las que se
+                reparten los chunks por hash de `source` (en lugar de
+                chroma_host/chroma_port)
         """
-        print(f"🔗 Conectando a ChromaDB en {chroma_host}:{chroma_port}...")
+        if shards:
+            self.shard_specs = [parse_shard_spec(spec, chroma_port) for spec in shards]
+        else:
+            self.shard_specs = [(chroma_host, chroma_port, COLLECTION_NAME)]
 
-        try:
-            self.client = chromadb.HttpClient(host=chroma_host, port=chroma_port)
-            # Test connection
-            self.client.heartbeat()
-            print("✅ Conexión exitosa a ChromaDB")
-        except Exception as e:
-            print(f"❌ Error conectando a ChromaDB: {e}")
-            print("\n💡 ¿ChromaDB está corriendo? Ejecuta:")
-            print("   docker run -d --name chromadb -p 8000:8000 chromadb/chroma")
+        if len(set(self.shard_specs)) != len(self.shard_specs):
+            print("❌ Hay shards repetidos en --shards")
             sys.exit(1)
 
-        # Crear o obtener colección
-        self.collection = self.client.get_or_create_collection(
-            name="adhd_knowledge",
-            metadata={
-                "description": "ADHD specialized books and resources",
-                "language": "es"
-            }
-        )
+        # Un cliente por host (varios shards pueden ser colecciones del mismo)
+        self.clients = {}
+        for host, port, _ in self.shard_specs:
+            if (host, port) in self.clients:
+                continue
+            print(f"🔗 Conectando a ChromaDB en {host}:{port}...")
+            try:
+                client = chromadb.HttpClient(host=host, port=port)
+                # Test connection
+                client.heartbeat()
+                self.clients[(host, port)] = client
+                print("✅ Conexión exitosa a ChromaDB")
+            except Exception as e:
+                print(f"❌ Error conectando a ChromaDB: {e}")
+                print("\n💡 ¿ChromaDB está corriendo? Ejecuta:")
+                print("   docker run -d --name chromadb -p 8000:8000 chromadb/chroma")
+                sys.exit(1)
+
+        # Crear u obtener las colecciones (una por shard)
+        self.collections = [
+            self.clients[(host, port)].get_or_create_collection(
+                name=name,
+                metadata=COLLECTION_METADATA
+            )
+            for host, port, name in self.shard_specs
+        ]
 
         # Text splitter para dividir documentos en chunks
         self.text_splitter = RecursiveCharacterTextSplitter(
@@ -69,8 +117,24 @@ class ADHDBookProcessor:
             separators=["\n\n", "\n", ". ", " ", ""]
         )
 
-        print(f"📚 Colección: adhd_knowledge")
-        print(f"📊 Documentos existentes: {self.collection.count()}")
+        if len(self.collections) == 1:
+            print(f"📚 Colección: {self.shard_specs[0][2]}")
+        else:
+            print(f"📚 Colecciones ({len(self.collections)} shards por fuente):")
+            for (host, port, name), collection in zip(self.shard_specs, self.collections):
+                print(f"   {host}:{port}/{name}: {collection.count()} documentos")
+        print(f"📊 Documentos existentes: {self.count()}")
+
+        self.bm25_index_path = bm25_index_path
+        self.load_inverted_index()
+
+    def collection_for(self, source: str):
+        """Colección (shard) donde va una fuente"""
+        return self.collections[shard_for_source(source, len(self.collections))]
+
+    def count(self) -> int:
+        """Chunks en todos los shards"""
+        return sum(collection.count() for collection in self.collections)
 
     def load_pdf(self, file_path: str) -> List[Dict]:
         """
@@ -168,13 +232,20 @@ class ADHDBookProcessor:
             for doc in documents
         ]
 
-        # Añadir a ChromaDB
+        # Añadir a ChromaDB (todos los chunks de una fuente van al mismo shard)
+        by_collection: Dict[int, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            shard = shard_for_source(metadata['source'], len(self.collections))
+            by_collection.setdefault(shard, []).append(i)
+
         try:
-            self.collection.add(
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
-            )
+            for shard, positions in by_collection.items():
+                self.collections[shard].add(
+                    documents=[texts[i] for i in positions],
+                    metadatas=[metadatas[i] for i in positions],
+                    ids=[ids[i] for i in positions]
+                )
+            self.index_chunks(ids, texts)
             return len(documents)
         except Exception as e:
             print(f"❌ Error añadiendo documentos a ChromaDB: {e}")
@@ -221,8 +292,95 @@ class ADHDBookProcessor:
             else:
                 print(f"   ❌ Error procesando archivo")
 
+        if total_chunks > 0:
+            self.save_inverted_index()
+
         return files_processed, total_chunks
 
+    def load_inverted_index(self) -> None:
+        """Carga el índice BM25 existente (o empieza uno vacío)"""
+        self.index_ids: List[str] = []
+        self.index_lengths: List[int] = []
+        self.postings: Dict[str, List[int]] = {}
+
+        if not os.path.exists(self.bm25_index_path):
+            return
+
+        try:
+            with open(self.bm25_index_path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != BM25_INDEX_VERSION:
+                raise ValueError(f"versión {data.get('version')} no soportada")
+            self.index_ids = data['ids']
+            self.index_lengths = data['lengths']
+            self.postings = data['postings']
+        except Exception as e:
+            print(f"⚠️  Índice BM25 ignorado ({self.bm25_index_path}): {e}")
+            print("   Reconstrúyelo con --rebuild-bm25")
+
+    def index_chunks(self, ids: List[str], texts: List[str]) -> None:
+        """
+        Añade chunks al índice invertido (término → [posición, tf, ...])
+
+        Los IDs ya indexados se ignoran, igual que hace ChromaDB en add().
+        """
+        indexed = set(self.index_ids)
+
+        for doc_id, text in zip(ids, texts):
+            if doc_id in indexed:
+                continue
+            indexed.add(doc_id)
+
+            terms = tokenize(text)
+            position = len(self.index_ids)
+            self.index_ids.append(doc_id)
+            self.index_lengths.append(len(terms))
+
+            frequencies: Dict[str, int] = {}
+            for term in terms:
+                frequencies[term] = frequencies.get(term, 0) + 1
+            for term, tf in frequencies.items():
+                self.postings.setdefault(term, []).extend((position, tf))
+
+    def save_inverted_index(self) -> None:
+        """Guarda el índice BM25 (escritura atómica vía fichero temporal)"""
+        tmp_path = self.bm25_index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(
+                {
+                    'version': BM25_INDEX_VERSION,
+                    'ids': self.index_ids,
+                    'lengths': self.index_lengths,
+                    'postings': self.postings
+                },
+                f,
+                ensure_ascii=False,
+                separators=(',', ':')
+            )
+        os.replace(tmp_path, self.bm25_index_path)
+
+    def rebuild_inverted_index(self, batch_size: int = 500) -> int:
+        """
+        Reconstruye el índice BM25 desde los textos de la colección
+
+        Returns:
+            Número de chunks indexados
+        """
+        self.index_ids, self.index_lengths, self.postings = [], [], {}
+
+        for collection in self.collections:
+            total = collection.count()
+            for offset in range(0, total, batch_size):
+                batch = collection.get(
+                    limit=batch_size,
+                    offset=offset,
+                    include=['documents']
+                )
+                self.index_chunks(batch['ids'], batch['documents'])
+
+        self.save_inverted_index()
+        return len(self.index_ids)
+
     def search_test(self, query: str, n_results: int = 3) -> None:
         """
         Prueba de búsqueda en la base de conocimiento
@@ -234,61 +392,154 @@ class ADHDBookProcessor:
         print(f"\n🔍 Búsqueda: '{query}'")
         print("─" * 60)
 
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
-
-        if not results['documents'][0]:
+        # Top-k de cada shard, mezclado por distancia
+        hits = []
+        for collection in self.collections:
+            results = collection.query(
+                query_texts=[query],
+                n_results=n_results
+            )
+            hits.extend(zip(
+                results['documents'][0],
+                results['metadatas'][0],
+                results['distances'][0]
+            ))
+        hits = sorted(hits, key=lambda hit: hit[2])[:n_results]
+
+        if not hits:
             print("No se encontraron resultados")
             return
 
-        for i, (doc, metadata, distance) in enumerate(zip(
-            results['documents'][0],
-            results['metadatas'][0],
-            results['distances'][0]
-        )):
+        for i, (doc, metadata, distance) in enumerate(hits):
             print(f"\n📌 Resultado {i+1} (relevancia: {1 - distance:.2f})")
             print(f"   Fuente: {metadata.get('source', 'N/A')}")
             print(f"   Página/Chunk: {metadata.get('page', metadata.get('chunk', 'N/A'))}")
             print(f"   Texto: {doc[:200]}...")
 
     def get_stats(self) -> Dict:
-        """Obtiene estadísticas de la colección"""
-        count = self.collection.count()
-
-        # Obtener muestra de metadatas
-        if count > 0:
-            sample = self.collection.get(limit=min(100, count))
-            sources = set(m['source'] for m in sample['metadatas'])
-        else:
-            sources = set()
-
-        return {
-            'total_documents': count,
+        """Obtiene estadísticas de la colección (o de todos los shards)"""
+        counts = [collection.count() for collection in self.collections]
+
+        # Obtener muestra de metadatas de cada shard
+        sources = set()
+        for collection, count in zip(self.collections, counts):
+            if count > 0:
+                sample = collection.get(limit=min(100, count))
+                sources.update(m['source'] for m in sample['metadatas'])
+
+        stats = {
+            'total_documents': sum(counts),
             'unique_sources': len(sources),
             'sources': sorted(sources)
         }
+        if len(self.collections) > 1:
+            stats['shards'] = {
+                f"{host}:{port}/{name}": count
+                for (host, port, name), count in zip(self.shard_specs, counts)
+            }
+        return stats
+
+    def export_index(self, output_dir: str, batch_size: int = 500) -> int:
+        """
+        Exporta la colección para el índice local de rag_api_service.py
+
+        Escribe embeddings.npy (matriz float32 con filas normalizadas) y
+        chunks.json (ids, textos y metadata en el mismo orden). Cada fichero se
+        escribe a un temporal y se renombra, así un servicio en marcha nunca
+        lee una exportación a medias.
+
+        Args:
+            output_dir: Directorio de salida
+            batch_size: Chunks leídos por llamada a ChromaDB
+
+        Returns:
+            Número de chunks exportados
+        """
+        if np is None:
+            print("❌ NumPy no instalado. Ejecuta: pip install numpy")
+            return 0
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        ids, documents, metadatas, vectors = [], [], [], []
+
+        for collection in self.collections:
+            total = collection.count()
+            for offset in range(0, total, batch_size):
+                batch = collection.get(
+                    limit=batch_size,
+                    offset=offset,
+                    include=['embeddings', 'documents', 'metadatas']
+                )
+                ids.extend(batch['ids'])
+                documents.extend(batch['documents'])
+                metadatas.extend(batch['metadatas'])
+                vectors.extend(batch['embeddings'])
+
+        if ids:
+            embeddings = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, 1e-12)
+        else:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+
+        embeddings_path = os.path.join(output_dir, INDEX_EMBEDDINGS_FILE)
+        with open(embeddings_path + '.tmp', 'wb') as f:
+            np.save(f, embeddings)
+        os.replace(embeddings_path + '.tmp', embeddings_path)
+
+        chunks_path = os.path.join(output_dir, INDEX_CHUNKS_FILE)
+        with open(chunks_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(
+                {'ids': ids, 'documents': documents, 'metadatas': metadatas},
+                f,
+                ensure_ascii=False
+            )
+        os.replace(chunks_path + '.tmp', chunks_path)
+
+        return len(ids)
 
     def clear_collection(self) -> None:
-        """Limpia la colección"""
+        """Limpia la colección (todos los shards)"""
         try:
-            self.client.delete_collection(name="adhd_knowledge")
-            print("✅ Colección eliminada")
-
-            # Recrear
-            self.collection = self.client.get_or_create_collection(
-                name="adhd_knowledge",
-                metadata={
-                    "description": "ADHD specialized books and resources",
-                    "language": "es"
-                }
-            )
-            print("✅ Colección recreada (vacía)")
+            for i, (host, port, name) in enumerate(self.shard_specs):
+                client = self.clients[(host, port)]
+                client.delete_collection(name=name)
+
+                # Recrear
+                self.collections[i] = client.get_or_create_collection(
+                    name=name,
+                    metadata=COLLECTION_METADATA
+                )
+            print("✅ Colección eliminada y recreada (vacía)")
+
+            self.index_ids, self.index_lengths, self.postings = [], [], {}
+            self.save_inverted_index()
         except Exception as e:
             print(f"❌ Error limpiando colección: {e}")
 
 
+def notify_rag_service(service_url: str) -> None:
+    """
+    Avisa al servicio RAG de que la colección cambió (POST /admin/refresh)
+
+    Así el servicio recuenta los documentos y vacía sus cachés sin esperar
+    al siguiente refresco periódico.
+
+    Args:
+        service_url: URL base del servicio (ej: http://localhost:5000)
+    """
+    url = service_url.rstrip('/') + '/admin/refresh'
+
+    try:
+        req = urllib.request.Request(url, data=b'', method='POST')
+        with urllib.request.urlopen(req, timeout=10) as response:
+            data = json.loads(response.read().decode('utf-8'))
+        print(f"🔄 Servicio RAG actualizado: {data.get('documents')} documentos")
+    except Exception as e:
+        print(f"⚠️  No se pudo avisar al servicio RAG ({url}): {e}")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Procesa libros especializados de TDAH para RAG",
@@ -302,6 +553,9 @@ Ejemplos de uso:
   # Conectar a ChromaDB remoto
   python process_adhd_books.py --books-dir ./books --chroma-host 192.168.1.100
 
+  # Repartir los chunks entre varios ChromaDB por hash de la fuente
+  python process_adhd_books.py --books-dir ./books --shards 10.0.0.5:8000 10.0.0.6:8000
+
   # Ver estadísticas
   python process_adhd_books.py --stats
 
@@ -310,6 +564,15 @@ Ejemplos de uso:
 
   # Limpiar base de datos
   python process_adhd_books.py --clear
+
+  # Exportar índice local para rag_api_service.py --index-dir
+  python process_adhd_books.py --export-index ./index
+
+  # Reconstruir el índice BM25 desde la colección (búsqueda híbrida)
+  python process_adhd_books.py --rebuild-bm25 --bm25-index ./bm25_index.json
+
+  # Avisar al servicio RAG al terminar (recuenta documentos y vacía cachés)
+  python process_adhd_books.py --books-dir ./books --rag-service-url http://localhost:5000
         """
     )
 
@@ -334,6 +597,14 @@ Ejemplos de uso:
         help='Puerto de ChromaDB (default: 8000)'
     )
 
+    parser.add_argument(
+        '--shards',
+        nargs='+',
+        metavar='HOST:PUERTO/COLECCIÓN',
+        help='Repartir los chunks entre varias colecciones/hosts por hash de la fuente '
+             '(sustituye a --chroma-host/--chroma-port; el orden importa)'
+    )
+
     parser.add_argument(
         '--stats',
         action='store_true',
@@ -352,12 +623,40 @@ Ejemplos de uso:
         help='Limpiar colección (¡PRECAUCIÓN!)'
     )
 
+    parser.add_argument(
+        '--export-index',
+        type=str,
+        metavar='DIR',
+        help='Exportar embeddings, textos y metadata a DIR para rag_api_service.py --index-dir'
+    )
+
+    parser.add_argument(
+        '--bm25-index',
+        type=str,
+        default='./bm25_index.json',
+        help='Fichero del índice BM25 que se actualiza al procesar (default: ./bm25_index.json)'
+    )
+
+    parser.add_argument(
+        '--rebuild-bm25',
+        action='store_true',
+        help='Reconstruir el índice BM25 desde los chunks ya presentes en ChromaDB'
+    )
+
+    parser.add_argument(
+        '--rag-service-url',
+        type=str,
+        help='URL del servicio RAG a avisar tras modificar la colección (ej: http://localhost:5000)'
+    )
+
     args = parser.parse_args()
 
     # Inicializar procesador
     processor = ADHDBookProcessor(
         chroma_host=args.chroma_host,
-        chroma_port=args.chroma_port
+        chroma_port=args.chroma_port,
+        bm25_index_path=args.bm25_index,
+        shards=args.shards
     )
 
     # Acciones
@@ -365,6 +664,8 @@ Ejemplos de uso:
         confirm = input("⚠️  ¿Seguro que quieres eliminar toda la colección? [y/N]: ")
         if confirm.lower() == 'y':
             processor.clear_collection()
+            if args.rag_service_url:
+                notify_rag_service(args.rag_service_url)
         else:
             print("Cancelado")
         return
@@ -375,6 +676,8 @@ Ejemplos de uso:
         print("─" * 60)
         print(f"Total documentos: {stats['total_documents']}")
         print(f"Fuentes únicas: {stats['unique_sources']}")
+        for shard, count in stats.get('shards', {}).items():
+            print(f"  Shard {shard}: {count}")
         if stats['sources']:
             print("\nFuentes:")
             for source in stats['sources']:
@@ -385,6 +688,22 @@ Ejemplos de uso:
         processor.search_test(args.test_search)
         return
 
+    if args.rebuild_bm25:
+        print(f"\n🔤 Reconstruyendo índice BM25 en {args.bm25_index}...")
+        indexed = processor.rebuild_inverted_index()
+        print(f"✅ {indexed} chunks indexados")
+        if args.rag_service_url:
+            notify_rag_service(args.rag_service_url)
+        return
+
+    if args.export_index:
+        print(f"\n📦 Exportando índice local a {args.export_index}...")
+        exported = processor.export_index(args.export_index)
+        print(f"✅ {exported} chunks exportados")
+        if args.rag_service_url:
+            notify_rag_service(args.rag_service_url)
+        return
+
     # Procesamiento de libros
     print("\n🚀 Iniciando procesamiento de libros...")
     print(f"📁 Directorio: {args.books_dir}")
@@ -402,6 +721,9 @@ Ejemplos de uso:
     stats = processor.get_stats()
     print(f"Total en base de datos: {stats['total_documents']}")
 
+    if args.rag_service_url and total_chunks > 0:
+        notify_rag_service(args.rag_service_url)
+
     if stats['total_documents'] > 0:
         print("\n✅ Base de conocimiento lista para usar")
         print("\n💡 Prueba una búsqueda:")
@@ -8,436 +8,452 @@ Uso:
 
 Endpoints:
     POST /search         - Busca en base de conocimiento
-    POST /generate       - Genera respuesta con RAG
+    POST /search/batch   - Varias búsquedas en una sola llamada a ChromaDB
+    POST /generate       - Genera respuesta con RAG ("stream": true para SSE)
     GET  /health         - Health check
     GET  /stats          - Estadísticas
+    GET  /metrics        - Métricas en formato Prometheus
+    POST /admin/refresh  - Recuenta documentos tras una ingesta
 """
 
-import os
 import argparse
+import signal
 import sys
-from typing import List, Dict, Optional
 
-try:
-    from flask import Flask, request, jsonify
-    from flask_cors import CORS
-except ImportError:
-    print("❌ Flask no instalado. Ejecuta: pip install flask flask-cors")
+from rag_service.lazy import aiohttp, installed
+
+if not installed('requests'):
+    print("❌ Requests no instalado. Ejecuta: pip install requests")
     sys.exit(1)
 
-try:
-    import chromadb
-except ImportError:
+if not installed('chromadb'):
     print("❌ ChromaDB no instalado. Ejecuta: pip install chromadb")
     sys.exit(1)
 
-try:
-    import requests
-except ImportError:
-    print("❌ Requests no instalado. Ejecuta: pip install requests")
-    sys.exit(1)
+# Después de comprobar las dependencias (el servidor elegido se importa en main)
+from rag_service.api import status_monitor  # noqa: E402
+from rag_service.caching import response_cache, retrieval_cache  # noqa: E402
+from rag_service.llm import init_llm_client  # noqa: E402
+from rag_service.query_log import query_log  # noqa: E402
+from rag_service.resilience import (  # noqa: E402
+    async_generate_admission, async_search_admission, chroma_hedger, generate_admission,
+    search_admission
+)
+from rag_service.retrieval import document_counter, init_bm25_index, init_chromadb  # noqa: E402
+from rag_service.settings import config  # noqa: E402
+from rag_service.startup import startup  # noqa: E402
+from rag_service.warmup import faq_warmup, load_faq_file, load_warm_cache, save_warm_cache  # noqa: E402
+
+
+def init_services() -> None:
+    """Conecta con ChromaDB y el LLM, carga los cachés y arranca el monitor"""
+    # Inicializar ChromaDB y cliente del LLM
+    init_chromadb()
+    if config['bm25_index']:
+        init_bm25_index()
+    init_llm_client()
+
+    # Cachés del arranque anterior
+    if config['warm_cache_file']:
+        try:
+            loaded = load_warm_cache(config['warm_cache_file'])
+            print(f"♨️  Caché persistente: {loaded['retrieval']} búsquedas, "
+                  f"{loaded['responses']} respuestas")
+        except Exception as e:
+            print(f"⚠️  No se pudo cargar el caché persistente: {e}")
+
+    # Precalcular FAQ antes de reportar healthy (el monitor ya ve 'warming')
+    if config['faq_file']:
+        questions = load_faq_file(config['faq_file'])
+        print(f"♨️  Precalculando {len(questions)} preguntas frecuentes en segundo plano")
+        faq_warmup.start(questions, config['faq_concurrency'])
+
+    # Health y stats en segundo plano
+    status_monitor.interval = config['status_interval']
+    status_monitor.start()
 
 
-app = Flask(__name__)
-CORS(app)  # Permitir CORS para requests desde backend Node.js
+def main():
+    startup.imported()
 
-# Configuración global
-config = {
-    'chroma_host': 'localhost',
-    'chroma_port': 8000,
-    'llm_url': 'http://localhost:8080/v1/chat/completions',
-    'llm_api_key': None,
-    'model_id': 'meta-llama/Llama-3.1-8B-Instruct'
-}
+    parser = argparse.ArgumentParser(
+        description="Servicio API REST para RAG con ChromaDB y LLM",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
 
-# Cliente ChromaDB global
-chroma_client = None
-collection = None
+    parser.add_argument(
+        '--chroma-host',
+        type=str,
+        default='localhost',
+        help='Host de ChromaDB (default: localhost)'
+    )
 
+    parser.add_argument(
+        '--chroma-port',
+        type=int,
+        default=8000,
+        help='Puerto de ChromaDB (default: 8000)'
+    )
 
-def init_chromadb():
-    """Inicializa conexión a ChromaDB"""
-    global chroma_client, collection
+    parser.add_argument(
+        '--shards',
+        nargs='+',
+        metavar='HOST:PUERTO/COLECCIÓN',
+        help='Shards de ChromaDB (los de process_adhd_books.py --shards, en el mismo orden); '
+             'cada búsqueda consulta todos en paralelo'
+    )
 
-    try:
-        chroma_client = chromadb.HttpClient(
-            host=config['chroma_host'],
-            port=config['chroma_port']
-        )
+    parser.add_argument(
+        '--shard-timeout',
+        type=float,
+        default=2.0,
+        help='Segundos máximos de espera a cada shard; los que no llegan se omiten (default: 2)'
+    )
 
-        # Test connection
-        chroma_client.heartbeat()
+    parser.add_argument(
+        '--index-dir',
+        type=str,
+        help='Directorio con el índice exportado (process_adhd_books.py --export-index); '
+             'busca en proceso sin consultar a ChromaDB'
+    )
 
-        # Obtener colección
-        collection = chroma_client.get_or_create_collection(
-            name="adhd_knowledge",
-            metadata={
-                "description": "ADHD specialized books and resources",
-                "language": "es"
-            }
-        )
+    parser.add_argument(
+        '--llm-url',
+        type=str,
+        nargs='+',
+        action='extend',
+        required=True,
+        help='URL del LLM (ej: http://IP:8080/v1/chat/completions); '
+             'acepta varias para repartir la carga entre backends'
+    )
 
-        print(f"✅ Conectado a ChromaDB")
-        print(f"   📊 Documentos: {collection.count()}")
+    parser.add_argument(
+        '--llm-api-key',
+        type=str,
+        help='API Key del LLM (si es necesario)'
+    )
 
-    except Exception as e:
-        print(f"❌ Error conectando a ChromaDB: {e}")
-        print("\n💡 Verifica que ChromaDB esté corriendo:")
-        print("   docker ps | grep chromadb")
-        sys.exit(1)
+    parser.add_argument(
+        '--model-id',
+        type=str,
+        default='meta-llama/Llama-3.1-8B-Instruct',
+        help='ID del modelo (default: meta-llama/Llama-3.1-8B-Instruct)'
+    )
 
+    parser.add_argument(
+        '--llm-pool-size',
+        type=int,
+        default=10,
+        help='Conexiones keep-alive al LLM en el pool (default: 10)'
+    )
 
-def search_knowledge(query: str, n_results: int = 3) -> List[Dict]:
-    """
-    Busca en la base de conocimiento
+    parser.add_argument(
+        '--llm-connect-timeout',
+        type=float,
+        default=5.0,
+        help='Timeout de conexión al LLM en segundos (default: 5)'
+    )
 
-    Args:
-        query: Consulta de búsqueda
-        n_results: Número de resultados
+    parser.add_argument(
+        '--llm-read-timeout',
+        type=float,
+        default=30.0,
+        help='Timeout de lectura del LLM en segundos (default: 30)'
+    )
 
-    Returns:
-        Lista de documentos relevantes
-    """
-    if collection is None:
-        raise RuntimeError("ChromaDB no inicializado")
+    parser.add_argument(
+        '--llm-max-retries',
+        type=int,
+        default=2,
+        help='Reintentos ante fallos transitorios del LLM (default: 2)'
+    )
 
-    try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
+    parser.add_argument(
+        '--llm-backoff',
+        type=float,
+        default=0.5,
+        help='Base del backoff exponencial entre reintentos en segundos (default: 0.5)'
+    )
 
-        documents = []
-        for doc, metadata, distance in zip(
-            results['documents'][0],
-            results['metadatas'][0],
-            results['distances'][0]
-        ):
-            documents.append({
-                'text': doc,
-                'metadata': metadata,
-                'relevance': 1 - distance  # Convertir distancia a score de relevancia
-            })
+    parser.add_argument(
+        '--llm-failure-threshold',
+        type=int,
+        default=3,
+        help='Fallos seguidos que abren el circuit breaker de un backend (default: 3)'
+    )
 
-        return documents
+    parser.add_argument(
+        '--llm-reset-timeout',
+        type=float,
+        default=30.0,
+        help='Segundos con el breaker abierto antes de la petición de prueba (default: 30)'
+    )
 
-    except Exception as e:
-        print(f"Error en búsqueda: {e}")
-        return []
-
-
-def generate_with_llm(
-    user_message: str,
-    context_docs: List[Dict],
-    max_tokens: int = 1000,
-    temperature: float = 0.7
-) -> Dict:
-    """
-    Genera respuesta usando LLM con contexto de RAG
-
-    Args:
-        user_message: Mensaje del usuario
-        context_docs: Documentos de contexto desde RAG
-        max_tokens: Máximo de tokens de salida
-        temperature: Temperatura del modelo
-
-    Returns:
-        Dict con respuesta y metadata
-    """
-    # Construir contexto desde documentos
-    if context_docs:
-        context = "\n\n".join([
-            f"Fuente {i+1} ({doc['metadata'].get('source', 'N/A')}, "
-            f"página {doc['metadata'].get('page', doc['metadata'].get('chunk', 'N/A'))}):\n{doc['text']}"
-            for i, doc in enumerate(context_docs)
-        ])
-
-        system_prompt = f"""Eres un asistente especializado en TDAH (Trastorno por Déficit de Atención e Hiperactividad).
-
-Usa el siguiente contexto de libros especializados para responder la pregunta del usuario:
-
-{context}
-
-INSTRUCCIONES:
-- Responde en español
-- Basa tu respuesta en el contexto proporcionado
-- Si la información del contexto no es suficiente, complementa con tu conocimiento general sobre TDAH
-- Sé empático, práctico y claro
-- Usa listas cuando sea apropiado
-- Si mencionas información del contexto, puedes citar la fuente brevemente
-
-Responde la siguiente pregunta del usuario:"""
-    else:
-        system_prompt = """Eres un asistente especializado en TDAH (Trastorno por Déficit de Atención e Hiperactividad).
-
-Responde en español de forma clara, empática y práctica.
-Si no tienes información específica, sé honesto al respecto."""
-
-    # Preparar request al LLM
-    headers = {
-        'Content-Type': 'application/json'
-    }
-
-    if config['llm_api_key']:
-        headers['Authorization'] = f"Bearer {config['llm_api_key']}"
-
-    payload = {
-        "model": config['model_id'],
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ],
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-        "top_p": 0.92,
-        "frequency_penalty": 0.4,
-        "presence_penalty": 0.2
-    }
+    parser.add_argument(
+        '--llm-concurrency',
+        type=int,
+        default=8,
+        help='Máximo de llamadas simultáneas al LLM con --server async (default: 8)'
+    )
 
-    try:
-        response = requests.post(
-            config['llm_url'],
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
+    parser.add_argument(
+        '--status-interval',
+        type=float,
+        default=10.0,
+        help='Segundos entre refrescos en segundo plano de /health y /stats (default: 10)'
+    )
 
-        response.raise_for_status()
+    parser.add_argument(
+        '--log-timings',
+        action='store_true',
+        help='Imprime el desglose de tiempos de cada petición con su request ID'
+    )
 
-        data = response.json()
+    parser.add_argument(
+        '--query-log',
+        type=str,
+        help='Registra una muestra de las peticiones a /search y /generate en este fichero '
+             '(JSON lines, para replay_query_log.py)'
+    )
 
-        return {
-            'response': data['choices'][0]['message']['content'],
-            'model': config['model_id'],
-            'tokens_used': data.get('usage', {}).get('total_tokens', 0),
-            'sources_used': len(context_docs)
-        }
+    parser.add_argument(
+        '--query-log-sample-rate',
+        type=float,
+        default=0.1,
+        help='Fracción de peticiones que se registran (default: 0.1)'
+    )
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error llamando al LLM: {e}")
-        raise
+    parser.add_argument(
+        '--query-log-max-mb',
+        type=float,
+        default=50.0,
+        help='Tamaño en MB a partir del cual se rota el log de consultas (default: 50)'
+    )
 
+    parser.add_argument(
+        '--query-log-backups',
+        type=int,
+        default=5,
+        help='Ficheros rotados del log de consultas que se conservan (default: 5)'
+    )
 
-# === ENDPOINTS ===
+    parser.add_argument(
+        '--query-log-raw-text',
+        action='store_true',
+        help='Guarda el texto de las preguntas en el log de consultas (lo necesita '
+             'replay_query_log.py); por defecto solo su hash y su longitud'
+    )
 
-@app.route('/health', methods=['GET'])
-def health():
-    """Health check"""
-    try:
-        # Verificar ChromaDB
-        chroma_client.heartbeat()
-        chroma_ok = True
-        doc_count = collection.count()
-    except:
-        chroma_ok = False
-        doc_count = 0
-
-    # Verificar LLM
-    try:
-        llm_health_url = config['llm_url'].replace('/v1/chat/completions', '/health')
-        llm_response = requests.get(llm_health_url, timeout=5)
-        llm_ok = llm_response.status_code == 200
-    except:
-        llm_ok = False
-
-    status = 'healthy' if (chroma_ok and llm_ok) else 'degraded'
-
-    return jsonify({
-        'status': status,
-        'chromadb': {
-            'connected': chroma_ok,
-            'documents': doc_count
-        },
-        'llm': {
-            'connected': llm_ok,
-            'url': config['llm_url']
-        }
-    }), 200 if status == 'healthy' else 503
-
-
-@app.route('/stats', methods=['GET'])
-def stats():
-    """Estadísticas de la base de conocimiento"""
-    try:
-        count = collection.count()
+    parser.add_argument(
+        '--context-token-budget',
+        type=int,
+        default=1500,
+        help='Tokens máximos de contexto RAG en el prompt, 0 sin límite (default: 1500)'
+    )
 
-        # Obtener muestra de metadatas
-        if count > 0:
-            sample = collection.get(limit=min(100, count))
-            sources = set(m['source'] for m in sample['metadatas'])
-        else:
-            sources = set()
+    parser.add_argument(
+        '--context-dedup-threshold',
+        type=float,
+        default=0.6,
+        help='Proporción de texto repetido para descartar un chunk (default: 0.6)'
+    )
 
-        return jsonify({
-            'total_documents': count,
-            'unique_sources': len(sources),
-            'sources': sorted(sources)
-        })
+    parser.add_argument(
+        '--bm25-index',
+        type=str,
+        help='Índice BM25 de process_adhd_books.py (ej: ./bm25_index.json); '
+             'activa la búsqueda híbrida BM25 + vectores'
+    )
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-
-@app.route('/search', methods=['POST'])
-def search():
-    """
-    Busca en la base de conocimiento
-
-    Body:
-        {
-            "query": "string",
-            "n_results": 3  # opcional
-        }
-
-    Response:
-        {
-            "documents": [
-                {
-                    "text": "...",
-                    "metadata": {...},
-                    "relevance": 0.95
-                }
-            ],
-            "count": 3
-        }
-    """
-    try:
-        data = request.get_json()
+    parser.add_argument(
+        '--hybrid-weight',
+        type=float,
+        default=0.5,
+        help='Peso de BM25 en la fusión híbrida, 0-1 (0 = solo vectores, default: 0.5)'
+    )
 
-        if not data or 'query' not in data:
-            return jsonify({'error': 'Missing required field: query'}), 400
+    parser.add_argument(
+        '--hybrid-candidates',
+        type=int,
+        default=20,
+        help='Candidatos de cada ranking antes de fusionar (default: 20)'
+    )
 
-        query = data['query']
-        n_results = data.get('n_results', 3)
+    parser.add_argument(
+        '--diversity',
+        type=float,
+        default=0.0,
+        help='Diversidad MMR por defecto para /search y /generate, 0-1 (default: 0 = desactivado)'
+    )
 
-        # Validaciones
-        if not isinstance(query, str) or len(query.strip()) == 0:
-            return jsonify({'error': 'Query must be a non-empty string'}), 400
+    parser.add_argument(
+        '--fetch-k',
+        type=int,
+        default=20,
+        help='Candidatos recuperados para MMR por defecto (default: 20)'
+    )
 
-        if not isinstance(n_results, int) or n_results < 1 or n_results > 10:
-            return jsonify({'error': 'n_results must be between 1 and 10'}), 400
+    parser.add_argument(
+        '--prompt-layout',
+        choices=['classic', 'prefix'],
+        default='classic',
+        help="Disposición del prompt: 'prefix' pone primero las instrucciones fijas "
+             "para aprovechar el prefix cache del LLM (default: classic)"
+    )
 
-        # Buscar
-        documents = search_knowledge(query, n_results)
+    parser.add_argument(
+        '--cache-prompt',
+        action='store_true',
+        help='Enviar "cache_prompt": true al LLM (llama.cpp server)'
+    )
 
-        return jsonify({
-            'documents': documents,
-            'count': len(documents)
-        })
+    parser.add_argument(
+        '--no-coalescing',
+        action='store_true',
+        help='No agrupar búsquedas/generaciones idénticas concurrentes'
+    )
 
-    except Exception as e:
-        print(f"Error en /search: {e}")
-        return jsonify({'error': str(e)}), 500
-
-
-@app.route('/generate', methods=['POST'])
-def generate():
-    """
-    Genera respuesta con RAG
-
-    Body:
-        {
-            "message": "string",
-            "use_rag": true,          # opcional, default true
-            "n_results": 3,           # opcional, default 3
-            "max_tokens": 1000,       # opcional, default 1000
-            "temperature": 0.7        # opcional, default 0.7
-        }
-
-    Response:
-        {
-            "response": "...",
-            "model": "meta-llama/Llama-3.1-8B-Instruct",
-            "tokens_used": 450,
-            "sources_used": 3,
-            "sources": [...]  # si use_rag=true
-        }
-    """
-    try:
-        data = request.get_json()
-
-        if not data or 'message' not in data:
-            return jsonify({'error': 'Missing required field: message'}), 400
-
-        message = data['message']
-        use_rag = data.get('use_rag', True)
-        n_results = data.get('n_results', 3)
-        max_tokens = data.get('max_tokens', 1000)
-        temperature = data.get('temperature', 0.7)
-
-        # Validaciones
-        if not isinstance(message, str) or len(message.strip()) == 0:
-            return jsonify({'error': 'Message must be a non-empty string'}), 400
-
-        # Buscar contexto si RAG está habilitado
-        context_docs = []
-        if use_rag and collection.count() > 0:
-            context_docs = search_knowledge(message, n_results)
-
-        # Generar respuesta
-        result = generate_with_llm(
-            user_message=message,
-            context_docs=context_docs,
-            max_tokens=max_tokens,
-            temperature=temperature
-        )
+    parser.add_argument(
+        '--max-concurrent-generations',
+        type=int,
+        default=8,
+        help='Generaciones simultáneas en /generate, 0 sin límite (default: 8)'
+    )
 
-        # Añadir fuentes si se usó RAG
-        if context_docs:
-            result['sources'] = [
-                {
-                    'source': doc['metadata'].get('source'),
-                    'page': doc['metadata'].get('page', doc['metadata'].get('chunk')),
-                    'relevance': doc['relevance']
-                }
-                for doc in context_docs
-            ]
+    parser.add_argument(
+        '--generation-queue-size',
+        type=int,
+        default=32,
+        help='Peticiones a /generate que pueden esperar hueco; el resto recibe 429 (default: 32)'
+    )
 
-        return jsonify(result)
+    parser.add_argument(
+        '--generation-queue-timeout',
+        type=float,
+        default=10.0,
+        help='Segundos máximos de espera en la cola de /generate antes del 429 (default: 10)'
+    )
 
-    except Exception as e:
-        print(f"Error en /generate: {e}")
-        return jsonify({'error': str(e)}), 500
+    parser.add_argument(
+        '--request-deadline',
+        type=float,
+        default=0.0,
+        help='Deadline por defecto de /generate en segundos si la petición no trae '
+             'deadline_ms ni X-Deadline-Ms; 0 = sin deadline (default: 0)'
+    )
 
+    parser.add_argument(
+        '--retrieval-deadline-share',
+        type=float,
+        default=0.3,
+        help='Fracción del deadline disponible para la búsqueda; si no termina se genera '
+             'sin RAG (default: 0.3)'
+    )
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Servicio API REST para RAG con ChromaDB y LLM",
-        formatter_class=argparse.RawDescriptionHelpFormatter
+    parser.add_argument(
+        '--hedge-percentile',
+        type=float,
+        default=95.0,
+        help='Percentil de latencia de ChromaDB a partir del que se duplica una consulta '
+             '(hedged request); 0 = sin duplicar (default: 95)'
     )
 
     parser.add_argument(
-        '--chroma-host',
-        type=str,
-        default='localhost',
-        help='Host de ChromaDB (default: localhost)'
+        '--max-concurrent-searches',
+        type=int,
+        default=32,
+        help='Búsquedas simultáneas en /search y /search/batch, 0 sin límite (default: 32)'
     )
 
     parser.add_argument(
-        '--chroma-port',
+        '--search-queue-size',
         type=int,
-        default=8000,
-        help='Puerto de ChromaDB (default: 8000)'
+        default=128,
+        help='Búsquedas que pueden esperar hueco; el resto recibe 429 (default: 128)'
     )
 
     parser.add_argument(
-        '--llm-url',
-        type=str,
-        required=True,
-        help='URL del LLM (ej: http://IP:8080/v1/chat/completions)'
+        '--search-queue-timeout',
+        type=float,
+        default=2.0,
+        help='Segundos máximos de espera en la cola de /search antes del 429 (default: 2)'
     )
 
     parser.add_argument(
-        '--llm-api-key',
+        '--snippet-length',
+        type=int,
+        default=200,
+        help='Caracteres de "snippet" en /search si no se indica snippet_length (default: 200)'
+    )
+
+    parser.add_argument(
+        '--gzip-min-size',
+        type=int,
+        default=1024,
+        help='Bytes a partir de los que /search se comprime con gzip si el cliente '
+             'lo acepta, 0 para desactivarlo (default: 1024)'
+    )
+
+    parser.add_argument(
+        '--warm-cache',
         type=str,
-        help='API Key del LLM (si es necesario)'
+        help='Fichero donde guardar los cachés al parar y de donde recargarlos al arrancar '
+             '(ej: ./warm_cache.json)'
     )
 
     parser.add_argument(
-        '--model-id',
+        '--faq-file',
         type=str,
-        default='meta-llama/Llama-3.1-8B-Instruct',
-        help='ID del modelo (default: meta-llama/Llama-3.1-8B-Instruct)'
+        help='Preguntas frecuentes (una por línea) a precalcular antes de reportar healthy'
+    )
+
+    parser.add_argument(
+        '--faq-concurrency',
+        type=int,
+        default=2,
+        help='Preguntas frecuentes que se precalculan a la vez (default: 2)'
+    )
+
+    parser.add_argument(
+        '--response-cache-size',
+        type=int,
+        default=256,
+        help='Máximo de respuestas en caché, 0 para desactivarlo (default: 256)'
+    )
+
+    parser.add_argument(
+        '--response-cache-ttl',
+        type=float,
+        default=3600,
+        help='Segundos de vida de cada respuesta en caché, 0 para desactivarlo (default: 3600)'
+    )
+
+    parser.add_argument(
+        '--retrieval-cache-size',
+        type=int,
+        default=1024,
+        help='Máximo de búsquedas en caché, 0 para desactivarlo (default: 1024)'
+    )
+
+    parser.add_argument(
+        '--retrieval-cache-ttl',
+        type=float,
+        default=3600,
+        help='Segundos de vida de cada búsqueda en caché, 0 para desactivarlo (default: 3600)'
+    )
+
+    parser.add_argument(
+        '--doc-count-max-age',
+        type=float,
+        default=30.0,
+        help='Segundos que se reutiliza el número de documentos cacheado (default: 30)'
+    )
+
+    parser.add_argument(
+        '--max-batch-queries',
+        type=int,
+        default=50,
+        help='Máximo de queries por petición a /search/batch (default: 50)'
     )
 
     parser.add_argument(
@@ -454,40 +470,177 @@ def main():
         help='Host del servicio API (default: 0.0.0.0)'
     )
 
+    parser.add_argument(
+        '--server',
+        choices=['flask', 'async'],
+        default='flask',
+        help='Servidor HTTP: flask (threads) o async (aiohttp) (default: flask)'
+    )
+
+    parser.add_argument(
+        '--fast-start',
+        action='store_true',
+        help="Abrir el puerto antes de conectar con ChromaDB y el LLM; /health responde "
+             "'starting' hasta que terminan de inicializarse en segundo plano"
+    )
+
     args = parser.parse_args()
 
     # Actualizar configuración
     config['chroma_host'] = args.chroma_host
     config['chroma_port'] = args.chroma_port
-    config['llm_url'] = args.llm_url
+    config['index_dir'] = args.index_dir
+    config['shards'] = args.shards or []
+    config['shard_timeout'] = max(args.shard_timeout, 0.1)
+    config['bm25_index'] = args.bm25_index
+    config['hybrid_weight'] = min(max(args.hybrid_weight, 0.0), 1.0)
+    config['hybrid_candidates'] = max(args.hybrid_candidates, 1)
+    config['diversity'] = min(max(args.diversity, 0.0), 1.0)
+    config['fetch_k'] = min(max(args.fetch_k, 1), 50)
+    config['prompt_layout'] = args.prompt_layout
+    config['llm_cache_prompt'] = args.cache_prompt
+    config['llm_urls'] = args.llm_url
+    config['llm_url'] = args.llm_url[0]
     config['llm_api_key'] = args.llm_api_key
     config['model_id'] = args.model_id
+    config['llm_pool_size'] = args.llm_pool_size
+    config['llm_connect_timeout'] = args.llm_connect_timeout
+    config['llm_read_timeout'] = args.llm_read_timeout
+    config['llm_max_retries'] = args.llm_max_retries
+    config['llm_backoff'] = args.llm_backoff
+    config['llm_failure_threshold'] = args.llm_failure_threshold
+    config['llm_reset_timeout'] = args.llm_reset_timeout
+    config['llm_concurrency'] = args.llm_concurrency
+    config['status_interval'] = args.status_interval
+    config['log_timings'] = args.log_timings
+    config['query_log_file'] = args.query_log
+    config['query_log_sample_rate'] = min(max(args.query_log_sample_rate, 0.0), 1.0)
+    config['query_log_max_bytes'] = max(int(args.query_log_max_mb * 1024 * 1024), 0)
+    config['query_log_backups'] = max(args.query_log_backups, 0)
+    config['query_log_raw_text'] = args.query_log_raw_text
+    config['context_token_budget'] = args.context_token_budget
+    config['context_dedup_threshold'] = args.context_dedup_threshold
+    config['coalesce_requests'] = not args.no_coalescing
+    config['max_concurrent_generations'] = max(args.max_concurrent_generations, 0)
+    config['generation_queue_size'] = max(args.generation_queue_size, 0)
+    config['generation_queue_timeout'] = max(args.generation_queue_timeout, 0.0)
+    config['request_deadline'] = max(args.request_deadline, 0.0)
+    config['retrieval_deadline_share'] = min(max(args.retrieval_deadline_share, 0.0), 1.0)
+    config['hedge_percentile'] = min(max(args.hedge_percentile, 0.0), 99.9)
+    config['max_concurrent_searches'] = max(args.max_concurrent_searches, 0)
+    config['search_queue_size'] = max(args.search_queue_size, 0)
+    config['search_queue_timeout'] = max(args.search_queue_timeout, 0.0)
+    config['snippet_length'] = min(max(args.snippet_length, 20), 2000)
+    config['gzip_min_size'] = max(args.gzip_min_size, 0)
+    config['warm_cache_file'] = args.warm_cache
+    config['faq_file'] = args.faq_file
+    config['faq_concurrency'] = max(args.faq_concurrency, 1)
+    config['response_cache_size'] = args.response_cache_size
+    config['response_cache_ttl'] = args.response_cache_ttl
+    config['retrieval_cache_size'] = args.retrieval_cache_size
+    config['retrieval_cache_ttl'] = args.retrieval_cache_ttl
+    config['doc_count_max_age'] = args.doc_count_max_age
+    config['max_batch_queries'] = args.max_batch_queries
+
+    if args.server == 'async' and aiohttp is None:
+        print("❌ aiohttp no instalado. Ejecuta: pip install aiohttp")
+        sys.exit(1)
+    if args.server != 'async' and not (installed('flask') and installed('flask_cors')):
+        print("❌ Flask no instalado. Ejecuta: pip install flask flask-cors")
+        sys.exit(1)
+
+    # Solo se importa el servidor elegido: --server async no carga Flask
+    if args.server == 'async':
+        from rag_service.lazy import web
+        from rag_service.server_async import create_async_app
+    else:
+        from rag_service.server_flask import app
+
+    response_cache.max_size = config['response_cache_size']
+    response_cache.ttl = config['response_cache_ttl']
+    retrieval_cache.max_size = config['retrieval_cache_size']
+    retrieval_cache.ttl = config['retrieval_cache_ttl']
+    document_counter.max_age = config['doc_count_max_age']
+    chroma_hedger.percentile = config['hedge_percentile']
+    for controller in (generate_admission, async_generate_admission):
+        controller.limit = config['max_concurrent_generations']
+        controller.max_queue = config['generation_queue_size']
+        controller.max_wait = config['generation_queue_timeout']
+    for controller in (search_admission, async_search_admission):
+        controller.limit = config['max_concurrent_searches']
+        controller.max_queue = config['search_queue_size']
+        controller.max_wait = config['search_queue_timeout']
+    if config['query_log_file']:
+        query_log.configure(
+            config['query_log_file'],
+            config['query_log_sample_rate'],
+            config['query_log_max_bytes'],
+            config['query_log_backups'],
+            config['query_log_raw_text']
+        )
 
     print("\n🚀 RAG API Service para TDAH Focus App")
     print("=" * 60)
-    print(f"ChromaDB: {config['chroma_host']}:{config['chroma_port']}")
-    print(f"LLM: {config['llm_url']}")
+    if config['index_dir']:
+        print(f"Índice local: {config['index_dir']}")
+    elif config['shards']:
+        print(f"ChromaDB: {len(config['shards'])} shards (timeout {config['shard_timeout']:g}s)")
+    else:
+        print(f"ChromaDB: {config['chroma_host']}:{config['chroma_port']}")
+    print(f"LLM: {', '.join(config['llm_urls'])}")
     print(f"Modelo: {config['model_id']}")
     print(f"Puerto API: {args.port}")
+    print(f"Servidor: {args.server}")
     print("=" * 60)
 
-    # Inicializar ChromaDB
-    init_chromadb()
+    # ChromaDB, LLM, cachés y monitor (con --fast-start, después de abrir el puerto)
+    if args.fast_start:
+        startup.fast_start = True
+        startup.run_in_background(init_services)
+    else:
+        init_services()
+        startup.mark_ready()
 
     # Iniciar servidor
-    print(f"\n✅ Servicio listo en http://{args.host}:{args.port}")
+    if args.fast_start:
+        print(f"\n⚡ Escuchando en http://{args.host}:{args.port} "
+              f"(/health responde 'starting' hasta terminar la inicialización)")
+    else:
+        print(f"\n✅ Servicio listo en http://{args.host}:{args.port} ({startup.ready_seconds:.2f}s)")
     print("\nEndpoints disponibles:")
     print(f"  GET  http://{args.host}:{args.port}/health")
     print(f"  GET  http://{args.host}:{args.port}/stats")
+    print(f"  GET  http://{args.host}:{args.port}/metrics")
     print(f"  POST http://{args.host}:{args.port}/search")
+    print(f"  POST http://{args.host}:{args.port}/search/batch")
     print(f"  POST http://{args.host}:{args.port}/generate")
+    print(f"  POST http://{args.host}:{args.port}/admin/refresh")
     print("\nPresiona Ctrl+C para detener\n")
 
-    app.run(
-        host=args.host,
-        port=args.port,
-        debug=False
-    )
+    if args.server != 'async':
+        # SIGTERM (docker stop, systemd) sale ordenadamente para guardar el caché
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        if args.server == 'async':
+            web.run_app(
+                create_async_app(),
+                host=args.host,
+                port=args.port,
+                print=None
+            )
+        else:
+            app.run(
+                host=args.host,
+                port=args.port,
+                debug=False
+            )
+    finally:
+        query_log.close()
+        # Si se detiene durante el arranque, no pisar el caché guardado con uno a medio cargar
+        if config['warm_cache_file'] and startup.ready:
+            saved = save_warm_cache(config['warm_cache_file'])
+            print(f"\n♨️  Caché persistente guardado: {saved} entradas en {config['warm_cache_file']}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+"""Paquete del servicio RAG: rag_api_service.py es el punto de entrada"""
+
+import time
+
+
+# Inicio de la importación del módulo (tiempos de arranque en /health → startup)
+MODULE_START = time.perf_counter()
@@ -0,0 +1,622 @@
+"""Lógica común de los endpoints Flask y asíncronos: respuestas, health/stats y pipeline de generación"""
+
+import functools
+import gzip
+import json
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from typing import Any, List, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Opcional: JSON más rápido en /search
+
+from .bm25 import tokenize
+from .caching import (
+    async_generation_flight, async_stream_flight, generation_flight, response_cache,
+    response_cache_key, retrieval_cache, retrieval_flight, stream_flight
+)
+from .llm import format_sources
+from .local_index import LocalVectorIndex
+from .metrics import format_labels, metrics, timed, track_request_timings
+from .packing import context_tokens, pack_context
+from .query_log import query_log
+from .resilience import (
+    AdmissionController, DeadlineExceeded, Hedger, async_generate_admission, async_search_admission,
+    chroma_hedger, generate_admission, search_admission
+)
+from .retrieval import document_counter, init_bm25_index, search_knowledge
+from .settings import config
+from .sharding import ShardedCollection
+from .sse import sse_event
+from .startup import startup
+from . import llm
+from . import retrieval
+
+
+def begin_request_timing(request_id: Optional[str]) -> Tuple[str, Dict[str, float], float]:
+    """Inicia el desglose de tiempos de una petición; devuelve (id, timings, inicio)"""
+    timings = track_request_timings()
+    return request_id or uuid.uuid4().hex[:16], timings, time.perf_counter()
+
+
+def end_request_timing(
+    request_id: str,
+    method: str,
+    path: str,
+    endpoint: str,
+    status_code: int,
+    timings: Dict[str, float],
+    start: float,
+    query_params: Optional[Dict] = None
+) -> None:
+    """
+    Registra la latencia del endpoint y, con --log-timings, el desglose
+
+    `query_params` es el body de una petición muestreada para el log de
+    consultas (None si no se registra).
+    """
+    elapsed = time.perf_counter() - start
+    metrics.observe('rag_http_request_duration_seconds', elapsed, endpoint=endpoint, method=method)
+    metrics.inc('rag_http_requests_total', endpoint=endpoint, method=method, status=status_code)
+
+    if config['log_timings']:
+        stages = " ".join(f"{stage}={value * 1000:.1f}ms" for stage, value in timings.items())
+        print(f"[{request_id}] {method} {path} {status_code} total={elapsed * 1000:.1f}ms {stages}".rstrip())
+
+    if query_params is not None:
+        try:
+            query_log.write({
+                'ts': round(time.time() - elapsed, 3),
+                'id': request_id,
+                'endpoint': endpoint,
+                'status': status_code,
+                'total_ms': round(elapsed * 1000, 1),
+                'stages_ms': {stage: round(value * 1000, 1) for stage, value in timings.items()},
+                'sample_rate': query_log.sample_rate,
+                'params': query_log.loggable_params(query_params)
+            })
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error escribiendo el log de consultas: {e}")
+
+
+def render_metrics() -> str:
+    """Métricas registradas + contadores de cachés y del cliente del LLM"""
+    lines = [metrics.render().rstrip('\n')]
+
+    cache_metrics = [
+        ('rag_cache_hits_total', 'counter', 'hits'),
+        ('rag_cache_misses_total', 'counter', 'misses'),
+        ('rag_cache_evictions_total', 'counter', 'evictions'),
+        ('rag_cache_entries', 'gauge', 'size')
+    ]
+    caches = {'responses': response_cache.stats(), 'retrieval': retrieval_cache.stats()}
+    for name, kind, field in cache_metrics:
+        lines.append(f"# TYPE {name} {kind}")
+        for cache_name, cache_stats in caches.items():
+            lines.append(f'{name}{{cache="{cache_name}"}} {cache_stats[field]}')
+
+    client = llm.async_llm if llm.async_llm is not None else llm.llm_http
+    client_stats = client.stats()
+    for field in ('requests', 'retries', 'failures'):
+        lines.append(f"# TYPE rag_llm_client_{field}_total counter")
+        lines.append(f"rag_llm_client_{field}_total {client_stats[field]}")
+
+    backend_metrics = [
+        ('rag_llm_backend_requests_total', 'counter', lambda b: b['requests']),
+        ('rag_llm_backend_failures_total', 'counter', lambda b: b['failures']),
+        ('rag_llm_backend_in_flight', 'gauge', lambda b: b['in_flight']),
+        # 0 = closed, 1 = half_open, 2 = open
+        ('rag_llm_backend_circuit_state', 'gauge',
+         lambda b: ('closed', 'half_open', 'open').index(b['state']))
+    ]
+    backends = llm.llm_backends.status()
+    for name, kind, value in backend_metrics:
+        lines.append(f"# TYPE {name} {kind}")
+        for backend in backends:
+            lines.append(f'{name}{format_labels((), backend=backend["url"])} {value(backend)}')
+
+    admission = {name: c.stats() for name, c in admission_controllers().items()}
+    for name, field in (('rag_admission_active', 'active'), ('rag_admission_queued', 'queued')):
+        lines.append(f"# TYPE {name} gauge")
+        for endpoint, admission_stats in admission.items():
+            lines.append(f'{name}{format_labels((), endpoint=endpoint)} {admission_stats[field]}')
+
+    lines.append("# TYPE rag_ready gauge")
+    lines.append(f"rag_ready {int(startup.ready)}")
+    lines.append("# TYPE rag_startup_seconds gauge")
+    for phase, elapsed in (('import', startup.import_seconds), ('ready', startup.ready_seconds)):
+        if elapsed is not None:
+            lines.append(f'rag_startup_seconds{format_labels((), phase=phase)} {elapsed:.3f}')
+
+    return "\n".join(lines) + "\n"
+
+
+def search_response(documents: List[Dict]) -> Dict:
+    return {
+        'documents': documents,
+        'count': len(documents)
+    }
+
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def fold_term(word: str) -> str:
+    """Normaliza una palabra como `tokenize` (minúsculas, sin tildes)"""
+    word = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(c for c in word if not unicodedata.combining(c))
+
+
+def make_snippet(text: str, terms: set, length: int) -> str:
+    """
+    Fragmento de hasta `length` caracteres centrado en los términos de la query
+
+    Elige la ventana que contiene más apariciones de `terms` (términos de
+    `tokenize`), la ajusta a límites de palabra y marca los cortes con '…'.
+    Sin coincidencias devuelve el inicio del texto.
+    """
+    if len(text) <= length:
+        return text
+
+    matches = [
+        (m.start(), m.end()) for m in WORD_PATTERN.finditer(text)
+        if fold_term(m.group()) in terms
+    ]
+
+    # Ventana deslizante sobre las coincidencias: la que cubre más en `length`
+    span_start, span_end, best, first = 0, 0, 0, 0
+    for last in range(len(matches)):
+        while matches[last][1] - matches[first][0] > length:
+            first += 1
+        if last - first + 1 > best:
+            best = last - first + 1
+            span_start, span_end = matches[first][0], matches[last][1]
+
+    start = max(0, span_start - (length - (span_end - span_start)) // 2) if best else 0
+    end = min(len(text), start + length)
+    start = max(0, end - length)
+
+    # Cortar en espacios para no partir palabras
+    if start > 0:
+        space = text.find(' ', start, span_start if best else end)
+        if space != -1:
+            start = space + 1
+    if end < len(text):
+        space = text.rfind(' ', max(start, span_end), end)
+        if space != -1:
+            end = space
+
+    return ('…' if start > 0 else '') + text[start:end].strip() + ('…' if end < len(text) else '')
+
+
+def compact_documents(
+    documents: List[Dict],
+    query: str,
+    fields: Optional[Tuple[str, ...]],
+    snippet_length: int
+) -> List[Dict]:
+    """Documentos de /search reducidos a `fields` (sin cambios si fields es None)"""
+    if fields is None:
+        return documents
+
+    terms = set(tokenize(query)) if 'snippet' in fields else set()
+    compact = []
+    for doc in documents:
+        metadata = doc.get('metadata') or {}
+        item = {}
+        for field in fields:
+            if field == 'snippet':
+                item['snippet'] = make_snippet(doc['text'], terms, snippet_length)
+            elif field == 'source':
+                item['source'] = metadata.get('source')
+            elif field == 'page':
+                item['page'] = metadata.get('page', metadata.get('chunk'))
+            else:
+                item[field] = doc.get(field)
+        compact.append(item)
+
+    return compact
+
+
+def encode_json(body: Any) -> bytes:
+    """JSON compacto en UTF-8 (con orjson si está instalado)"""
+    if orjson is not None:
+        return orjson.dumps(body)
+    return json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """True si el header Accept-Encoding admite gzip (sin q=0)"""
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip() in ('gzip', '*'):
+            q = params.strip()
+            if not q.startswith('q='):
+                return True
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def json_payload(body: Any, accept_encoding: Optional[str]) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Body JSON codificado y sus headers
+
+    Se comprime con gzip si el cliente lo acepta y ocupa al menos
+    --gzip-min-size bytes (0 lo desactiva).
+    """
+    data = encode_json(body)
+    headers = {'Content-Type': 'application/json', 'Vary': 'Accept-Encoding'}
+
+    min_size = config['gzip_min_size']
+    if min_size > 0 and len(data) >= min_size and accepts_gzip(accept_encoding):
+        data = gzip.compress(data, compresslevel=5)
+        headers['Content-Encoding'] = 'gzip'
+
+    return data, headers
+
+
+def search_batch_response(
+    queries: List[Tuple[str, int]],
+    batch_results: List[List[Dict]]
+) -> Dict:
+    return {
+        'results': [
+            {
+                'query': query,
+                'documents': documents,
+                'count': len(documents)
+            }
+            for (query, _), documents in zip(queries, batch_results)
+        ],
+        'count': len(batch_results)
+    }
+
+
+def check_chromadb() -> Tuple[bool, int]:
+    """Devuelve (conectado, documentos) de ChromaDB"""
+    try:
+        if retrieval.chroma_client is not None:
+            retrieval.chroma_client.heartbeat()
+        count = retrieval.collection.count()
+        document_counter.set(count)
+        return True, count
+    except Exception:
+        return False, 0
+
+
+def health_response(chroma_ok: bool, doc_count: int, llm_ok: bool) -> Tuple[Dict, int]:
+    """Body y código HTTP de /health ('warming' mientras se precalculan las FAQ)"""
+    from .warmup import faq_warmup  # warmup usa el pipeline de este módulo
+
+    status = 'healthy' if (chroma_ok and llm_ok) else 'degraded'
+    if status == 'healthy' and faq_warmup.running:
+        status = 'warming'
+
+    body = {
+        'status': status,
+        'chromadb': {
+            'connected': chroma_ok,
+            'documents': doc_count
+        },
+        'llm': {
+            'connected': llm_ok,
+            'url': config['llm_url'],
+            'backends': llm.llm_backends.status()
+        }
+    }
+    if isinstance(retrieval.collection, ShardedCollection):
+        body['chromadb']['shards'] = retrieval.collection.status()
+    if faq_warmup.total:
+        body['warmup'] = faq_warmup.status()
+
+    return body, 200 if status == 'healthy' else 503
+
+
+def probe_llm() -> bool:
+    """Comprueba el /health de cada backend del LLM (sin reintentos); True si alguno responde"""
+    for backend in llm.llm_backends.backends:
+        start = time.perf_counter()
+        try:
+            llm_response = llm.llm_http.get(
+                backend.health_url,
+                timeout=(llm.llm_http.connect_timeout, 5),
+                max_retries=0
+            )
+            ok = llm_response.status_code == 200
+        except Exception:
+            ok = False
+        llm.llm_backends.record_probe(backend, ok, time.perf_counter() - start)
+
+    return any(backend.probe_ok for backend in llm.llm_backends.backends)
+
+
+def collect_collection_stats() -> Dict:
+    """Estadísticas de la colección (documentos y fuentes)"""
+    count = retrieval.collection.count()
+    document_counter.set(count)
+
+    # Obtener muestra de metadatas (sin textos ni embeddings)
+    if count > 0:
+        sample = retrieval.collection.get(limit=min(100, count), include=['metadatas'])
+        sources = set(m['source'] for m in sample['metadatas'])
+    else:
+        sources = set()
+
+    return {
+        'total_documents': count,
+        'unique_sources': len(sources),
+        'sources': sorted(sources)
+    }
+
+
+def stats_response(collection_stats: Dict, age: float) -> Dict:
+    """Body de /stats: estadísticas de la colección + contadores en vivo"""
+    return dict(
+        collection_stats,
+        age_seconds=round(age, 3),
+        cache={
+            'responses': response_cache.stats(),
+            'retrieval': retrieval_cache.stats()
+        },
+        llm_client=llm.llm_http.stats(),
+        coalesced={
+            'retrieval': retrieval_flight.coalesced,
+            'generate': generation_flight.coalesced + async_generation_flight.coalesced,
+            'stream': stream_flight.coalesced + async_stream_flight.coalesced
+        },
+        admission={name: c.stats() for name, c in admission_controllers().items()},
+        hedging=[hedger.stats() for hedger in active_hedgers()],
+        query_log=query_log.stats()
+    )
+
+
+def active_hedgers() -> List[Hedger]:
+    """Hedgers de las consultas a ChromaDB en uso (uno por shard con --shards)"""
+    if isinstance(retrieval.collection, ShardedCollection):
+        return [shard.hedger for shard in retrieval.collection.shards]
+    if retrieval.chroma_client is not None:
+        return [chroma_hedger]
+    return []
+
+
+def admission_controllers() -> Dict[str, 'AdmissionController']:
+    """Control de admisión del servidor en marcha (Flask o asíncrono)"""
+    if llm.async_llm is not None:
+        return {'generate': async_generate_admission, 'search': async_search_admission}
+    return {'generate': generate_admission, 'search': search_admission}
+
+
+class StatusMonitor:
+    """
+    Refresca en segundo plano el estado de ChromaDB/LLM y las estadísticas
+
+    /health y /stats sirven el último snapshot con su antigüedad en lugar de
+    consultar ChromaDB y el LLM en cada petición. Mientras el monitor no esté
+    corriendo, `health()` y `stats()` devuelven None y los endpoints hacen la
+    comprobación en vivo.
+    """
+
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self._health: Optional[Tuple[Dict, int, float]] = None
+        self._stats: Optional[Tuple[Dict, float]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Primer refresco síncrono y luego uno cada `interval` segundos"""
+        self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='status-monitor', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def refresh(self) -> None:
+        try:
+            self.refresh_health()
+        except Exception as e:
+            print(f"Error refrescando health: {e}")
+        try:
+            self.refresh_stats()
+        except Exception as e:
+            print(f"Error refrescando stats: {e}")
+
+    def refresh_health(self) -> Tuple[Dict, int]:
+        chroma_ok, doc_count = check_chromadb()
+        body, status_code = health_response(chroma_ok, doc_count, probe_llm())
+        self.store_health(body, status_code)
+        return body, status_code
+
+    def store_health(self, body: Dict, status_code: int) -> None:
+        with self._lock:
+            self._health = (body, status_code, time.monotonic())
+
+    def refresh_stats(self) -> Dict:
+        collection_stats = collect_collection_stats()
+        with self._lock:
+            self._stats = (collection_stats, time.monotonic())
+        return collection_stats
+
+    def health(self) -> Optional[Tuple[Dict, int, float]]:
+        """(body, status_code, antigüedad en segundos) del último health check"""
+        with self._lock:
+            if not self.running or self._health is None:
+                return None
+            body, status_code, updated_at = self._health
+        return body, status_code, time.monotonic() - updated_at
+
+    def stats(self) -> Optional[Tuple[Dict, float]]:
+        """(estadísticas de la colección, antigüedad en segundos)"""
+        with self._lock:
+            if not self.running or self._stats is None:
+                return None
+            collection_stats, updated_at = self._stats
+        return collection_stats, time.monotonic() - updated_at
+
+
+# Monitor global de health/stats (se arranca en main)
+status_monitor = StatusMonitor(interval=config['status_interval'])
+
+
+def refresh_document_count() -> Dict:
+    """Recuenta los documentos y vacía los cachés si la colección cambió"""
+    previous = document_counter.cached
+    if isinstance(retrieval.collection, LocalVectorIndex):
+        retrieval.collection.load()  # Recoger una exportación nueva del índice
+    if config['bm25_index']:
+        init_bm25_index()
+    count = document_counter.refresh()
+    retrieval_cache.validate(count)
+    response_cache.validate((count, config['model_id']))
+
+    return {
+        'documents': count,
+        'previous': previous,
+        'changed': previous is not None and previous != count
+    }
+
+
+def prepare_generation(params: Dict) -> Tuple[List[Dict], Optional[Tuple], Optional[Dict]]:
+    """
+    Recuperación de contexto y consulta al caché de respuestas para /generate
+
+    Returns:
+        Tuple (context_docs, cache_key, respuesta_cacheada)
+        cache_key es None si el caché no aplica a esta petición.
+    """
+    # Buscar contexto si RAG está habilitado
+    doc_count = document_counter.get()
+    context_docs = []
+    fallback = False
+    if params['use_rag'] and doc_count > 0:
+        search = functools.partial(
+            search_knowledge,
+            params['message'],
+            params['n_results'],
+            doc_count,
+            diversity=params['diversity'],
+            fetch_k=params['fetch_k'],
+            where=params['where']
+        )
+        if params['deadline'] is None:
+            context_docs = search()
+        else:
+            budget = (params['deadline'] - time.monotonic()) * config['retrieval_deadline_share']
+            try:
+                context_docs = search(deadline=time.monotonic() + budget)
+            except DeadlineExceeded:
+                # Búsqueda lenta: se responde sin RAG (y sin cachear la respuesta)
+                metrics.inc('rag_deadline_exceeded_total', stage='retrieval')
+                context_docs = []
+                fallback = True
+
+    # Caché de respuestas (se invalida si cambia la colección o el modelo)
+    cache_key = None
+    cached = None
+    if params['use_cache'] and response_cache.enabled and not fallback:
+        response_cache.validate((doc_count, config['model_id']))
+        cache_key = response_cache_key(
+            params['message'],
+            params['n_results'],
+            params['max_tokens'],
+            params['temperature'],
+            context_docs,
+            params['context_token_budget'],
+            params['where']
+        )
+        cached = response_cache.get(cache_key)
+
+    if cached is None and context_docs:
+        with timed('context_pack'):
+            context_docs = pack_context(
+                context_docs,
+                params['context_token_budget'],
+                config['context_dedup_threshold']
+            )
+
+    return context_docs, cache_key, cached
+
+
+def coalescing_key(params: Dict, context_docs: List[Dict]) -> Optional[Tuple]:
+    """
+    Clave para agrupar generaciones idénticas en curso, o None si no aplica
+
+    No se agrupan peticiones con "cache": false, que piden una generación nueva.
+    """
+    if not config['coalesce_requests'] or not params['use_cache']:
+        return None
+
+    return response_cache_key(
+        params['message'],
+        params['n_results'],
+        params['max_tokens'],
+        params['temperature'],
+        context_docs,
+        params['context_token_budget'],
+        params['where']
+    )
+
+
+def finish_generation(
+    result: Dict,
+    context_docs: List[Dict],
+    cache_key: Optional[Tuple]
+) -> Dict:
+    """Añade fuentes a la respuesta del LLM y la guarda en caché"""
+    result['context_tokens'] = context_tokens(context_docs)
+    if context_docs:
+        result['sources'] = format_sources(context_docs)
+
+    if cache_key is not None:
+        response_cache.set(cache_key, result)
+
+    return result
+
+
+def finish_stream(
+    summary: Dict,
+    tokens: List[str],
+    context_docs: List[Dict],
+    cache_key: Optional[Tuple]
+) -> Dict:
+    """Metadata del evento 'done' de un stream; guarda la respuesta en caché"""
+    done = {k: v for k, v in summary.items() if k != 'done'}
+    done['context_tokens'] = context_tokens(context_docs)
+    if context_docs:
+        done['sources'] = format_sources(context_docs)
+
+    if cache_key is not None:
+        response_cache.set(cache_key, dict(done, response="".join(tokens)))
+
+    return done
+
+
+def cached_stream_events(cached: Dict) -> List[str]:
+    """Eventos SSE para un acierto del caché: un único token y el evento 'done'"""
+    done = {k: v for k, v in cached.items() if k != 'response'}
+    done['cached'] = True
+    return [
+        sse_event({'token': cached['response']}),
+        sse_event(done, event='done')
+    ]
@@ -0,0 +1,91 @@
+"""Índice BM25 para la búsqueda híbrida"""
+
+import heapq
+import json
+import math
+import re
+import unicodedata
+from typing import List, Dict, Tuple
+
+
+# === BÚSQUEDA HÍBRIDA (BM25 + vectores) ===
+
+# process_adhd_books.py importa estos valores para construir el índice
+BM25_INDEX_VERSION = 1
+TOKEN_PATTERN = re.compile(r'\w+')
+STOPWORDS = frozenset("""
+    a al algo algunas algunos ante antes como con contra cual cuando de del
+    desde donde durante e el ella ellas ellos en entre era es esa esas ese eso
+    esos esta estas este esto estos fue ha han hay hasta la las le les lo los
+    mas me mi muy nada ni no nos o otra otras otro otros para pero poco por
+    porque que quien se ser si sin sobre son su sus tambien te tiene todo
+    todos tu un una uno unos y ya yo
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Términos para BM25: minúsculas, sin tildes, sin stopwords ni letras sueltas"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return [
+        term for term in TOKEN_PATTERN.findall(text)
+        if len(term) > 1 and term not in STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 construido por process_adhd_books.py al ingerir
+
+    Formato en disco (JSON): `ids` y `lengths` por chunk y `postings` con, por
+    término, una lista plana [posición, tf, posición, tf, ...].
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, path: str):
+        self.path = path
+        self.load()
+
+    def load(self) -> None:
+        """(Re)carga el índice desde disco"""
+        with open(self.path, encoding='utf-8') as f:
+            data = json.load(f)
+
+        if data.get('version') != BM25_INDEX_VERSION:
+            raise ValueError(f"versión de índice BM25 no soportada: {data.get('version')}")
+
+        lengths = data['lengths']
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+        self.ids, self.lengths, self.postings, self.avg_length = (
+            data['ids'], lengths, data['postings'], avg_length
+        )
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, n_results: int) -> List[Tuple[str, float]]:
+        """Top `n_results` chunks por BM25 como lista de (id, score)"""
+        ids, lengths, postings, avg_length = (
+            self.ids, self.lengths, self.postings, self.avg_length
+        )
+        total = len(ids)
+        scores: Dict[int, float] = {}
+
+        for term in set(tokenize(query)):
+            posting = postings.get(term)
+            if not posting:
+                continue
+
+            df = len(posting) // 2
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+
+            for i in range(0, len(posting), 2):
+                position, tf = posting[i], posting[i + 1]
+                norm = tf + self.K1 * (1 - self.B + self.B * lengths[position] / avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * tf * (self.K1 + 1) / norm
+
+        top = heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+        return [(ids[position], score) for position, score in top]
@@ -0,0 +1,489 @@
+"""Cachés LRU con TTL y agrupación de peticiones concurrentes (single-flight)"""
+
+import asyncio
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextvars import copy_context
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Hashable, List, Dict, Iterator, Optional, Tuple
+)
+
+from .metrics import metrics
+from .resilience import DeadlineExceeded, time_left
+from .settings import config
+from .sse import sse_event
+
+
+class LRUCache:
+    """
+    Caché LRU thread-safe con tamaño máximo y TTL
+
+    Cada entrada expira `ttl` segundos después de guardarse. Al superar
+    `max_size` se descarta la entrada usada hace más tiempo. El caché se
+    vacía cuando cambia su fingerprint (ver `validate`). Con `max_size` o
+    `ttl` a 0 está desactivado: no guarda nada ni cuenta fallos.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._fingerprint: Optional[Hashable] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def validate(self, fingerprint: Hashable) -> None:
+        """Vacía el caché si cambió el estado del que dependen sus entradas"""
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                if self._data:
+                    self.invalidations += 1
+                self._data.clear()
+                self._fingerprint = fingerprint
+
+    def get(
+        self,
+        key: Hashable,
+        usable: Optional[Callable[[Any], bool]] = None
+    ) -> Optional[Any]:
+        """
+        Devuelve el valor guardado o None
+
+        Si se pasa `usable`, una entrada para la que devuelve False cuenta
+        como fallo (p.ej. un resultado con menos documentos de los pedidos).
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            if usable is not None and not usable(value):
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def snapshot(self) -> Tuple[Optional[Hashable], List[Tuple[Hashable, float, Any]]]:
+        """(fingerprint, [(clave, segundos de vida restantes, valor), ...]) en orden LRU"""
+        now = time.monotonic()
+        with self._lock:
+            return self._fingerprint, [
+                (key, expires_at - now, value)
+                for key, (expires_at, value) in self._data.items()
+                if expires_at > now
+            ]
+
+    def restore(self, fingerprint: Hashable, entries: List[Tuple[Hashable, float, Any]]) -> int:
+        """Carga entradas de un snapshot ya validado; devuelve cuántas quedan"""
+        if not self.enabled:
+            return 0
+
+        now = time.monotonic()
+        with self._lock:
+            self._fingerprint = fingerprint
+            for key, ttl_left, value in entries:
+                if ttl_left > 0:
+                    self._data[key] = (now + min(ttl_left, self.ttl), value)
+                    self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return len(self._data)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+# Caché de respuestas de /generate
+response_cache = LRUCache(
+    max_size=config['response_cache_size'],
+    ttl=config['response_cache_ttl']
+)
+
+# Caché de resultados de búsqueda (query normalizada -> documentos)
+retrieval_cache = LRUCache(
+    max_size=config['retrieval_cache_size'],
+    ttl=config['retrieval_cache_ttl']
+)
+
+
+# === AGRUPACIÓN DE PETICIONES CONCURRENTES (single-flight) ===
+
+class _FlightCall:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave en una sola ejecución
+
+    La primera llamada ejecuta `func`; las que llegan mientras está en curso
+    esperan y reciben el mismo resultado (o la misma excepción). Con
+    `deadline`, una llamada agrupada deja de esperar al vencer y lanza
+    DeadlineExceeded(stage); la ejecución sigue para las demás.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _FlightCall] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self,
+        key: Hashable,
+        func: Callable[[], Any],
+        deadline: Optional[float] = None,
+        stage: str = 'coalescing'
+    ) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _FlightCall()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            metrics.inc('rag_coalesced_requests_total', kind=self.name)
+            if not call.event.wait(time_left(deadline)):
+                raise DeadlineExceeded(stage)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class StreamBroadcast:
+    """Eventos de un stream compartido; cada suscriptor los recibe todos desde el inicio"""
+
+    def __init__(self):
+        self.events: List[str] = []
+        self.done = False
+        self._cond = threading.Condition()
+
+    def publish(self, event: str) -> None:
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    def subscribe(self) -> Iterator[str]:
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self.events) and not self.done:
+                    self._cond.wait()
+                batch = self.events[position:]
+                position = len(self.events)
+                if not batch and self.done:
+                    return
+            yield from batch
+
+
+class StreamFlight:
+    """
+    Single-flight para respuestas SSE
+
+    El stream lo produce un thread propio (no depende de que el primer
+    cliente siga conectado) y se reparte a todos los suscriptores.
+
+    `admit` se llama solo en la petición que produce el stream (p.ej. para
+    ocupar un hueco de admisión) y devuelve la función a llamar cuando el
+    stream termina; las peticiones agrupadas no la llaman. Si `admit` lanza
+    una excepción, los suscriptores que ya se habían unido reciben un evento
+    'error'.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._streams: Dict[Hashable, StreamBroadcast] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(
+        self,
+        key: Hashable,
+        producer: Callable[[], Iterator[str]],
+        admit: Optional[Callable[[], Callable[[], None]]] = None
+    ) -> Iterator[str]:
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = StreamBroadcast()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                release = admit() if admit is not None else None
+            except BaseException as e:
+                with self._lock:
+                    self._streams.pop(key, None)
+                broadcast.publish(sse_event({'error': str(e)}, event='error'))
+                broadcast.close()
+                raise
+            # copy_context: las etapas se registran en el desglose del primer cliente
+            threading.Thread(
+                target=copy_context().run,
+                args=(self._produce, key, broadcast, producer, release),
+                name=f'stream-flight-{self.name}',
+                daemon=True
+            ).start()
+        else:
+            metrics.inc('rag_coalesced_requests_total', kind=self.name)
+
+        return broadcast.subscribe()
+
+    def _produce(
+        self,
+        key: Hashable,
+        broadcast: StreamBroadcast,
+        producer: Callable[[], Iterator[str]],
+        release: Optional[Callable[[], None]] = None
+    ) -> None:
+        try:
+            for event in producer():
+                broadcast.publish(event)
+        except Exception as e:
+            broadcast.publish(sse_event({'error': str(e)}, event='error'))
+        finally:
+            if release is not None:
+                release()
+            with self._lock:
+                self._streams.pop(key, None)
+            broadcast.close()
+
+
+retrieval_flight = SingleFlight('retrieval')
+generation_flight = SingleFlight('generate')
+stream_flight = StreamFlight('stream')
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza texto para claves de caché (unicode NFC, minúsculas, espacios)"""
+    return " ".join(unicodedata.normalize('NFC', text).lower().split())
+
+
+def filter_key(where: Optional[Dict]) -> Optional[str]:
+    """Forma canónica de un filtro de metadata para claves de caché (None sin filtro)"""
+    if not where:
+        return None
+    return json.dumps(where, sort_keys=True, ensure_ascii=False)
+
+
+def response_cache_key(
+    message: str,
+    n_results: int,
+    max_tokens: int,
+    temperature: float,
+    context_docs: List[Dict],
+    context_token_budget: int = 0,
+    where: Optional[Dict] = None
+) -> Tuple:
+    """
+    Clave del caché de respuestas: parámetros + filtro + IDs de los chunks recuperados
+
+    Los parámetros son los ya validados por parse_generate_request (max_tokens
+    entero, temperature float), no los del body tal cual.
+    """
+    return (
+        normalize_text(message),
+        n_results,
+        max_tokens,
+        temperature,
+        tuple(doc.get('id') for doc in context_docs),
+        context_token_budget,
+        filter_key(where)
+    )
+
+
+class AsyncSingleFlight:
+    """
+    Versión asyncio de SingleFlight
+
+    La ejecución corre en su propia task, así que cancelar al primer cliente
+    (p.ej. si se desconecta) no afecta a los demás. `deadline` y `stage`
+    como en SingleFlight.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._tasks: Dict[Hashable, 'asyncio.Task'] = {}
+
+    async def do(
+        self,
+        key: Hashable,
+        coro_factory: Callable[[], Any],
+        deadline: Optional[float] = None,
+        stage: str = 'coalescing'
+    ) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+            return await asyncio.shield(task)
+
+        self.coalesced += 1
+        metrics.inc('rag_coalesced_requests_total', kind=self.name)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), time_left(deadline))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(stage) from None
+
+    def _finished(self, key: Hashable, task: 'asyncio.Task') -> None:
+        self._tasks.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Evita "exception was never retrieved"
+
+
+class AsyncStreamBroadcast:
+    """Versión asyncio de StreamBroadcast"""
+
+    def __init__(self):
+        self.events: List[str] = []
+        self.done = False
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str) -> None:
+        self.events.append(event)
+        self._changed.set()
+
+    def close(self) -> None:
+        self.done = True
+        self._changed.set()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            if position < len(self.events):
+                batch = self.events[position:]
+                position = len(self.events)
+                for event in batch:
+                    yield event
+                continue
+            if self.done:
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class AsyncStreamFlight:
+    """Versión asyncio de StreamFlight: el stream lo produce una task propia (`admit` es async)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._streams: Dict[Hashable, AsyncStreamBroadcast] = {}
+
+    async def subscribe(
+        self,
+        key: Hashable,
+        producer: Callable[[], AsyncIterator[str]],
+        admit: Optional[Callable[[], Awaitable[Callable[[], None]]]] = None
+    ) -> AsyncIterator[str]:
+        broadcast = self._streams.get(key)
+        if broadcast is not None:
+            self.coalesced += 1
+            metrics.inc('rag_coalesced_requests_total', kind=self.name)
+            return broadcast.subscribe()
+
+        broadcast = self._streams[key] = AsyncStreamBroadcast()
+        try:
+            release = await admit() if admit is not None else None
+        except BaseException as e:
+            self._streams.pop(key, None)
+            broadcast.publish(sse_event({'error': str(e)}, event='error'))
+            broadcast.close()
+            raise
+        asyncio.ensure_future(self._produce(key, broadcast, producer, release))
+        return broadcast.subscribe()
+
+    async def _produce(
+        self,
+        key: Hashable,
+        broadcast: AsyncStreamBroadcast,
+        producer: Callable[[], AsyncIterator[str]],
+        release: Optional[Callable[[], None]] = None
+    ) -> None:
+        try:
+            async for event in producer():
+                broadcast.publish(event)
+        except Exception as e:
+            broadcast.publish(sse_event({'error': str(e)}, event='error'))
+        finally:
+            if release is not None:
+                release()
+            self._streams.pop(key, None)
+            broadcast.close()
+
+
+async_generation_flight = AsyncSingleFlight('generate')
+async_stream_flight = AsyncStreamFlight('stream')
@@ -0,0 +1,53 @@
+"""Imports diferidos: chromadb, numpy y aiohttp se cargan en su primer uso"""
+
+import importlib
+import importlib.util
+import threading
+import time
+from typing import Any, Dict
+
+
+class LazyModule:
+    """
+    Módulo que se importa en el primer acceso a uno de sus atributos
+
+    Importar chromadb tarda varios segundos; así no retrasa la apertura del
+    puerto con --fast-start. Lo que tarda cada import queda en `loaded`.
+    """
+
+    loaded: Dict[str, float] = {}
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        # Un lock por módulo: importar chromadb en segundo plano no bloquea a aiohttp
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    LazyModule.loaded[self._name] = time.perf_counter() - start
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+
+def installed(name: str) -> bool:
+    """True si el paquete está instalado (sin importarlo)"""
+    return importlib.util.find_spec(name) is not None
+
+
+# Se importan en el primer uso; rag_api_service.py comprueba antes que estén instalados
+chromadb = LazyModule('chromadb')
+
+# Solo necesario para --server async
+aiohttp = LazyModule('aiohttp') if installed('aiohttp') else None
+web = LazyModule('aiohttp.web') if aiohttp is not None else None
+
+# Solo necesario para --index-dir y la diversidad (MMR)
+np = LazyModule('numpy') if installed('numpy') else None
@@ -0,0 +1,520 @@
+"""Cliente HTTP del LLM, pool de backends y generación (normal y en streaming)"""
+
+import json
+import threading
+import time
+from typing import List, Dict, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, DecodeError, ProtocolError, ReadTimeoutError
+
+from .metrics import record_llm_usage, record_stage, timed
+from .prompts import build_messages
+from .resilience import (
+    DeadlineExceeded, LLMBackend, LLMBackendPool, deadline_passed, retry_delay, shrink_timeout
+)
+from .settings import config
+
+
+def is_connect_error(error: Exception) -> bool:
+    """True si la petición falló al conectar, antes de enviarse (NewConnectionError es un ConnectTimeoutError)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    # requests envuelve el MaxRetryError de urllib3; los fallos tras enviar llegan como ProtocolError
+    reason = getattr(error.args[0], 'reason', None)
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class LLMHttpClient:
+    """
+    Cliente HTTP compartido para el LLM (keep-alive + pool de conexiones)
+
+    Reintenta con backoff exponencial y jitter los fallos transitorios. Los
+    GET (health checks) se reintentan ante cualquier error de conexión o
+    timeout y ante 429/502/503/504. Los POST (generaciones, no idempotentes)
+    solo si la petición no llegó a enviarse (fallo al conectar) o si el
+    backend la rechazó con 429/503 y Retry-After: un 502/504 o un error de
+    lectura pueden llegar con la generación ya en marcha, y reintentarla la
+    duplicaría.
+    """
+
+    RETRY_STATUSES = {429, 502, 503, 504}
+    POST_RETRY_STATUSES = {429, 503}
+
+    @classmethod
+    def should_retry_status(cls, method: str, status: int, retry_after: Optional[str]) -> bool:
+        if method.upper() == 'GET':
+            return status in cls.RETRY_STATUSES
+        return status in cls.POST_RETRY_STATUSES and bool(retry_after)
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 2,
+        backoff: float = 0.5,
+        backoff_max: float = 8.0,
+        hosts: int = 4
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(
+            pool_connections=max(4, hosts),
+            pool_maxsize=pool_size,
+            max_retries=0
+        )
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        timeout: Optional[Tuple[float, float]] = None,
+        max_retries: Optional[int] = None,
+        deadline: Optional[float] = None,
+        **kwargs
+    ) -> 'requests.Response':
+        """
+        Petición HTTP con reintentos; lanza RequestException si se agotan
+
+        Con `deadline` (time.monotonic) cada intento recorta sus timeouts al
+        tiempo restante y no se reintenta una vez vencido.
+        """
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        attempt = 0
+        while True:
+            with self._lock:
+                self.requests += 1
+
+            try:
+                response = self.session.request(
+                    method, url, timeout=shrink_timeout(timeout, deadline), **kwargs
+                )
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                retryable = method.upper() == 'GET' or is_connect_error(e)
+                if not retryable or attempt >= max_retries or deadline_passed(deadline):
+                    with self._lock:
+                        self.failures += 1
+                    raise
+                self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+
+            retry_after = response.headers.get('Retry-After')
+            if (self.should_retry_status(method, response.status_code, retry_after)
+                    and attempt < max_retries and not deadline_passed(deadline)):
+                response.close()
+                self._sleep_before_retry(attempt, retry_after)
+                attempt += 1
+                continue
+
+            return response
+
+    def get(self, url: str, **kwargs) -> 'requests.Response':
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> 'requests.Response':
+        return self.request('POST', url, **kwargs)
+
+    def _sleep_before_retry(self, attempt: int, retry_after: Optional[str] = None) -> None:
+        with self._lock:
+            self.retries += 1
+        time.sleep(retry_delay(attempt, self.backoff, self.backoff_max, retry_after))
+
+    def stats(self) -> Dict:
+        """Contadores de peticiones, reintentos y reutilización de conexiones"""
+        new_connections = 0
+        pooled_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                new_connections += pool.num_connections
+                pooled_requests += pool.num_requests
+
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'connect_timeout': self.connect_timeout,
+                'read_timeout': self.read_timeout,
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'new_connections': new_connections,
+                'reused_connections': max(0, pooled_requests - new_connections)
+            }
+
+
+# Cliente HTTP global para el LLM (se recrea en init_llm_client)
+llm_http = LLMHttpClient()
+
+
+# Backends globales del LLM (se recrean en init_llm_client)
+llm_backends = LLMBackendPool([config['llm_url']])
+
+
+def is_backend_failure(error: Exception) -> bool:
+    """True si el error indica un backend caído o saturado (no un 4xx de la petición)"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    return isinstance(error, requests.exceptions.RequestException)
+
+
+def post_to_llm(
+    payload: Dict,
+    headers: Dict,
+    stream: bool = False,
+    deadline: Optional[float] = None
+) -> Tuple[LLMBackend, 'requests.Response']:
+    """
+    POST al backend con menos peticiones en curso
+
+    Si un backend no acepta la conexión (la petición no llegó a procesarse)
+    se prueba con el siguiente disponible. El backend devuelto queda
+    reservado: el llamador debe llamar a llm_backends.release al terminar.
+    Un timeout por el deadline de la petición se lanza como DeadlineExceeded
+    y no cuenta como fallo del backend.
+    """
+    tried: List[LLMBackend] = []
+
+    while True:
+        backend = llm_backends.acquire(exclude=tried)
+        try:
+            response = llm_http.post(
+                backend.url,
+                json=payload,
+                headers=headers,
+                stream=stream,
+                deadline=deadline
+            )
+            response.raise_for_status()
+            return backend, response
+
+        except DeadlineExceeded:
+            llm_backends.release(backend, None)
+            raise
+
+        except requests.exceptions.RequestException as e:
+            if getattr(e, 'response', None) is not None:
+                e.response.close()
+            if isinstance(e, requests.exceptions.Timeout) and deadline_passed(deadline):
+                llm_backends.release(backend, None)
+                raise DeadlineExceeded('llm') from e
+            llm_backends.release(backend, not is_backend_failure(e))
+            tried.append(backend)
+            if is_connect_error(e) and llm_backends.has_available(tried):
+                print(f"⚠️  LLM {backend.url} no responde ({e}); probando otro backend")
+                continue
+            raise
+
+
+def init_llm_client():
+    """Crea el cliente HTTP y los backends del LLM con la configuración actual"""
+    global llm_http, llm_backends
+
+    urls = config['llm_urls'] or [config['llm_url']]
+
+    llm_http = LLMHttpClient(
+        pool_size=config['llm_pool_size'],
+        connect_timeout=config['llm_connect_timeout'],
+        read_timeout=config['llm_read_timeout'],
+        max_retries=config['llm_max_retries'],
+        backoff=config['llm_backoff'],
+        hosts=len(urls)
+    )
+    llm_backends = LLMBackendPool(
+        urls,
+        failure_threshold=config['llm_failure_threshold'],
+        reset_timeout=config['llm_reset_timeout']
+    )
+
+
+def build_llm_request(
+    user_message: str,
+    context_docs: List[Dict],
+    max_tokens: int = 1000,
+    temperature: float = 0.7,
+    stream: bool = False
+) -> Tuple[Dict, Dict]:
+    """
+    Prepara payload y headers para el endpoint OpenAI-compatible del LLM
+
+    Returns:
+        Tuple (payload, headers)
+    """
+    headers = {
+        'Content-Type': 'application/json'
+    }
+
+    if config['llm_api_key']:
+        headers['Authorization'] = f"Bearer {config['llm_api_key']}"
+
+    payload = {
+        "model": config['model_id'],
+        "messages": build_messages(user_message, context_docs),
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": 0.92,
+        "frequency_penalty": 0.4,
+        "presence_penalty": 0.2
+    }
+
+    if stream:
+        payload['stream'] = True
+        # Pide el uso de tokens en el último chunk (vLLM / OpenAI)
+        payload['stream_options'] = {"include_usage": True}
+
+    if config['llm_cache_prompt']:
+        # Hint de llama.cpp server para reutilizar el KV cache del prefijo
+        # (vLLM activa el prefix caching en el servidor y lo ignora)
+        payload['cache_prompt'] = True
+
+    return payload, headers
+
+
+def format_sources(context_docs: List[Dict]) -> List[Dict]:
+    """Resumen de fuentes usadas (source, page, relevance) para la respuesta"""
+    return [
+        {
+            'source': doc['metadata'].get('source'),
+            'page': doc['metadata'].get('page', doc['metadata'].get('chunk')),
+            'relevance': doc['relevance']
+        }
+        for doc in context_docs
+    ]
+
+
+def generate_with_llm(
+    user_message: str,
+    context_docs: List[Dict],
+    max_tokens: int = 1000,
+    temperature: float = 0.7,
+    deadline: Optional[float] = None
+) -> Dict:
+    """
+    Genera respuesta usando LLM con contexto de RAG
+
+    Args:
+        user_message: Mensaje del usuario
+        context_docs: Documentos de contexto desde RAG
+        max_tokens: Máximo de tokens de salida
+        temperature: Temperatura del modelo
+        deadline: Instante límite (time.monotonic) de la petición; los
+            timeouts del LLM se recortan al tiempo restante
+
+    Returns:
+        Dict con respuesta y metadata
+
+    Raises:
+        DeadlineExceeded: si el LLM no responde antes del deadline
+    """
+    with timed('prompt_build'):
+        payload, headers = build_llm_request(
+            user_message, context_docs, max_tokens, temperature
+        )
+
+    try:
+        start = time.perf_counter()
+        with timed('llm'):
+            backend, response = post_to_llm(payload, headers, deadline=deadline)
+            try:
+                data = response.json()
+            except ValueError:
+                llm_backends.release(backend, False)
+                raise
+            llm_backends.release(backend, True, time.perf_counter() - start)
+
+        record_llm_usage(data.get('usage') or {}, time.perf_counter() - start)
+
+        return {
+            'response': data['choices'][0]['message']['content'],
+            'model': config['model_id'],
+            'tokens_used': data.get('usage', {}).get('total_tokens', 0),
+            'sources_used': len(context_docs)
+        }
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error llamando al LLM: {e}")
+        raise
+
+
+class LLMStreamParser:
+    """
+    Parser incremental del stream SSE de un endpoint OpenAI-compatible
+
+    Se alimenta línea a línea (`feed`) y devuelve los fragmentos de texto.
+    Si el backend no reporta `usage` en el stream, tokens_used se aproxima
+    con el número de fragmentos recibidos.
+    """
+
+    def __init__(self):
+        self.finished = False
+        self.tokens_used = 0
+        self.chunks_received = 0
+        self.usage: Dict = {}
+
+    def feed(self, line: str) -> List[str]:
+        if not line or not line.startswith('data:'):
+            return []
+
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            self.finished = True
+            return []
+
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            return []
+
+        usage = chunk.get('usage') or {}
+        if usage.get('total_tokens'):
+            self.tokens_used = usage['total_tokens']
+            self.usage = usage
+
+        tokens = []
+        for choice in chunk.get('choices') or []:
+            delta = choice.get('delta') or {}
+            content = delta.get('content')
+            if content:
+                self.chunks_received += 1
+                tokens.append(content)
+        return tokens
+
+    def record_usage(self, elapsed: float) -> None:
+        """Registra tokens y velocidad en las métricas al terminar el stream"""
+        usage = self.usage or {'completion_tokens': self.chunks_received}
+        record_llm_usage(usage, elapsed)
+
+    def summary(self, context_docs: List[Dict]) -> Dict:
+        """Metadata final, igual que la de generate_with_llm"""
+        return {
+            'done': True,
+            'model': config['model_id'],
+            'tokens_used': self.tokens_used or self.chunks_received,
+            'sources_used': len(context_docs)
+        }
+
+
+def iter_stream_lines(response: 'requests.Response', chunk_size: int = 8192) -> Iterator[str]:
+    """
+    Líneas de una respuesta en streaming según llegan del LLM
+
+    iter_lines() agrupa el body en bloques de 512 bytes (y con chunk_size=None,
+    si la respuesta no es chunked, lo lee entero) antes de partirlo en líneas,
+    lo que retiene los primeros tokens. read1 devuelve lo que ya haya llegado
+    al socket. Con urllib3 < 2 (sin read1) se lee línea a línea con readline.
+    Los errores de urllib3 se relanzan como los de requests, igual que en
+    iter_content.
+    """
+    raw = response.raw
+    raw.decode_content = True
+    read1 = getattr(raw, 'read1', None)
+
+    try:
+        if read1 is None:
+            for line in iter(raw.readline, b''):
+                yield line.rstrip(b'\r\n').decode('utf-8', errors='replace')
+            return
+
+        pending = b''
+        while True:
+            data = read1(chunk_size)
+            if not data:
+                break
+            *lines, pending = (pending + data).split(b'\n')
+            for line in lines:
+                yield line.rstrip(b'\r').decode('utf-8', errors='replace')
+        if pending:
+            yield pending.decode('utf-8', errors='replace')
+
+    except ReadTimeoutError as e:
+        raise requests.exceptions.ReadTimeout(e) from e
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e) from e
+    except DecodeError as e:
+        raise requests.exceptions.ContentDecodingError(e) from e
+
+
+def stream_with_llm(
+    user_message: str,
+    context_docs: List[Dict],
+    max_tokens: int = 1000,
+    temperature: float = 0.7,
+    deadline: Optional[float] = None
+) -> Iterator[Dict]:
+    """
+    Genera respuesta en streaming usando LLM con contexto de RAG
+
+    Emite un dict {'token': str} por cada fragmento recibido del LLM y,
+    al final, un dict {'done': True, ...} con la misma metadata que
+    generate_with_llm (model, tokens_used, sources_used). Si el stream no
+    termina antes de `deadline` se corta con DeadlineExceeded.
+    """
+    with timed('prompt_build'):
+        payload, headers = build_llm_request(
+            user_message, context_docs, max_tokens, temperature, stream=True
+        )
+
+    parser = LLMStreamParser()
+    start = time.perf_counter()
+    first_token_at = None
+
+    with timed('llm'):
+        try:
+            backend, response = post_to_llm(payload, headers, stream=True, deadline=deadline)
+        except requests.exceptions.RequestException as e:
+            print(f"Error llamando al LLM: {e}")
+            raise
+
+        success = None
+        try:
+            for line in iter_stream_lines(response):
+                for token in parser.feed(line):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        record_stage('llm_first_token', first_token_at - start)
+                    yield {'token': token}
+                if parser.finished:
+                    break
+                if deadline_passed(deadline, slack=0.0):
+                    raise DeadlineExceeded('llm')
+            success = True
+        except requests.exceptions.RequestException as e:
+            if isinstance(e, requests.exceptions.Timeout) and deadline_passed(deadline):
+                raise DeadlineExceeded('llm') from e
+            success = not is_backend_failure(e)
+            raise
+        finally:
+            response.close()
+            # Si el cliente corta el stream el resultado es neutro (success None)
+            llm_backends.release(backend, success, time.perf_counter() - start)
+
+    parser.record_usage(time.perf_counter() - start)
+    yield parser.summary(context_docs)
+
+
+# Cliente asíncrono global (se crea al arrancar el servidor asíncrono)
+async_llm = None
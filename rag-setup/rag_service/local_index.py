@@ -0,0 +1,191 @@
+"""Índice vectorial local en memoria (--index-dir)"""
+
+import json
+import os
+from typing import Callable, List, Dict, Optional
+
+from .caching import filter_key
+from .lazy import np
+
+
+# === ÍNDICE VECTORIAL LOCAL (--index-dir) ===
+
+# Ficheros que escribe process_adhd_books.py --export-index
+INDEX_EMBEDDINGS_FILE = 'embeddings.npy'
+INDEX_CHUNKS_FILE = 'chunks.json'
+
+
+WHERE_OPERATORS = {
+    '$eq': lambda value, operand: value == operand,
+    '$ne': lambda value, operand: value != operand,
+    '$gt': lambda value, operand: value > operand,
+    '$gte': lambda value, operand: value >= operand,
+    '$lt': lambda value, operand: value < operand,
+    '$lte': lambda value, operand: value <= operand,
+    '$in': lambda value, operand: value in operand,
+    '$nin': lambda value, operand: value not in operand
+}
+
+
+def metadata_matches(metadata: Dict, where: Dict) -> bool:
+    """
+    Evalúa una cláusula `where` de ChromaDB sobre la metadata de un chunk
+
+    Soporta $and/$or, igualdad implícita y los operadores de WHERE_OPERATORS.
+    Como en ChromaDB, un chunk sin la clave no cumple ninguna condición sobre ella.
+    """
+    for key, condition in where.items():
+        if key == '$and':
+            ok = all(metadata_matches(metadata, c) for c in condition)
+        elif key == '$or':
+            ok = any(metadata_matches(metadata, c) for c in condition)
+        else:
+            value = metadata.get(key)
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            ok = value is not None and all(
+                WHERE_OPERATORS[op](value, operand) for op, operand in condition.items()
+            )
+        if not ok:
+            return False
+    return True
+
+
+class LocalVectorIndex:
+    """
+    Índice vectorial en proceso sobre los embeddings exportados de ChromaDB
+
+    La matriz de embeddings (float32, filas normalizadas) se abre con
+    memory-map: no se copia al heap y varios workers comparten las mismas
+    páginas del page cache. Implementa la parte de la API de colección de
+    ChromaDB que usa el servicio (count, query, get) con el mismo formato de
+    resultados, así que el resto del código no distingue el modo.
+    """
+
+    def __init__(self, index_dir: str, embedding_function: Optional[Callable] = None):
+        self.index_dir = index_dir
+        self.embedding_function = embedding_function
+        self.load()
+
+    def load(self) -> None:
+        """(Re)carga el índice desde disco"""
+        embeddings = np.load(
+            os.path.join(self.index_dir, INDEX_EMBEDDINGS_FILE),
+            mmap_mode='r'
+        )
+        with open(os.path.join(self.index_dir, INDEX_CHUNKS_FILE), encoding='utf-8') as f:
+            chunks = json.load(f)
+
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(chunks['ids']):
+            raise ValueError(
+                f"Índice inconsistente: {embeddings.shape[0]} embeddings "
+                f"para {len(chunks['ids'])} chunks"
+            )
+
+        # Se sustituye todo junto para que las búsquedas en curso sigan
+        # viendo una versión coherente
+        self.embeddings, self.ids, self.documents, self.metadatas, self._filter_positions = (
+            embeddings, chunks['ids'], chunks['documents'], chunks['metadatas'], {}
+        )
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def embed(self, texts: List[str]) -> 'np.ndarray':
+        """Embeddings normalizados de las queries (mismo modelo que ChromaDB)"""
+        if self.embedding_function is None:
+            from chromadb.utils import embedding_functions
+            self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+
+        vectors = np.asarray(self.embedding_function(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def query(
+        self,
+        query_texts: List[str],
+        n_results: int = 10,
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict:
+        """Top-k por similitud coseno, en el formato de collection.query"""
+        embeddings, ids, documents, metadatas = (
+            self.embeddings, self.ids, self.documents, self.metadatas
+        )
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        with_embeddings = include is not None and 'embeddings' in include
+        if with_embeddings:
+            results['embeddings'] = []
+
+        # Con filtro solo se puntúan las filas que lo cumplen
+        positions = self.filter_positions(where) if where else None
+        if positions is not None:
+            embeddings = embeddings[positions]
+        k = min(n_results, len(embeddings))
+
+        if k <= 0:
+            for key in results:
+                results[key] = [[] for _ in query_texts]
+            return results
+
+        # (queries x chunks): un solo producto matricial para todo el batch
+        scores = self.embed(query_texts) @ embeddings.T
+
+        for row in scores:
+            rows = np.argpartition(-row, k - 1)[:k]
+            rows = rows[np.argsort(-row[rows], kind='stable')]
+            top = rows if positions is None else positions[rows]
+
+            results['ids'].append([ids[i] for i in top])
+            results['documents'].append([documents[i] for i in top])
+            results['metadatas'].append([metadatas[i] for i in top])
+            # Distancia L2 al cuadrado entre vectores unitarios, la misma que
+            # devuelve ChromaDB con su espacio por defecto ('l2')
+            results['distances'].append((2.0 - 2.0 * row[rows]).tolist())
+            if with_embeddings:
+                results['embeddings'].append(embeddings[rows])
+
+        return results
+
+    def filter_positions(self, where: Dict) -> 'np.ndarray':
+        """Filas que cumplen `where` (memorizado por filtro hasta el siguiente load)"""
+        key = filter_key(where)
+        memo, metadatas = self._filter_positions, self.metadatas
+        positions = memo.get(key)
+        if positions is None:
+            positions = np.array(
+                [i for i, metadata in enumerate(metadatas) if metadata_matches(metadata, where)],
+                dtype=np.int64
+            )
+            if len(memo) >= 256:
+                memo.clear()
+            memo[key] = positions
+        return positions
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict:
+        """Chunks por ID o por posición, en el formato de collection.get"""
+        if ids is not None:
+            positions = [self.positions[doc_id] for doc_id in ids if doc_id in self.positions]
+        else:
+            end = None if limit is None else offset + limit
+            positions = range(len(self.ids))[offset:end]
+        if where:
+            positions = [i for i in positions if metadata_matches(self.metadatas[i], where)]
+
+        results = {
+            'ids': [self.ids[i] for i in positions],
+            'documents': [self.documents[i] for i in positions],
+            'metadatas': [self.metadatas[i] for i in positions]
+        }
+        if include is not None and 'embeddings' in include:
+            results['embeddings'] = self.embeddings[list(positions)]
+
+        return results
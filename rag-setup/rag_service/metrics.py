@@ -0,0 +1,191 @@
+"""Métricas en formato Prometheus y desglose de tiempos por etapa"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Iterator, Optional, Tuple
+
+
+# === MÉTRICAS ===
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+TOKENS_PER_SECOND_BUCKETS = (1, 2.5, 5, 10, 20, 40, 80, 160, 320)
+
+
+class Metrics:
+    """
+    Registro mínimo de contadores e histogramas en formato de texto Prometheus
+
+    Las métricas se declaran con `counter`/`histogram` y se actualizan con
+    `inc`/`observe` pasando las etiquetas como kwargs.
+    """
+
+    def __init__(self):
+        self._meta: "OrderedDict[str, Tuple[str, str, Tuple[float, ...]]]" = OrderedDict()
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Dict[Tuple, List]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._meta[name] = ('counter', help_text, ())
+        self._counters[name] = {}
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self._meta[name] = ('histogram', help_text, tuple(buckets))
+        self._histograms[name] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        buckets = self._meta[name][2]
+        with self._lock:
+            series = self._histograms[name]
+            entry = series.get(key)
+            if entry is None:
+                # [conteos por bucket..., suma, total]
+                entry = series[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == 'counter':
+                    for key, value in self._counters[name].items():
+                        lines.append(f"{name}{format_labels(key)} {format_value(value)}")
+                    continue
+
+                for key, entry in self._histograms[name].items():
+                    for bound, count in zip(buckets, entry):
+                        lines.append(f"{name}_bucket{format_labels(key, le=f'{bound:g}')} {count}")
+                    lines.append(f"{name}_bucket{format_labels(key, le='+Inf')} {entry[-1]}")
+                    lines.append(f"{name}_sum{format_labels(key)} {format_value(entry[-2])}")
+                    lines.append(f"{name}_count{format_labels(key)} {entry[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value: float) -> str:
+    """Valor exacto para Prometheus: `:g` redondea a 6 cifras y congela los contadores grandes"""
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(key: Tuple, **extra) -> str:
+    """Etiquetas Prometheus: {a="1",b="2"}"""
+    items = list(key) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in items
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+metrics = Metrics()
+metrics.histogram('rag_http_request_duration_seconds', 'Latencia de cada endpoint')
+metrics.counter('rag_http_requests_total', 'Peticiones por endpoint y código HTTP')
+metrics.histogram(
+    'rag_stage_duration_seconds',
+    'Latencia por etapa (retrieval, context_pack, prompt_build, llm, llm_first_token)'
+)
+metrics.counter('rag_stage_errors_total', 'Errores por etapa')
+metrics.counter(
+    'rag_coalesced_requests_total',
+    'Peticiones servidas por una ejecución idéntica ya en curso (single-flight)'
+)
+metrics.counter(
+    'rag_admission_rejected_total',
+    'Peticiones rechazadas con 429 por el control de admisión (queue_full, timeout)'
+)
+metrics.histogram('rag_admission_wait_seconds', 'Espera en la cola de admisión por endpoint')
+metrics.counter(
+    'rag_deadline_exceeded_total',
+    'Peticiones que agotaron su deadline por etapa (retrieval = generadas sin RAG)'
+)
+metrics.counter('rag_hedged_requests_total', 'Consultas a ChromaDB duplicadas por superar el p95')
+metrics.counter('rag_hedge_wins_total', 'Consultas duplicadas que respondieron antes que la original')
+metrics.counter(
+    'rag_shard_errors_total',
+    'Consultas a un shard de ChromaDB sin respuesta (timeout, error)'
+)
+metrics.histogram('rag_shard_query_seconds', 'Latencia de cada shard de ChromaDB')
+metrics.counter('rag_llm_prompt_tokens_total', 'Tokens de prompt enviados al LLM')
+metrics.counter('rag_llm_completion_tokens_total', 'Tokens generados por el LLM')
+metrics.counter(
+    'rag_llm_cached_prompt_tokens_total',
+    'Tokens de prompt servidos desde el prefix cache del LLM (si el backend lo informa)'
+)
+metrics.histogram(
+    'rag_llm_tokens_per_second',
+    'Velocidad de generación (tokens de completion por segundo)',
+    TOKENS_PER_SECOND_BUCKETS
+)
+
+# Tiempos por etapa de la petición en curso (para --log-timings)
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    'request_timings', default=None
+)
+
+
+def track_request_timings() -> Dict[str, float]:
+    """Empieza el desglose de la petición en curso; devuelve el dict que rellenan timed y record_stage"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Mide una etapa: histograma, contador de errores y desglose por petición"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            metrics.inc('rag_stage_errors_total', stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('rag_stage_duration_seconds', elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def record_stage(stage: str, elapsed: float) -> None:
+    """Registra una etapa medida fuera de `timed` (p.ej. primer token)"""
+    metrics.observe('rag_stage_duration_seconds', elapsed, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def record_llm_usage(usage: Dict, elapsed: float) -> None:
+    """Contadores de tokens y velocidad de generación a partir de `usage`"""
+    prompt_tokens = usage.get('prompt_tokens') or 0
+    completion_tokens = usage.get('completion_tokens') or 0
+    # vLLM / OpenAI: usage.prompt_tokens_details.cached_tokens
+    cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+
+    metrics.inc('rag_llm_prompt_tokens_total', prompt_tokens)
+    metrics.inc('rag_llm_completion_tokens_total', completion_tokens)
+    metrics.inc('rag_llm_cached_prompt_tokens_total', cached_tokens)
+    if completion_tokens and elapsed > 0:
+        metrics.observe('rag_llm_tokens_per_second', completion_tokens / elapsed)
@@ -0,0 +1,141 @@
+"""Empaquetado del contexto dentro del presupuesto de tokens"""
+
+import math
+from typing import List, Dict
+
+from .caching import normalize_text
+
+
+# === EMPAQUETADO DE CONTEXTO ===
+
+# Aproximación de caracteres por token para texto en español (Llama 3)
+CHARS_PER_TOKEN = 3.5
+
+# Por debajo de este presupuesto restante no vale la pena truncar un chunk
+# (salvo el primero: nunca se genera sin contexto si hay documentos)
+MIN_PARTIAL_TOKENS = 64
+
+SENTENCE_ENDINGS = ('. ', '! ', '? ', '.\n', '!\n', '?\n', '\n\n')
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida de tokens (sin tokenizer)"""
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN)) if text else 0
+
+
+def word_shingles(text: str, size: int = 5) -> set:
+    """Conjunto de n-gramas de palabras para comparar chunks"""
+    words = normalize_text(text).split()
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def overlap_length(first: str, second: str, min_overlap: int = 40, max_overlap: int = 400) -> int:
+    """Longitud del texto con el que termina `first` y empieza `second`"""
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+
+    probe = second[:min_overlap]
+    start = max(0, len(first) - max_overlap)
+    idx = first.find(probe, start)
+    while idx != -1:
+        tail = first[idx:]
+        if second.startswith(tail):
+            return len(tail)
+        idx = first.find(probe, idx + 1)
+    return 0
+
+
+def truncate_to_sentence(text: str, max_chars: int) -> str:
+    """Recorta `text` a `max_chars` terminando en fin de frase si es posible"""
+    if len(text) <= max_chars:
+        return text
+
+    window = text[:max_chars]
+    cut = max(window.rfind(ending) for ending in SENTENCE_ENDINGS)
+    if cut >= max_chars // 2:
+        return window[:cut + 1].rstrip()
+
+    # Sin fin de frase razonable: cortar en el último espacio
+    cut = window.rfind(' ')
+    return (window[:cut] if cut > 0 else window).rstrip() + '…'
+
+
+def pack_context(
+    context_docs: List[Dict],
+    token_budget: int,
+    dedup_threshold: float = 0.6
+) -> List[Dict]:
+    """
+    Selecciona y recorta los chunks de contexto para el prompt
+
+    Recorre los documentos por relevancia y:
+    - descarta los que repiten en su mayoría un chunk ya elegido
+      (proporción de 5-gramas compartidos >= `dedup_threshold`)
+    - elimina el solapamiento textual con chunks adyacentes de la misma
+      fuente (el overlap de 200 caracteres de process_adhd_books.py)
+    - llena `token_budget` y trunca el último chunk en fin de frase
+
+    Si el chunk más relevante no cabe entero se incluye truncado aunque el
+    presupuesto sea menor que MIN_PARTIAL_TOKENS: con documentos recuperados
+    el resultado nunca queda vacío.
+
+    Args:
+        context_docs: Documentos recuperados (no se modifican)
+        token_budget: Tokens máximos de contexto, 0 para no limitar
+        dedup_threshold: Proporción de solapamiento para descartar un chunk
+
+    Returns:
+        Documentos empaquetados, cada uno con su estimación en 'tokens'
+    """
+    ordered = sorted(context_docs, key=lambda doc: doc['relevance'], reverse=True)
+
+    packed = []
+    selected_shingles = []
+    used_tokens = 0
+
+    for doc in ordered:
+        text = doc['text']
+        source = doc['metadata'].get('source')
+
+        shingles = word_shingles(text)
+        if shingles and any(
+            len(shingles & other) / min(len(shingles), len(other)) >= dedup_threshold
+            for other in selected_shingles if other
+        ):
+            continue
+
+        for other in packed:
+            if other['metadata'].get('source') != source:
+                continue
+            text = text[overlap_length(other['text'], text):]
+            cut = overlap_length(text, other['text'])
+            if cut:
+                text = text[:-cut]
+
+        text = text.strip()
+        if not text:
+            continue
+
+        tokens = estimate_tokens(text)
+        if token_budget > 0 and used_tokens + tokens > token_budget:
+            remaining = token_budget - used_tokens
+            if remaining < MIN_PARTIAL_TOKENS and packed:
+                break
+            text = truncate_to_sentence(text, int(remaining * CHARS_PER_TOKEN))
+            tokens = estimate_tokens(text)
+            packed.append(dict(doc, text=text, tokens=tokens, truncated=True))
+            used_tokens += tokens
+            break
+
+        packed.append(dict(doc, text=text, tokens=tokens))
+        selected_shingles.append(shingles)
+        used_tokens += tokens
+
+    return packed
+
+
+def context_tokens(context_docs: List[Dict]) -> int:
+    """Tokens estimados del contexto empaquetado"""
+    return sum(doc.get('tokens', estimate_tokens(doc['text'])) for doc in context_docs)
@@ -0,0 +1,106 @@
+"""Construcción de los mensajes del prompt"""
+
+from typing import List, Dict, Tuple
+
+from .settings import config
+
+
+def format_context(context_docs: List[Dict]) -> str:
+    """Bloque de texto con las fuentes numeradas para el prompt"""
+    return "\n\n".join([
+        f"Fuente {i+1} ({doc['metadata'].get('source', 'N/A')}, "
+        f"página {doc['metadata'].get('page', doc['metadata'].get('chunk', 'N/A'))}):\n{doc['text']}"
+        for i, doc in enumerate(context_docs)
+    ])
+
+
+def build_system_prompt(context_docs: List[Dict]) -> str:
+    """
+    Construye el system prompt con el contexto de RAG
+
+    Args:
+        context_docs: Documentos de contexto desde RAG
+
+    Returns:
+        System prompt para el LLM
+    """
+    if context_docs:
+        context = format_context(context_docs)
+
+        return f"""Eres un asistente especializado en TDAH (Trastorno por Déficit de Atención e Hiperactividad).
+
+Usa el siguiente contexto de libros especializados para responder la pregunta del usuario:
+
+{context}
+
+INSTRUCCIONES:
+- Responde en español
+- Basa tu respuesta en el contexto proporcionado
+- Si la información del contexto no es suficiente, complementa con tu conocimiento general sobre TDAH
+- Sé empático, práctico y claro
+- Usa listas cuando sea apropiado
+- Si mencionas información del contexto, puedes citar la fuente brevemente
+
+Responde la siguiente pregunta del usuario:"""
+
+    return """Eres un asistente especializado en TDAH (Trastorno por Déficit de Atención e Hiperactividad).
+
+Responde en español de forma clara, empática y práctica.
+Si no tienes información específica, sé honesto al respecto."""
+
+
+# Instrucciones del layout 'prefix': son el inicio de todos los prompts y deben
+# mantenerse idénticas byte a byte para que el LLM reutilice su KV cache
+PREFIX_SYSTEM_PROMPT = """Eres un asistente especializado en TDAH (Trastorno por Déficit de Atención e Hiperactividad).
+
+INSTRUCCIONES:
+- Responde en español
+- Si el mensaje incluye contexto de libros especializados, basa tu respuesta en él
+- Si la información del contexto no es suficiente, complementa con tu conocimiento general sobre TDAH
+- Si no tienes información específica, sé honesto al respecto
+- Sé empático, práctico y claro
+- Usa listas cuando sea apropiado
+- Si mencionas información del contexto, puedes citar la fuente brevemente"""
+
+
+def context_sort_key(doc: Dict) -> Tuple:
+    """Orden estable de las fuentes: libro, página/chunk e ID"""
+    metadata = doc['metadata']
+    return (
+        str(metadata.get('source', '')),
+        str(metadata.get('page', metadata.get('chunk', ''))).zfill(6),
+        str(doc.get('id', ''))
+    )
+
+
+def build_messages(user_message: str, context_docs: List[Dict]) -> List[Dict]:
+    """
+    Mensajes del chat según config['prompt_layout']
+
+    - 'classic': system prompt con el contexto en medio de las instrucciones
+      (build_system_prompt); dos peticiones apenas comparten prefijo.
+    - 'prefix': system prompt fijo (PREFIX_SYSTEM_PROMPT) y después, en el
+      mensaje del usuario, el contexto en orden determinista y la pregunta.
+      Todas las peticiones comparten el prefijo de instrucciones, y las que
+      recuperan las mismas fuentes comparten también el contexto, así que el
+      prefix caching de llama.cpp / vLLM evita recalcular esos tokens.
+    """
+    if config['prompt_layout'] != 'prefix':
+        return [
+            {"role": "system", "content": build_system_prompt(context_docs)},
+            {"role": "user", "content": user_message}
+        ]
+
+    if context_docs:
+        context = format_context(sorted(context_docs, key=context_sort_key))
+        content = (
+            f"Contexto de libros especializados:\n\n{context}\n\n"
+            f"Pregunta del usuario:\n{user_message}"
+        )
+    else:
+        content = user_message
+
+    return [
+        {"role": "system", "content": PREFIX_SYSTEM_PROMPT},
+        {"role": "user", "content": content}
+    ]
@@ -0,0 +1,140 @@
+"""Log de consultas en JSON Lines (--query-log)"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+from typing import Any, Dict, Optional
+
+from .caching import normalize_text
+
+
+# === LOG DE CONSULTAS (--query-log) ===
+
+# Endpoints cuyas peticiones se registran (los que se pueden reproducir)
+QUERY_LOG_ENDPOINTS = ('/search', '/search/batch', '/generate')
+
+# Campos del body con texto de los usuarios (en /search/batch, dentro de `queries`)
+TEXT_FIELDS = ('query', 'message')
+
+
+def redact_text(text: str) -> Dict:
+    """Hash (del texto normalizado, como la clave del caché) y longitud en vez del texto"""
+    digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    return {'sha256': digest[:16], 'chars': len(text)}
+
+
+def redact_params(params: Dict) -> Dict:
+    """Copia del body con los textos de TEXT_FIELDS cambiados por redact_text"""
+    redacted: Dict[str, Any] = dict(params)
+    for field in TEXT_FIELDS:
+        if isinstance(redacted.get(field), str):
+            redacted[field] = redact_text(redacted[field])
+    if isinstance(redacted.get('queries'), list):
+        redacted['queries'] = [
+            redact_params(query) if isinstance(query, dict) else query
+            for query in redacted['queries']
+        ]
+    return redacted
+
+
+class QueryLog:
+    """
+    Log de consultas muestreado en JSON lines, rotado por tamaño
+
+    Cada línea tiene el instante de llegada, el endpoint, el body de la
+    petición, el código HTTP y la latencia total y por etapa. Al superar
+    `max_bytes` el fichero pasa a `path.1` (y los anteriores a `.2`, `.3`...)
+    conservando `backups` ficheros rotados.
+
+    Por defecto las preguntas del body se guardan solo como hash y longitud
+    (redact_params). Con `raw_text` se guardan tal cual, que es lo que
+    necesita replay_query_log.py para reproducirlas.
+    """
+
+    def __init__(self):
+        self.path: Optional[str] = None
+        self.sample_rate = 0.0
+        self.max_bytes = 0
+        self.backups = 0
+        self.raw_text = False
+        self.written = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def configure(
+        self,
+        path: Optional[str],
+        sample_rate: float,
+        max_bytes: int,
+        backups: int,
+        raw_text: bool = False
+    ) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path
+            self.sample_rate = sample_rate
+            self.max_bytes = max_bytes
+            self.backups = backups
+            self.raw_text = raw_text
+
+    def sample(self, endpoint: str) -> bool:
+        """Decide si se registra una petición a `endpoint`"""
+        return (
+            self.path is not None
+            and endpoint in QUERY_LOG_ENDPOINTS
+            and random.random() < self.sample_rate
+        )
+
+    def loggable_params(self, params: Dict) -> Dict:
+        """Body tal como se guarda en el log (sin el texto de las preguntas salvo con raw_text)"""
+        return params if self.raw_text else redact_params(params)
+
+    def write(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+        with self._lock:
+            if self.path is None:
+                return
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+            self.written += 1
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        if self.backups == 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'path': self.path,
+                'sample_rate': self.sample_rate,
+                'raw_text': self.raw_text,
+                'written': self.written
+            }
+
+
+query_log = QueryLog()
@@ -0,0 +1,600 @@
+"""Reintentos con backoff, deadlines, circuit breakers de los backends, control de admisión y hedging"""
+
+import asyncio
+import functools
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait as wait_futures
+)
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, List, Dict, Iterator, Optional, Tuple
+
+import requests
+
+from .metrics import metrics
+from .settings import config
+
+
+# === DEADLINE POR PETICIÓN ===
+
+# Presupuesto restante de la petición en milisegundos (alternativa a `deadline_ms`)
+DEADLINE_HEADER = 'X-Deadline-Ms'
+
+
+class DeadlineExceeded(Exception):
+    """La petición agotó su deadline en `stage`; los endpoints responden 504"""
+
+    def __init__(self, stage: str):
+        super().__init__(f'Deadline exceeded during {stage}')
+        self.stage = stage
+
+
+def deadline_passed(deadline: Optional[float], slack: float = 0.05) -> bool:
+    """True si el deadline (time.monotonic) ya pasó o pasa en menos de `slack` s"""
+    return deadline is not None and time.monotonic() >= deadline - slack
+
+
+def time_left(deadline: Optional[float]) -> Optional[float]:
+    """Segundos hasta el deadline (>= 0), o None sin deadline"""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def check_deadline(deadline: Optional[float], stage: str) -> None:
+    """Lanza DeadlineExceeded(stage) si no queda tiempo para la siguiente etapa"""
+    if deadline_passed(deadline):
+        raise DeadlineExceeded(stage)
+
+
+def shrink_timeout(timeout: Tuple[float, float], deadline: Optional[float]) -> Tuple[float, float]:
+    """Recorta (connect, read) al tiempo que le queda a la petición"""
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded('llm')
+    return min(timeout[0], remaining), min(timeout[1], remaining)
+
+
+def retry_delay(
+    attempt: int,
+    backoff: float,
+    backoff_max: float = 8.0,
+    retry_after: Optional[str] = None
+) -> float:
+    """
+    Espera antes del reintento `attempt` (0, 1, ...)
+
+    Full jitter: uniforme entre 0 y el backoff exponencial. Respeta un
+    header Retry-After numérico, acotado por `backoff_max`.
+    """
+    delay = random.uniform(0, min(backoff_max, backoff * (2 ** attempt)))
+    if retry_after:
+        try:
+            delay = max(delay, min(backoff_max, float(retry_after)))
+        except ValueError:
+            pass
+    return delay
+
+
+# === BACKENDS DEL LLM (varios --llm-url) ===
+
+class NoLLMBackendAvailable(requests.exceptions.ConnectionError):
+    """Todos los backends del LLM tienen el circuit breaker abierto"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"No hay backends del LLM disponibles (reintentar en {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+class LLMBackend:
+    """
+    Un endpoint del LLM: peticiones en curso, latencia y circuit breaker
+
+    Estados del breaker:
+    - closed: recibe tráfico normalmente
+    - open: tras `failure_threshold` fallos seguidos no recibe tráfico
+      durante `reset_timeout` segundos
+    - half_open: pasado ese tiempo admite una única petición de prueba; si
+      va bien se cierra y si falla se vuelve a abrir
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, url: str):
+        self.url = url
+        self.state = self.CLOSED
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.latency: Optional[float] = None  # Media móvil exponencial (segundos)
+        self.probe_ok: Optional[bool] = None
+        self.probe_latency: Optional[float] = None
+
+    @property
+    def health_url(self) -> str:
+        return self.url.replace('/v1/chat/completions', '/health')
+
+
+class LLMBackendPool:
+    """
+    Reparte las peticiones al LLM entre varios backends
+
+    Cada petición va al backend con menos peticiones en curso (least
+    outstanding requests) entre los que su circuit breaker deja pasar; a
+    igualdad, al de menor latencia. El resultado de cada petición
+    (`release`) alimenta el breaker: cuentan como fallo los errores de
+    conexión, timeouts y respuestas 5xx/429. Thread-safe; el servidor
+    asíncrono usa la misma instancia desde el event loop.
+    """
+
+    LATENCY_ALPHA = 0.2
+
+    def __init__(
+        self,
+        urls: List[str],
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0
+    ):
+        self.backends = [LLMBackend(url) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+
+    def _available(self, backend: LLMBackend, now: float) -> bool:
+        if backend.state == LLMBackend.CLOSED:
+            return True
+        if backend.state == LLMBackend.OPEN:
+            return now - backend.opened_at >= self.reset_timeout
+        # half_open: solo si no hay ya una petición de prueba en curso
+        return backend.in_flight == 0
+
+    def has_available(self, exclude: List[LLMBackend]) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            return any(
+                backend not in exclude and self._available(backend, now)
+                for backend in self.backends
+            )
+
+    def acquire(self, exclude: Optional[List[LLMBackend]] = None) -> LLMBackend:
+        """Reserva el backend elegido; el llamador debe llamar a `release`"""
+        exclude = exclude or []
+        now = time.monotonic()
+
+        with self._lock:
+            candidates = [
+                backend for backend in self.backends
+                if backend not in exclude and self._available(backend, now)
+            ]
+            if not candidates:
+                raise NoLLMBackendAvailable(self._retry_after(now))
+
+            backend = min(
+                candidates,
+                key=lambda b: (b.in_flight, b.latency if b.latency is not None else 0.0)
+            )
+            if backend.state == LLMBackend.OPEN:
+                backend.state = LLMBackend.HALF_OPEN
+                print(f"🔌 LLM {backend.url}: half-open, enviando petición de prueba")
+
+            backend.in_flight += 1
+            backend.requests += 1
+            return backend
+
+    def release(
+        self,
+        backend: LLMBackend,
+        success: Optional[bool],
+        latency: Optional[float] = None
+    ) -> None:
+        """
+        Libera el backend y actualiza su breaker
+
+        `success` None significa resultado neutro (p.ej. el cliente cortó el
+        stream): solo se descuenta la petición en curso.
+        """
+        with self._lock:
+            backend.in_flight -= 1
+
+            if success is None:
+                return
+
+            if success:
+                if backend.state != LLMBackend.CLOSED:
+                    print(f"✅ LLM {backend.url}: circuit breaker cerrado")
+                backend.state = LLMBackend.CLOSED
+                backend.consecutive_failures = 0
+                if latency is not None:
+                    backend.latency = latency if backend.latency is None else (
+                        self.LATENCY_ALPHA * latency + (1 - self.LATENCY_ALPHA) * backend.latency
+                    )
+                return
+
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            if (backend.state == LLMBackend.HALF_OPEN
+                    or backend.consecutive_failures >= self.failure_threshold):
+                if backend.state != LLMBackend.OPEN:
+                    print(f"⚠️  LLM {backend.url}: circuit breaker abierto "
+                          f"({backend.consecutive_failures} fallos seguidos)")
+                backend.state = LLMBackend.OPEN
+                backend.opened_at = time.monotonic()
+
+    def record_probe(self, backend: LLMBackend, ok: bool, latency: float) -> None:
+        """Resultado del health check de un backend (informativo, no toca el breaker)"""
+        with self._lock:
+            backend.probe_ok = ok
+            backend.probe_latency = latency
+
+    def _retry_after(self, now: float) -> float:
+        waits = [
+            self.reset_timeout - (now - backend.opened_at)
+            for backend in self.backends
+            if backend.state == LLMBackend.OPEN
+        ]
+        return max(1.0, min(waits)) if waits else 1.0
+
+    def status(self) -> List[Dict]:
+        """Estado por backend para /health"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'url': backend.url,
+                    'state': backend.state,
+                    'connected': backend.probe_ok,
+                    'probe_latency_ms': None if backend.probe_latency is None
+                    else round(backend.probe_latency * 1000, 1),
+                    'latency_ms': None if backend.latency is None
+                    else round(backend.latency * 1000, 1),
+                    'in_flight': backend.in_flight,
+                    'requests': backend.requests,
+                    'failures': backend.failures,
+                    'consecutive_failures': backend.consecutive_failures,
+                    'retry_in_seconds': round(max(
+                        0.0, self.reset_timeout - (now - backend.opened_at)
+                    ), 1) if backend.state == LLMBackend.OPEN else None
+                }
+                for backend in self.backends
+            ]
+
+
+# === CONTROL DE ADMISIÓN (429 con Retry-After) ===
+
+class Overloaded(Exception):
+    """La cola de admisión de un endpoint está llena o la espera se agotó (HTTP 429)"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limita las peticiones concurrentes de un endpoint con una cola acotada
+
+    Hasta `limit` peticiones se ejecutan a la vez; las siguientes esperan por
+    orden de llegada (como mucho `max_queue`, durante `max_wait` segundos).
+    Si la cola está llena o la espera se agota se lanza Overloaded con un
+    Retry-After estimado a partir de lo que tarda de media cada petición.
+    Con `limit` 0 no se limita nada.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.service_time = 1.0  # Media móvil de segundos que se ocupa un hueco
+        self._waiters: deque = deque()
+        self._lock = threading.Lock()
+
+    def _enter(self, waiter_factory: Callable[[], Any]) -> Optional[Any]:
+        """Ocupa un hueco libre (devuelve None) o encola un waiter y lo devuelve"""
+        with self._lock:
+            if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+                self.active += 1
+                self.admitted += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject('queue_full')
+            waiter = waiter_factory()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _after_wait(self, waiter: Any) -> None:
+        """Tras la espera: admitido si `release` le cedió un hueco, si no Overloaded"""
+        with self._lock:
+            if waiter.is_set():
+                self.admitted += 1
+                return
+            self._waiters.remove(waiter)
+            raise self._reject('timeout')
+
+    def _reject(self, reason: str) -> Overloaded:
+        # Llamar con el lock tomado
+        self.rejected += 1
+        metrics.inc('rag_admission_rejected_total', endpoint=self.name, reason=reason)
+        retry_after = self.service_time * (len(self._waiters) + 1) / max(self.limit, 1)
+        return Overloaded(
+            f'Too many concurrent {self.name} requests, retry later',
+            max(1.0, min(retry_after, 60.0))
+        )
+
+    def wait_limit(self, deadline: Optional[float]) -> float:
+        """Espera máxima en la cola: `max_wait`, recortada al deadline de la petición"""
+        if deadline is None:
+            return self.max_wait
+        return max(0.0, min(self.max_wait, deadline - time.monotonic()))
+
+    def acquire(self, deadline: Optional[float] = None) -> float:
+        """Espera un hueco; devuelve el instante de admisión para `release`"""
+        start = time.perf_counter()
+        waiter = self._enter(threading.Event)
+        if waiter is not None:
+            waiter.wait(self.wait_limit(deadline))
+            self._after_wait(waiter)
+        admitted_at = time.perf_counter()
+        metrics.observe('rag_admission_wait_seconds', admitted_at - start, endpoint=self.name)
+        return admitted_at
+
+    def release(self, admitted_at: float) -> None:
+        """Libera el hueco, cediéndolo directamente al primero de la cola"""
+        held = time.perf_counter() - admitted_at
+        with self._lock:
+            self.service_time = 0.8 * self.service_time + 0.2 * held
+            self._free_slot()
+
+    def _free_slot(self) -> None:
+        # Llamar con el lock tomado
+        if self._waiters:
+            self._waiters.popleft().set()
+        else:
+            self.active -= 1
+
+    @contextmanager
+    def slot(self, deadline: Optional[float] = None) -> Iterator[None]:
+        admitted_at = self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release(admitted_at)
+
+    def admit(self, deadline: Optional[float] = None) -> Callable[[], None]:
+        """Como `slot`, para huecos que se liberan en otro sitio: devuelve la función que lo libera"""
+        return functools.partial(self.release, self.acquire(deadline))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'queued': len(self._waiters),
+                'max_queue': self.max_queue,
+                'max_wait': self.max_wait,
+                'admitted': self.admitted,
+                'rejected': self.rejected
+            }
+
+
+generate_admission = AdmissionController(
+    'generate',
+    config['max_concurrent_generations'],
+    config['generation_queue_size'],
+    config['generation_queue_timeout']
+)
+search_admission = AdmissionController(
+    'search',
+    config['max_concurrent_searches'],
+    config['search_queue_size'],
+    config['search_queue_timeout']
+)
+
+
+# === PETICIONES HEDGED A CHROMADB ===
+
+# Hilos por Hedger si algún límite de admisión está desactivado (0)
+UNLIMITED_HEDGE_WORKERS = 128
+
+
+def hedge_workers() -> int:
+    """Hilos por Hedger: original y copia de cada búsqueda que deja pasar la admisión"""
+    limits = (config['max_concurrent_searches'], config['max_concurrent_generations'])
+    if not all(limits):
+        return UNLIMITED_HEDGE_WORKERS
+    return 2 * sum(limits)
+
+
+class Hedger:
+    """
+    Duplica una consulta lenta (hedged request) para acotar la latencia de cola
+
+    Guarda la latencia de las últimas `window` consultas a un destino. Si una
+    consulta supera el percentil `percentile` de esas latencias, se lanza una
+    copia idéntica y se usa la primera que responda; la otra se descarta.
+    Por construcción se duplica ~(100 - percentile)% de las consultas. Con
+    menos de `min_samples` latencias registradas, o `percentile` 0, no se
+    duplica nada y la consulta corre en el thread que llama.
+
+    La latencia y el umbral se miden desde que la consulta empieza a
+    ejecutarse, no desde que entra en el pool: la espera en cola no es
+    latencia de ChromaDB. El pool (creado al primer uso) se dimensiona con
+    los límites de admisión, para no limitar la concurrencia hacia ChromaDB.
+
+    Con `deadline` la consulta corre siempre en el pool y se deja de esperar
+    al vencer (DeadlineExceeded('retrieval')): el cliente HTTP de ChromaDB no
+    admite un timeout por llamada, así que quien llama queda libre aunque la
+    consulta ya enviada termine por su cuenta. Las que empiezan con el
+    deadline vencido (tras esperar un thread) no llegan a enviarse.
+    """
+
+    def __init__(self, name: str, percentile: float = 95.0, window: int = 256, min_samples: int = 20):
+        self.name = name
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.hedged = 0
+        self.wins = 0
+        self._latencies: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def threshold(self) -> Optional[float]:
+        """Segundos tras los que se duplica una consulta (None: no se duplica)"""
+        if self.percentile <= 0:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, math.ceil(self.percentile / 100 * len(latencies)) - 1)
+        return latencies[index]
+
+    def _record(self, elapsed: float) -> None:
+        with self._lock:
+            self._latencies.append(elapsed)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=hedge_workers(),
+                    thread_name_prefix=f'hedge-{self.name}'
+                )
+            return self._executor
+
+    def call(self, func: Callable[[], Any], deadline: Optional[float] = None) -> Any:
+        threshold = self.threshold()
+
+        if threshold is None and deadline is None:
+            start = time.perf_counter()
+            result = func()
+            self._record(time.perf_counter() - start)
+            return result
+
+        # Se registra la latencia de la consulta original aunque gane la copia,
+        # para que el umbral refleje la distribución sin hedging
+        started: List[float] = []
+
+        def attempt() -> Any:
+            check_deadline(deadline, 'retrieval')
+            return func()
+
+        def original() -> Any:
+            check_deadline(deadline, 'retrieval')
+            started.append(time.perf_counter())
+            try:
+                return func()
+            finally:
+                self._record(time.perf_counter() - started[0])
+
+        executor = self._pool()
+        first = executor.submit(original)
+        pending = {first}
+
+        if threshold is not None:
+            wait = threshold
+            while wait > 0:
+                left = time_left(deadline)
+                try:
+                    return first.result(timeout=wait if left is None else min(wait, left))
+                except FutureTimeout:
+                    check_deadline(deadline, 'retrieval')
+                    # Si esperó en el pool, el umbral cuenta desde que empezó
+                    wait = started[0] + threshold - time.perf_counter() if started else threshold
+
+            with self._lock:
+                self.hedged += 1
+            metrics.inc('rag_hedged_requests_total', target=self.name)
+            pending.add(executor.submit(attempt))
+
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait_futures(pending, timeout=time_left(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded('retrieval')
+            for future in done:
+                if future.exception() is None:
+                    if future is not first:
+                        with self._lock:
+                            self.wins += 1
+                        metrics.inc('rag_hedge_wins_total', target=self.name)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def stats(self) -> Dict:
+        threshold = self.threshold()
+        with self._lock:
+            return {
+                'target': self.name,
+                'threshold_ms': round(threshold * 1000, 1) if threshold is not None else None,
+                'hedged': self.hedged,
+                'wins': self.wins
+            }
+
+
+# Consultas a la colección única de ChromaDB (con --shards cada shard tiene el suyo)
+chroma_hedger = Hedger('chromadb', config['hedge_percentile'])
+
+
+class AsyncAdmissionController(AdmissionController):
+    """Versión asyncio de AdmissionController (se usa solo desde el event loop)"""
+
+    async def acquire(self, deadline: Optional[float] = None) -> float:
+        start = time.perf_counter()
+        waiter = self._enter(asyncio.Event)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.wait(), self.wait_limit(deadline))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # Cliente desconectado en la cola: salir de ella o devolver el hueco cedido
+                with self._lock:
+                    if waiter.is_set():
+                        self._free_slot()
+                    else:
+                        self._waiters.remove(waiter)
+                raise
+            self._after_wait(waiter)
+        admitted_at = time.perf_counter()
+        metrics.observe('rag_admission_wait_seconds', admitted_at - start, endpoint=self.name)
+        return admitted_at
+
+    @asynccontextmanager
+    async def slot(self, deadline: Optional[float] = None) -> AsyncIterator[None]:
+        admitted_at = await self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release(admitted_at)
+
+    async def admit(self, deadline: Optional[float] = None) -> Callable[[], None]:
+        return functools.partial(self.release, await self.acquire(deadline))
+
+
+async_generate_admission = AsyncAdmissionController(
+    'generate',
+    config['max_concurrent_generations'],
+    config['generation_queue_size'],
+    config['generation_queue_timeout']
+)
+async_search_admission = AsyncAdmissionController(
+    'search',
+    config['max_concurrent_searches'],
+    config['search_queue_size'],
+    config['search_queue_timeout']
+)
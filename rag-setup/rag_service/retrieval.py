@@ -0,0 +1,576 @@
+"""Conexión a ChromaDB, búsqueda híbrida, fusión de rankings y diversidad (MMR)"""
+
+import functools
+import sys
+import threading
+import time
+from typing import Hashable, List, Dict, Optional, Tuple
+
+from .bm25 import BM25Index
+from .caching import filter_key, normalize_text, retrieval_cache, retrieval_flight
+from .lazy import chromadb, np
+from .local_index import LocalVectorIndex
+from .metrics import timed
+from .resilience import DeadlineExceeded, check_deadline, chroma_hedger
+from .settings import config
+from .sharding import COLLECTION_NAME, ShardedCollection, search_deadline, track_search
+
+
+# Cliente ChromaDB global (chroma_client es None con el índice local)
+chroma_client = None
+collection = None
+
+# Índice BM25 para búsqueda híbrida (None si no se usa --bm25-index)
+bm25_index = None
+
+
+class DocumentCounter:
+    """
+    Número de documentos de la colección cacheado en memoria
+
+    Evita un collection.count() (round trip a ChromaDB) en cada /generate.
+    El valor se actualiza cuando lo consulta el monitor de estado, al llamar
+    a POST /admin/refresh o, si nadie lo ha hecho, cuando supera `max_age`.
+    """
+
+    def __init__(self, max_age: float = 30.0):
+        self.max_age = max_age
+        self._count: Optional[int] = None
+        self._updated_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def cached(self) -> Optional[int]:
+        """Último valor conocido (None si nunca se ha contado)"""
+        with self._lock:
+            return self._count
+
+    def get(self) -> int:
+        with self._lock:
+            if (self._count is not None
+                    and time.monotonic() - self._updated_at < self.max_age):
+                return self._count
+        return self.refresh()
+
+    def refresh(self) -> int:
+        count = collection.count()
+        self.set(count)
+        return count
+
+    def set(self, count: int) -> None:
+        with self._lock:
+            self._count = count
+            self._updated_at = time.monotonic()
+
+
+# Número de documentos cacheado para el hot path de /generate y /search
+document_counter = DocumentCounter(max_age=config['doc_count_max_age'])
+
+
+def init_local_index():
+    """Abre el índice exportado en config['index_dir'] en lugar de ChromaDB"""
+    global chroma_client, collection
+
+    if np is None:
+        print("❌ NumPy no instalado (necesario para --index-dir). Ejecuta: pip install numpy")
+        sys.exit(1)
+
+    try:
+        chroma_client = None
+        collection = LocalVectorIndex(config['index_dir'])
+
+        print(f"✅ Índice local cargado: {config['index_dir']}")
+        print(f"   📊 Documentos: {document_counter.refresh()}")
+
+    except Exception as e:
+        print(f"❌ Error cargando índice local: {e}")
+        print("\n💡 Exporta el índice desde ChromaDB:")
+        print("   python process_adhd_books.py --export-index ./index")
+        sys.exit(1)
+
+
+def init_sharded_collection():
+    """Conecta con los shards de config['shards'] en lugar de una sola colección"""
+    global chroma_client, collection
+
+    chroma_client = None
+    collection = ShardedCollection(config['shards'], config['shard_timeout'], config['chroma_port'])
+
+    try:
+        documents = document_counter.refresh()
+    except Exception as e:
+        print(f"❌ Error conectando a ChromaDB: {e}")
+        print("\n💡 Verifica que los shards estén corriendo:")
+        for shard in collection.shards:
+            print(f"   {shard.label}")
+        sys.exit(1)
+
+    print(f"✅ Conectado a {len(collection.shards)} shards de ChromaDB")
+    for shard in collection.shards:
+        state = f"{shard.documents} documentos" if shard.connected else "⚠️  sin respuesta"
+        print(f"   📊 {shard.label}: {state}")
+    print(f"   📊 Documentos: {documents}")
+
+
+# Constante k de reciprocal-rank fusion (valor habitual en la literatura)
+RRF_K = 60
+
+
+def init_bm25_index() -> None:
+    """Carga (o recarga) el índice BM25 de config['bm25_index']"""
+    global bm25_index
+
+    try:
+        if bm25_index is None:
+            bm25_index = BM25Index(config['bm25_index'])
+        else:
+            bm25_index.load()
+        print(f"✅ Índice BM25: {bm25_index.count()} chunks")
+    except Exception as e:
+        print(f"⚠️  Índice BM25 no disponible ({config['bm25_index']}): {e}")
+        print("   Búsqueda solo vectorial hasta el próximo /admin/refresh")
+
+
+def hybrid_enabled() -> bool:
+    return bm25_index is not None and config['hybrid_weight'] > 0
+
+
+def fetch_documents(
+    by_id: Dict[str, Dict],
+    ids: List[str],
+    with_embeddings: bool = False,
+    where: Optional[Dict] = None
+) -> None:
+    """Añade a `by_id` los chunks pedidos por ID (solo los que cumplen `where`)"""
+    if not ids:
+        return
+    include = ['documents', 'metadatas'] + (['embeddings'] if with_embeddings else [])
+    fetched = collection.get(ids=ids, where=where, include=include)
+    for i, (doc_id, text, metadata) in enumerate(zip(
+        fetched['ids'], fetched['documents'], fetched['metadatas']
+    )):
+        by_id[doc_id] = {'id': doc_id, 'text': text, 'metadata': metadata}
+        if with_embeddings:
+            by_id[doc_id]['embedding'] = fetched['embeddings'][i]
+
+
+def fuse_rankings(
+    query: str,
+    vector_docs: List[Dict],
+    n_results: int,
+    with_embeddings: bool = False,
+    where: Optional[Dict] = None
+) -> List[Dict]:
+    """
+    Combina el ranking vectorial con el de BM25 (reciprocal-rank fusion)
+
+    score = (1 - w) / (k + rango_vectorial) + w / (k + rango_bm25), con
+    w = config['hybrid_weight']. Los chunks que solo encontró BM25 se piden a
+    la colección por ID. `relevance` pasa a ser el score fusionado
+    normalizado: 1.0 es el primer puesto en ambos rankings.
+    """
+    weight = config['hybrid_weight']
+    hits = bm25_index.search(query, config['hybrid_candidates'])
+
+    by_id = {doc['id']: doc for doc in vector_docs}
+    if where:
+        # El índice BM25 no tiene metadata: sus candidatos se filtran con el mismo where
+        fetch_documents(by_id, [doc_id for doc_id, _ in hits if doc_id not in by_id], with_embeddings, where)
+        hits = [(doc_id, score) for doc_id, score in hits if doc_id in by_id]
+
+    scores: Dict[str, float] = {}
+    for rank, doc in enumerate(vector_docs, 1):
+        scores[doc['id']] = (1 - weight) / (RRF_K + rank)
+    for rank, (doc_id, _) in enumerate(hits, 1):
+        scores[doc_id] = scores.get(doc_id, 0.0) + weight / (RRF_K + rank)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:n_results]
+
+    fetch_documents(by_id, [doc_id for doc_id in ranked if doc_id not in by_id], with_embeddings)
+
+    # Chunks del índice BM25 que ya no están en la colección se descartan
+    return [
+        dict(by_id[doc_id], relevance=scores[doc_id] * (RRF_K + 1))
+        for doc_id in ranked
+        if doc_id in by_id
+    ]
+
+
+def query_collection(
+    query_texts: List[str],
+    n_results: int,
+    with_embeddings: bool = False,
+    where: Optional[Dict] = None
+) -> List[List[Dict]]:
+    """
+    collection.query para varias queries, con fusión BM25 si está activa
+
+    En modo híbrido se piden siempre al menos `hybrid_candidates` resultados
+    vectoriales, así el resultado para un n_results menor es un prefijo del
+    de uno mayor (lo que asume el caché de búsquedas). Con `with_embeddings`
+    cada documento lleva además su 'embedding' (para MMR). `where` es una
+    cláusula de ChromaDB sobre la metadata (ver parse_metadata_filter).
+
+    Respeta el deadline de track_search: lanza DeadlineExceeded si vence
+    durante la consulta o antes de la fusión con BM25.
+    """
+    hybrid = hybrid_enabled()
+    fetch_n = max(n_results, config['hybrid_candidates']) if hybrid else n_results
+
+    include = ['documents', 'metadatas', 'distances']
+    if with_embeddings:
+        include.append('embeddings')
+
+    query = functools.partial(
+        collection.query,
+        query_texts=query_texts,
+        n_results=fetch_n,
+        where=where,
+        include=include
+    )
+
+    with timed('retrieval'):
+        deadline = search_deadline()
+        # Índice local y shards: sin hedging aquí (en proceso / ya lo hace cada shard)
+        results = chroma_hedger.call(query, deadline) if chroma_client is not None else query()
+        documents = [
+            documents_from_results(results, i, with_embeddings)
+            for i in range(len(query_texts))
+        ]
+
+        if hybrid:
+            check_deadline(deadline, 'retrieval')
+            documents = [
+                fuse_rankings(query, docs, n_results, with_embeddings, where)
+                for query, docs in zip(query_texts, documents)
+            ]
+
+    return documents
+
+
+def init_chromadb():
+    """Inicializa conexión a ChromaDB (o el índice local con --index-dir)"""
+    global chroma_client, collection
+
+    if config['index_dir']:
+        init_local_index()
+        return
+
+    if config['shards']:
+        init_sharded_collection()
+        return
+
+    try:
+        chroma_client = chromadb.HttpClient(
+            host=config['chroma_host'],
+            port=config['chroma_port']
+        )
+
+        # Test connection
+        chroma_client.heartbeat()
+
+        # Obtener colección
+        collection = chroma_client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            metadata={
+                "description": "ADHD specialized books and resources",
+                "language": "es"
+            }
+        )
+
+        print(f"✅ Conectado a ChromaDB")
+        print(f"   📊 Documentos: {document_counter.refresh()}")
+
+    except Exception as e:
+        print(f"❌ Error conectando a ChromaDB: {e}")
+        print("\n💡 Verifica que ChromaDB esté corriendo:")
+        print("   docker ps | grep chromadb")
+        sys.exit(1)
+
+
+def validate_retrieval_cache(doc_count: Optional[int] = None) -> None:
+    """
+    Vacía el caché de búsquedas si cambió el número de documentos
+
+    Si no se pasa `doc_count` se usa el valor cacheado de document_counter.
+    """
+    if doc_count is None:
+        doc_count = document_counter.get()
+
+    retrieval_cache.validate(doc_count)
+
+
+def search_knowledge(
+    query: str,
+    n_results: int = 3,
+    doc_count: Optional[int] = None,
+    diversity: float = 0.0,
+    fetch_k: Optional[int] = None,
+    where: Optional[Dict] = None,
+    deadline: Optional[float] = None
+) -> List[Dict]:
+    """
+    Busca en la base de conocimiento
+
+    Los resultados se guardan en caché por query normalizada; una búsqueda
+    con menos `n_results` que una ya cacheada se sirve recortando esa.
+
+    Args:
+        query: Consulta de búsqueda
+        n_results: Número de resultados
+        doc_count: Documentos en la colección si el llamador ya lo conoce
+            (para validar el caché sin otra llamada a ChromaDB)
+        diversity: Si > 0, se recuperan `fetch_k` candidatos y se eligen
+            `n_results` con MMR (ver mmr_select)
+        fetch_k: Tamaño del pool de candidatos para MMR
+        where: Filtro de metadata (cláusula where de ChromaDB)
+        deadline: Instante (time.monotonic) en que debe terminar la búsqueda.
+            Se comprueba antes de consultar, antes de la fusión BM25 y antes
+            de MMR, y acota la espera a ChromaDB. Si vence se lanza
+            DeadlineExceeded('retrieval') en vez de devolver [].
+
+    Returns:
+        Lista de documentos relevantes
+    """
+    if collection is None:
+        raise RuntimeError("ChromaDB no inicializado")
+
+    use_mmr = diversity > 0 and np is not None
+    fetch_k = max(fetch_k or config['fetch_k'], n_results)
+    # Con MMR el resultado depende también de diversity y fetch_k
+    flight_key = (
+        (normalize_text(query), diversity, fetch_k) if use_mmr
+        else normalize_text(query)
+    )
+    if where:
+        flight_key = (flight_key, filter_key(where))
+
+    cache_key = None
+    if retrieval_cache.enabled:
+        try:
+            validate_retrieval_cache(doc_count)
+        except Exception as e:
+            print(f"Error validando caché de búsqueda: {e}")
+            retrieval_cache.clear()
+
+        cache_key = flight_key
+        cached = get_cached_retrieval(cache_key, n_results)
+        if cached is not None:
+            return cached
+
+    def fetch() -> Tuple[List[Dict], bool]:
+        """(documentos, parcial): parcial si algún shard no respondió"""
+        check_deadline(deadline, 'retrieval')
+        with track_search(deadline) as missing:
+            if not use_mmr:
+                documents = query_collection([query], n_results, where=where)[0]
+            else:
+                candidates = query_collection([query], fetch_k, with_embeddings=True, where=where)[0]
+                check_deadline(deadline, 'retrieval')
+                with timed('mmr'):
+                    documents = mmr_select(candidates, n_results, diversity)
+        return documents, bool(missing)
+
+    try:
+        if config['coalesce_requests']:
+            # Búsquedas idénticas concurrentes comparten una sola consulta
+            try:
+                documents, partial = retrieval_flight.do(
+                    (flight_key, n_results), fetch, deadline, 'retrieval'
+                )
+            except DeadlineExceeded:
+                # Venció nuestra espera o el deadline de la búsqueda que la ejecutaba;
+                # en el segundo caso se reintenta con el nuestro si aún queda tiempo
+                check_deadline(deadline, 'retrieval')
+                documents, partial = fetch()
+        else:
+            documents, partial = fetch()
+
+        if cache_key is not None and not partial:
+            retrieval_cache.set(cache_key, {
+                'n_results': n_results,
+                'documents': documents
+            })
+
+        return documents[:]
+
+    except DeadlineExceeded:
+        raise
+
+    except Exception as e:
+        print(f"Error en búsqueda: {e}")
+        return []
+
+
+def search_knowledge_batch(
+    queries: List[Tuple[str, int]],
+    doc_count: Optional[int] = None,
+    where: Optional[Dict] = None
+) -> List[List[Dict]]:
+    """
+    Busca varias queries con una sola llamada a ChromaDB
+
+    Las queries ya presentes en el caché de búsquedas no se envían; el resto
+    (sin duplicados) se consulta en un único collection.query con el mayor
+    n_results pedido y luego se recorta cada resultado.
+
+    Args:
+        queries: Lista de tuplas (query, n_results)
+        doc_count: Documentos en la colección si el llamador ya lo conoce
+        where: Filtro de metadata común a todas las queries
+
+    Returns:
+        Lista de resultados en el mismo orden que `queries`
+    """
+    if collection is None:
+        raise RuntimeError("ChromaDB no inicializado")
+
+    if retrieval_cache.enabled:
+        try:
+            validate_retrieval_cache(doc_count)
+        except Exception as e:
+            print(f"Error validando caché de búsqueda: {e}")
+            retrieval_cache.clear()
+
+    results_by_position: List[Optional[List[Dict]]] = [None] * len(queries)
+    pending: Dict[Hashable, int] = {}  # clave de caché -> n_results máximo
+    pending_text: Dict[Hashable, str] = {}
+
+    # Mismas claves de caché que search_knowledge sin MMR
+    def cache_key(query: str) -> Hashable:
+        key = normalize_text(query)
+        return (key, filter_key(where)) if where else key
+
+    for i, (query, n_results) in enumerate(queries):
+        key = cache_key(query)
+        if retrieval_cache.enabled:
+            cached = get_cached_retrieval(key, n_results)
+            if cached is not None:
+                results_by_position[i] = cached
+                continue
+        pending[key] = max(n_results, pending.get(key, 0))
+        pending_text.setdefault(key, query)
+
+    if pending:
+        keys = list(pending)
+        n_max = max(pending.values())
+
+        try:
+            with track_search() as missing:
+                batch_documents = query_collection(
+                    [pending_text[key] for key in keys],
+                    n_max,
+                    where=where
+                )
+            # Sin caché si algún shard no respondió (resultado parcial)
+            partial = bool(missing)
+
+            fetched = {}
+            for key, documents in zip(keys, batch_documents):
+                fetched[key] = documents
+                if not partial:
+                    retrieval_cache.set(key, {
+                        'n_results': n_max,
+                        'documents': documents
+                    })
+
+        except Exception as e:
+            print(f"Error en búsqueda batch: {e}")
+            fetched = {key: [] for key in keys}
+
+        for i, (query, n_results) in enumerate(queries):
+            if results_by_position[i] is None:
+                results_by_position[i] = fetched[cache_key(query)][:n_results]
+
+    return results_by_position
+
+
+def get_cached_retrieval(cache_key: Hashable, n_results: int) -> Optional[List[Dict]]:
+    """Resultado cacheado con al menos `n_results` documentos, o None"""
+    cached = retrieval_cache.get(
+        cache_key,
+        # Sirve si se pidieron al menos n_results o la colección no tenía más
+        usable=lambda entry: (
+            entry['n_results'] >= n_results
+            or len(entry['documents']) < entry['n_results']
+        )
+    )
+    if cached is None:
+        return None
+    return cached['documents'][:n_results]
+
+
+def documents_from_results(
+    results: Dict,
+    index: int,
+    with_embeddings: bool = False
+) -> List[Dict]:
+    """
+    Convierte la respuesta de collection.query en lista de documentos
+
+    Args:
+        results: Respuesta de ChromaDB
+        index: Posición de la query dentro de `query_texts`
+        with_embeddings: Añadir 'embedding' a cada documento (pedido con
+            include=['embeddings'])
+    """
+    documents = []
+    for i, (doc_id, doc, metadata, distance) in enumerate(zip(
+        results['ids'][index],
+        results['documents'][index],
+        results['metadatas'][index],
+        results['distances'][index]
+    )):
+        documents.append({
+            'id': doc_id,
+            'text': doc,
+            'metadata': metadata,
+            'relevance': 1 - distance  # Convertir distancia a score de relevancia
+        })
+        if with_embeddings:
+            documents[-1]['embedding'] = results['embeddings'][index][i]
+
+    return documents
+
+
+def mmr_select(documents: List[Dict], n_results: int, diversity: float) -> List[Dict]:
+    """
+    Selección por maximal marginal relevance sobre un pool de candidatos
+
+    En cada paso elige el candidato que maximiza
+    (1 - diversity) * relevance - diversity * max_sim(candidato, elegidos),
+    con la similitud coseno entre embeddings calculada de una vez como
+    matriz. Evita devolver chunks contiguos de la misma página que repiten
+    casi el mismo texto. La selección es voraz, así que el resultado para un
+    n_results menor es un prefijo del de uno mayor.
+
+    Args:
+        documents: Candidatos (con 'relevance' y 'embedding')
+        n_results: Documentos a devolver
+        diversity: 0 = solo relevancia, 1 = solo diversidad
+
+    Returns:
+        Documentos elegidos, sin 'embedding'
+    """
+    if not documents:
+        return []
+
+    embeddings = np.asarray([doc['embedding'] for doc in documents], dtype=np.float32)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    similarity = embeddings @ embeddings.T
+    relevance = np.asarray([doc['relevance'] for doc in documents], dtype=np.float32)
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+
+    for _ in range(min(n_results, len(documents)) - 1):
+        scores = (1 - diversity) * relevance - diversity * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+    return [
+        {key: value for key, value in documents[i].items() if key != 'embedding'}
+        for i in selected
+    ]
@@ -0,0 +1,725 @@
+"""Servidor asíncrono sobre aiohttp (--server async)"""
+
+import asyncio
+import functools
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import copy_context
+from typing import Any, AsyncIterator, Callable, List, Dict, Optional, Tuple
+
+from .api import (
+    begin_request_timing, cached_stream_events, check_chromadb, coalescing_key, compact_documents,
+    end_request_timing, finish_generation, finish_stream, health_response, json_payload,
+    prepare_generation, refresh_document_count, render_metrics, search_batch_response,
+    search_response, stats_response, status_monitor
+)
+from .caching import async_generation_flight, async_stream_flight
+from .lazy import aiohttp, web
+from .llm import LLMHttpClient, LLMStreamParser, build_llm_request
+from .metrics import metrics, record_llm_usage, record_stage, timed
+from .query_log import query_log
+from .resilience import (
+    DEADLINE_HEADER, DeadlineExceeded, LLMBackend, NoLLMBackendAvailable, Overloaded,
+    async_generate_admission, async_search_admission, deadline_passed, retry_delay
+)
+from .retrieval import search_knowledge, search_knowledge_batch
+from .settings import config
+from .sse import SSE_HEADERS, sse_event
+from .startup import STARTUP_ENDPOINTS, starting_health, startup
+from .validation import (
+    RequestError, parse_diversity, parse_generate_request, parse_metadata_filter,
+    parse_search_batch_request, parse_search_options, parse_search_request, wants_fresh
+)
+from . import llm
+
+
+# === SERVIDOR ASÍNCRONO (--server async) ===
+# Mismos endpoints y contratos JSON que el servidor Flask, sobre aiohttp.
+# Las llamadas al LLM son no bloqueantes y están limitadas por un semáforo
+# (--llm-concurrency); las de ChromaDB (cliente síncrono) se ejecutan en un
+# pool de threads para no bloquear el event loop.
+
+class AsyncLLMClient:
+    """
+    Cliente aiohttp para el LLM con keep-alive, reintentos y concurrencia acotada
+
+    Aplica la misma política de reintentos que LLMHttpClient.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 2,
+        backoff: float = 0.5,
+        concurrency: int = 8
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.concurrency = concurrency
+
+        self.session = None
+        self.semaphore = None
+
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.waiting = 0
+
+    async def start(self) -> None:
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.connect_timeout,
+                sock_read=self.read_timeout
+            )
+        )
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+    def _timeout(self, deadline: Optional[float]) -> Optional['aiohttp.ClientTimeout']:
+        """Timeout de un intento recortado al deadline (None: el de la sesión)"""
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded('llm')
+        # `total` cubre también la lectura del body (todo el stream)
+        return aiohttp.ClientTimeout(
+            sock_connect=min(self.connect_timeout, remaining),
+            sock_read=self.read_timeout,
+            total=remaining
+        )
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        deadline: Optional[float] = None,
+        **kwargs
+    ) -> 'aiohttp.ClientResponse':
+        attempt = 0
+        while True:
+            self.requests += 1
+            timeout = self._timeout(deadline)
+            if timeout is not None:
+                kwargs['timeout'] = timeout
+            try:
+                response = await self.session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                retryable = method.upper() == 'GET' or is_async_connect_error(e)
+                if not retryable or attempt >= self.max_retries or deadline_passed(deadline):
+                    self.failures += 1
+                    raise
+                await self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+
+            retry_after = response.headers.get('Retry-After')
+            if (LLMHttpClient.should_retry_status(method, response.status, retry_after)
+                    and attempt < self.max_retries and not deadline_passed(deadline)):
+                response.release()
+                await self._sleep_before_retry(attempt, retry_after)
+                attempt += 1
+                continue
+
+            return response
+
+    async def _sleep_before_retry(self, attempt: int, retry_after: Optional[str] = None) -> None:
+        self.retries += 1
+        await asyncio.sleep(retry_delay(attempt, self.backoff, retry_after=retry_after))
+
+    async def _acquire(self) -> None:
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    async def post_json(
+        self,
+        url: str,
+        payload: Dict,
+        headers: Dict,
+        deadline: Optional[float] = None
+    ) -> Dict:
+        await self._acquire()
+        try:
+            async with await self._request(
+                'POST', url, deadline=deadline, json=payload, headers=headers
+            ) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        url: str,
+        payload: Dict,
+        headers: Dict,
+        deadline: Optional[float] = None
+    ) -> AsyncIterator['aiohttp.ClientResponse']:
+        """Respuesta en streaming (ya comprobado el status) dentro de un `async with`"""
+        await self._acquire()
+        try:
+            async with await self._request(
+                'POST', url, deadline=deadline, json=payload, headers=headers
+            ) as response:
+                response.raise_for_status()
+                yield response
+        finally:
+            self._release()
+
+    async def probe(self, url: str, timeout: float = 5.0) -> bool:
+        try:
+            async with self.session.get(
+                url,
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, total=timeout)
+            ) as response:
+                return response.status == 200
+        except Exception:
+            return False
+
+    def stats(self) -> Dict:
+        return {
+            'pool_size': self.pool_size,
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'concurrency_limit': self.concurrency,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting
+        }
+
+
+async def run_blocking(func: Callable, *args) -> Any:
+    """
+    Ejecuta una función bloqueante (ChromaDB) en el pool de threads
+
+    Copia el contexto actual para que las métricas por petición sigan
+    registrándose en el desglose de la petición.
+    """
+    loop = asyncio.get_running_loop()
+    context = copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args))
+
+
+def is_async_connect_error(error: BaseException) -> bool:
+    """Versión aiohttp de is_connect_error (ConnectionTimeoutError existe desde aiohttp 3.10)"""
+    connect_errors = (aiohttp.ClientConnectorError, getattr(aiohttp, 'ConnectionTimeoutError', ()))
+    return isinstance(error, connect_errors)
+
+
+def is_async_backend_failure(error: BaseException) -> bool:
+    """Versión aiohttp de is_backend_failure"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+async def apost_to_llm(payload: Dict, headers: Dict, deadline: Optional[float] = None) -> Dict:
+    """Versión no bloqueante de post_to_llm para respuestas JSON (libera el backend)"""
+    tried: List[LLMBackend] = []
+
+    while True:
+        backend = llm.llm_backends.acquire(exclude=tried)
+        start = time.perf_counter()
+        success = None
+        try:
+            data = await llm.async_llm.post_json(backend.url, payload, headers, deadline=deadline)
+            success = True
+            return data
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if isinstance(e, asyncio.TimeoutError) and deadline_passed(deadline):
+                raise DeadlineExceeded('llm') from e
+            success = not is_async_backend_failure(e)
+            tried.append(backend)
+            if is_async_connect_error(e) and llm.llm_backends.has_available(tried):
+                print(f"⚠️  LLM {backend.url} no responde ({e}); probando otro backend")
+                continue
+            raise
+
+        finally:
+            llm.llm_backends.release(backend, success, time.perf_counter() - start)
+
+
+async def agenerate_with_llm(
+    user_message: str,
+    context_docs: List[Dict],
+    max_tokens: int = 1000,
+    temperature: float = 0.7,
+    deadline: Optional[float] = None
+) -> Dict:
+    """Versión no bloqueante de generate_with_llm"""
+    with timed('prompt_build'):
+        payload, headers = build_llm_request(
+            user_message, context_docs, max_tokens, temperature
+        )
+
+    try:
+        start = time.perf_counter()
+        with timed('llm'):
+            data = await apost_to_llm(payload, headers, deadline=deadline)
+    except (aiohttp.ClientError, asyncio.TimeoutError, NoLLMBackendAvailable) as e:
+        print(f"Error llamando al LLM: {e}")
+        raise
+
+    record_llm_usage(data.get('usage') or {}, time.perf_counter() - start)
+
+    return {
+        'response': data['choices'][0]['message']['content'],
+        'model': config['model_id'],
+        'tokens_used': data.get('usage', {}).get('total_tokens', 0),
+        'sources_used': len(context_docs)
+    }
+
+
+async def astream_with_llm(
+    user_message: str,
+    context_docs: List[Dict],
+    max_tokens: int = 1000,
+    temperature: float = 0.7,
+    deadline: Optional[float] = None
+) -> AsyncIterator[Dict]:
+    """Versión no bloqueante de stream_with_llm (mismos eventos)"""
+    with timed('prompt_build'):
+        payload, headers = build_llm_request(
+            user_message, context_docs, max_tokens, temperature, stream=True
+        )
+
+    parser = LLMStreamParser()
+    start = time.perf_counter()
+    first_token_at = None
+
+    with timed('llm'):
+        tried: List[LLMBackend] = []
+        while True:
+            backend = llm.llm_backends.acquire(exclude=tried)
+            success = None
+            try:
+                async with llm.async_llm.stream(
+                    backend.url, payload, headers, deadline=deadline
+                ) as response:
+                    async for raw_line in response.content:
+                        line = raw_line.decode('utf-8', errors='replace').strip()
+                        for token in parser.feed(line):
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                                record_stage('llm_first_token', first_token_at - start)
+                            yield {'token': token}
+                        if parser.finished:
+                            break
+                        if deadline_passed(deadline, slack=0.0):
+                            raise DeadlineExceeded('llm')
+                success = True
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, asyncio.TimeoutError) and deadline_passed(deadline):
+                    raise DeadlineExceeded('llm') from e
+                success = not is_async_backend_failure(e)
+                tried.append(backend)
+                # Solo se cambia de backend si aún no se emitió ningún token
+                if (first_token_at is None
+                        and is_async_connect_error(e)
+                        and llm.llm_backends.has_available(tried)):
+                    print(f"⚠️  LLM {backend.url} no responde ({e}); probando otro backend")
+                    continue
+                raise
+
+            finally:
+                llm.llm_backends.release(backend, success, time.perf_counter() - start)
+
+            break
+
+    parser.record_usage(time.perf_counter() - start)
+    yield parser.summary(context_docs)
+
+
+async def aprobe_llm() -> bool:
+    """Versión no bloqueante de probe_llm (backends en paralelo)"""
+    async def probe(backend: LLMBackend) -> bool:
+        start = time.perf_counter()
+        ok = await llm.async_llm.probe(backend.health_url)
+        llm.llm_backends.record_probe(backend, ok, time.perf_counter() - start)
+        return ok
+
+    results = await asyncio.gather(*(probe(backend) for backend in llm.llm_backends.backends))
+    return any(results)
+
+
+async def read_json_body(request: 'web.Request') -> Optional[Dict]:
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def async_health(request: 'web.Request') -> 'web.Response':
+    """Health check (ver health)"""
+    if not startup.ready:
+        return web.json_response(starting_health(), status=503)
+
+    snapshot = None if wants_fresh(request.query) else status_monitor.health()
+
+    if snapshot is None:
+        chroma_ok, doc_count = await run_blocking(check_chromadb)
+        llm_ok = await aprobe_llm()
+        body, status_code = health_response(chroma_ok, doc_count, llm_ok)
+        status_monitor.store_health(body, status_code)
+        age = 0.0
+    else:
+        body, status_code, age = snapshot
+
+    return web.json_response(
+        dict(body, age_seconds=round(age, 3), startup=startup.status()),
+        status=status_code
+    )
+
+
+async def async_stats(request: 'web.Request') -> 'web.Response':
+    """Estadísticas de la base de conocimiento (ver stats)"""
+    try:
+        snapshot = None if wants_fresh(request.query) else status_monitor.stats()
+
+        if snapshot is None:
+            snapshot = (await run_blocking(status_monitor.refresh_stats), 0.0)
+
+        body = stats_response(*snapshot)
+        body['llm_client'] = llm.async_llm.stats()
+        return web.json_response(body)
+
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def async_metrics(request: 'web.Request') -> 'web.Response':
+    """Métricas en formato de texto Prometheus"""
+    return web.Response(text=render_metrics(), content_type='text/plain')
+
+
+async def async_admin_refresh(request: 'web.Request') -> 'web.Response':
+    """Fuerza el recuento de documentos (ver admin_refresh)"""
+    try:
+        return web.json_response(await run_blocking(refresh_document_count))
+
+    except Exception as e:
+        print(f"Error en /admin/refresh: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def async_search(request: 'web.Request') -> 'web.Response':
+    """Busca en la base de conocimiento (ver search)"""
+    try:
+        data = await read_json_body(request)
+        query, n_results = parse_search_request(data)
+        diversity, fetch_k = parse_diversity(data, n_results)
+        fields, snippet_length = parse_search_options(data)
+        where = parse_metadata_filter(data)
+
+        async with async_search_admission.slot():
+            documents = await run_blocking(
+                search_knowledge, query, n_results, None, diversity, fetch_k, where
+            )
+
+        documents = compact_documents(documents, query, fields, snippet_length)
+        return async_encoded_json_response(request, search_response(documents))
+
+    except RequestError as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+    except Overloaded as e:
+        return async_overloaded_response(e)
+
+    except Exception as e:
+        print(f"Error en /search: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def async_search_batch(request: 'web.Request') -> 'web.Response':
+    """Varias búsquedas en una sola llamada a ChromaDB (ver search_batch)"""
+    try:
+        data = await read_json_body(request)
+        queries = parse_search_batch_request(data)
+        fields, snippet_length = parse_search_options(data)
+        where = parse_metadata_filter(data)
+
+        async with async_search_admission.slot():
+            batch_results = await run_blocking(search_knowledge_batch, queries, None, where)
+
+        batch_results = [
+            compact_documents(documents, query, fields, snippet_length)
+            for (query, _), documents in zip(queries, batch_results)
+        ]
+        return async_encoded_json_response(request, search_batch_response(queries, batch_results))
+
+    except RequestError as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+    except Overloaded as e:
+        return async_overloaded_response(e)
+
+    except Exception as e:
+        print(f"Error en /search/batch: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def async_generate(request: 'web.Request') -> 'web.StreamResponse':
+    """Genera respuesta con RAG (ver generate)"""
+    try:
+        params = parse_generate_request(
+            await read_json_body(request), request.headers.get(DEADLINE_HEADER)
+        )
+
+        context_docs, cache_key, cached = await run_blocking(prepare_generation, params)
+
+        if cached is not None:
+            if params['stream']:
+                return await async_sse_response(request, cached_stream_events(cached))
+            return web.json_response(dict(cached, cached=True))
+
+        flight_key = coalescing_key(params, context_docs)
+
+        if params['stream']:
+            return await async_stream_generate_response(
+                request, params, context_docs, cache_key, flight_key
+            )
+
+        async def run() -> Dict:
+            async with async_generate_admission.slot(params['deadline']):
+                result = await agenerate_with_llm(
+                    user_message=params['message'],
+                    context_docs=context_docs,
+                    max_tokens=params['max_tokens'],
+                    temperature=params['temperature'],
+                    deadline=params['deadline']
+                )
+            return finish_generation(result, context_docs, cache_key)
+
+        if flight_key is not None:
+            return web.json_response(
+                await async_generation_flight.do(flight_key, run, params['deadline'], 'llm')
+            )
+        return web.json_response(await run())
+
+    except RequestError as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+    except Overloaded as e:
+        return async_overloaded_response(e)
+
+    except DeadlineExceeded as e:
+        metrics.inc('rag_deadline_exceeded_total', stage=e.stage)
+        return web.json_response({'error': str(e)}, status=504)
+
+    except NoLLMBackendAvailable as e:
+        return web.json_response(
+            {'error': str(e)},
+            status=503,
+            headers={'Retry-After': str(math.ceil(e.retry_after))}
+        )
+
+    except Exception as e:
+        print(f"Error en /generate: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def async_stream_generate_response(
+    request: 'web.Request',
+    params: Dict,
+    context_docs: List[Dict],
+    cache_key: Optional[Tuple],
+    flight_key: Optional[Tuple] = None
+) -> 'web.StreamResponse':
+    """Respuesta SSE para /generate con stream=true (ver stream_generate_response)"""
+    async def events() -> AsyncIterator[str]:
+        tokens = []
+        try:
+            async for item in astream_with_llm(
+                user_message=params['message'],
+                context_docs=context_docs,
+                max_tokens=params['max_tokens'],
+                temperature=params['temperature'],
+                deadline=params['deadline']
+            ):
+                if item.get('done'):
+                    done = finish_stream(item, tokens, context_docs, cache_key)
+                    yield sse_event(done, event='done')
+                else:
+                    tokens.append(item['token'])
+                    yield sse_event(item)
+        except DeadlineExceeded as e:
+            metrics.inc('rag_deadline_exceeded_total', stage=e.stage)
+            yield sse_event({'error': str(e)}, event='error')
+        except Exception as e:
+            print(f"Error en /generate (stream): {e}")
+            yield sse_event({'error': str(e)}, event='error')
+
+    # La admisión (y su 429) se decide antes de enviar las cabeceras
+    release = None
+    if flight_key is not None:
+        source = await async_stream_flight.subscribe(
+            flight_key, events, admit=lambda: async_generate_admission.admit(params['deadline'])
+        )
+    else:
+        release = await async_generate_admission.admit(params['deadline'])
+        source = events()
+
+    try:
+        response = web.StreamResponse(
+            headers=dict(SSE_HEADERS, **{'Content-Type': 'text/event-stream'})
+        )
+        await response.prepare(request)
+
+        try:
+            async for event in source:
+                await response.write(event.encode('utf-8'))
+
+        except ConnectionResetError:
+            # Cliente desconectado: no queda a quién escribir
+            return response
+
+        except Exception as e:
+            # Las cabeceras ya se enviaron: el error va como evento SSE, igual que en Flask
+            print(f"Error en /generate (stream): {e}")
+            try:
+                await response.write(sse_event({'error': str(e)}, event='error').encode('utf-8'))
+            except ConnectionResetError:
+                return response
+
+        await response.write_eof()
+        return response
+
+    finally:
+        if release is not None:
+            release()
+
+
+def async_encoded_json_response(request: 'web.Request', body: Dict) -> 'web.Response':
+    """Respuesta JSON con encode_json y gzip (ver encoded_json_response)"""
+    data, headers = json_payload(body, request.headers.get('Accept-Encoding'))
+    return web.Response(body=data, headers=headers)
+
+
+def async_overloaded_response(error: Overloaded) -> 'web.Response':
+    """429 con Retry-After (ver overloaded_response)"""
+    return web.json_response(
+        {'error': str(error)},
+        status=429,
+        headers={'Retry-After': str(math.ceil(error.retry_after))}
+    )
+
+
+async def async_sse_response(request: 'web.Request', events: List[str]) -> 'web.StreamResponse':
+    response = web.StreamResponse(
+        headers=dict(SSE_HEADERS, **{'Content-Type': 'text/event-stream'})
+    )
+    await response.prepare(request)
+    for event in events:
+        await response.write(event.encode('utf-8'))
+    await response.write_eof()
+    return response
+
+
+def create_async_app() -> 'web.Application':
+    """Aplicación aiohttp con los mismos endpoints que `app`"""
+
+    @web.middleware
+    async def timing_middleware(request, handler):
+        request_id, timings, start = begin_request_timing(
+            request.headers.get('X-Request-ID')
+        )
+        route = request.match_info.route.resource
+        endpoint = route.canonical if route is not None else 'other'
+        status_code = 500
+        query_params = None
+        if query_log.sample(endpoint):
+            # aiohttp guarda el body leído: el handler lo vuelve a leer sin coste
+            try:
+                body = await request.json()
+            except ValueError:
+                body = None
+            query_params = body if isinstance(body, dict) else {}
+        try:
+            response = await handler(request)
+            status_code = response.status
+            response.headers['X-Request-ID'] = request_id
+            return response
+        except web.HTTPException as e:
+            status_code = e.status
+            raise
+        finally:
+            end_request_timing(
+                request_id, request.method, request.path, endpoint,
+                status_code, timings, start, query_params
+            )
+
+    @web.middleware
+    async def cors_middleware(request, handler):
+        # Equivalente a CORS(app) en el servidor Flask
+        response = await handler(request)
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Headers'] = f'Content-Type, Authorization, {DEADLINE_HEADER}'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        return response
+
+    @web.middleware
+    async def startup_middleware(request, handler):
+        # Equivalente a reject_while_starting en el servidor Flask
+        if not startup.ready and request.path not in STARTUP_ENDPOINTS and request.method != 'OPTIONS':
+            return web.json_response(
+                {'error': 'Service is starting, retry later'},
+                status=503,
+                headers={'Retry-After': '1'}
+            )
+        return await handler(request)
+
+    async def preflight(_):
+        return web.Response()
+
+    async def on_startup(_):
+        llm.async_llm = AsyncLLMClient(
+            pool_size=config['llm_pool_size'],
+            connect_timeout=config['llm_connect_timeout'],
+            read_timeout=config['llm_read_timeout'],
+            max_retries=config['llm_max_retries'],
+            backoff=config['llm_backoff'],
+            concurrency=config['llm_concurrency']
+        )
+        await llm.async_llm.start()
+
+    async def on_cleanup(_):
+        await llm.async_llm.close()
+
+    async_app = web.Application(middlewares=[timing_middleware, cors_middleware, startup_middleware])
+    async_app.router.add_get('/health', async_health)
+    async_app.router.add_get('/metrics', async_metrics)
+    async_app.router.add_get('/stats', async_stats)
+    async_app.router.add_post('/search', async_search)
+    async_app.router.add_post('/search/batch', async_search_batch)
+    async_app.router.add_post('/generate', async_generate)
+    async_app.router.add_post('/admin/refresh', async_admin_refresh)
+    for resource in list(async_app.router.resources()):
+        resource.add_route('OPTIONS', preflight)
+    async_app.on_startup.append(on_startup)
+    async_app.on_cleanup.append(on_cleanup)
+
+    return async_app
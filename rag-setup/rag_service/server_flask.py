@@ -0,0 +1,421 @@
+"""Servidor Flask (--server flask, por defecto)"""
+
+import math
+from typing import List, Dict, Iterator, Optional, Tuple
+
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from flask_cors import CORS
+
+from .api import (
+    begin_request_timing, cached_stream_events, coalescing_key, compact_documents,
+    end_request_timing, finish_generation, finish_stream, json_payload, prepare_generation,
+    refresh_document_count, render_metrics, search_batch_response, search_response, stats_response,
+    status_monitor
+)
+from .caching import generation_flight, stream_flight
+from .llm import generate_with_llm, stream_with_llm
+from .metrics import metrics
+from .query_log import query_log
+from .resilience import (
+    DEADLINE_HEADER, DeadlineExceeded, NoLLMBackendAvailable, Overloaded, generate_admission,
+    search_admission
+)
+from .retrieval import search_knowledge, search_knowledge_batch
+from .sse import SSE_HEADERS, sse_event
+from .startup import STARTUP_ENDPOINTS, starting_health, startup
+from .validation import (
+    RequestError, parse_diversity, parse_generate_request, parse_metadata_filter,
+    parse_search_batch_request, parse_search_options, parse_search_request, wants_fresh
+)
+
+
+app = Flask(__name__)
+CORS(app)  # Permitir CORS para requests desde backend Node.js
+
+
+# === ENDPOINTS ===
+
+@app.before_request
+def start_request_timing():
+    g.request_id, g.timings, g.request_start = begin_request_timing(
+        request.headers.get('X-Request-ID')
+    )
+
+
+@app.after_request
+def finish_request_timing(response):
+    response.headers['X-Request-ID'] = g.request_id
+
+    # call_on_close: en respuestas SSE se mide hasta el final del stream
+    request_id, timings, start = g.request_id, g.timings, g.request_start
+    method, path = request.method, request.path
+    endpoint = request.url_rule.rule if request.url_rule else 'other'
+    status_code = response.status_code
+    query_params = None
+    if query_log.sample(endpoint):
+        body = request.get_json(silent=True)
+        query_params = body if isinstance(body, dict) else {}
+
+    response.call_on_close(lambda: end_request_timing(
+        request_id, method, path, endpoint, status_code, timings, start, query_params
+    ))
+    return response
+
+
+@app.before_request
+def reject_while_starting():
+    # Registrado después de start_request_timing: el 503 también se mide
+    if not startup.ready and request.path not in STARTUP_ENDPOINTS and request.method != 'OPTIONS':
+        response = jsonify({'error': 'Service is starting, retry later'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas en formato de texto Prometheus"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Health check
+
+    Sirve el último snapshot del monitor en segundo plano (`age_seconds` indica
+    su antigüedad). Con ?fresh=1 comprueba ChromaDB y el LLM en vivo.
+    Mientras el servicio arranca (--fast-start) responde 'starting' (503).
+    """
+    if not startup.ready:
+        return jsonify(starting_health()), 503
+
+    snapshot = None if wants_fresh(request.args) else status_monitor.health()
+
+    if snapshot is None:
+        body, status_code = status_monitor.refresh_health()
+        age = 0.0
+    else:
+        body, status_code, age = snapshot
+
+    return jsonify(dict(body, age_seconds=round(age, 3), startup=startup.status())), status_code
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Estadísticas de la base de conocimiento (?fresh=1 para recalcularlas)"""
+    try:
+        snapshot = None if wants_fresh(request.args) else status_monitor.stats()
+
+        if snapshot is None:
+            snapshot = (status_monitor.refresh_stats(), 0.0)
+
+        return jsonify(stats_response(*snapshot))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/admin/refresh', methods=['POST'])
+def admin_refresh():
+    """
+    Fuerza el recuento de documentos (p.ej. después de ingestar libros)
+
+    Response:
+        {
+            "documents": 260,
+            "previous": 250,
+            "changed": true
+        }
+    """
+    try:
+        return jsonify(refresh_document_count())
+
+    except Exception as e:
+        print(f"Error en /admin/refresh: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/search', methods=['POST'])
+def search():
+    """
+    Busca en la base de conocimiento
+
+    Body:
+        {
+            "query": "string",
+            "n_results": 3,   # opcional
+            "diversity": 0.3, # opcional, 0-1 (MMR), default 0
+            "fetch_k": 20,    # opcional, candidatos para MMR
+            "fields": ["source", "page", "relevance"],  # opcional, ver SEARCH_FIELDS
+            "snippet_length": 200, # opcional, fragmento centrado en la query
+            "filter": {"source": "libro.pdf"}  # opcional, ver parse_metadata_filter
+        }
+
+    Response:
+        {
+            "documents": [
+                {
+                    "text": "...",
+                    "metadata": {...},
+                    "relevance": 0.95
+                }
+            ],
+            "count": 3
+        }
+
+    Con `fields` cada documento lleva solo esos campos. La respuesta va
+    comprimida con gzip si el cliente envía Accept-Encoding: gzip.
+    """
+    try:
+        data = request.get_json()
+        query, n_results = parse_search_request(data)
+        diversity, fetch_k = parse_diversity(data, n_results)
+        fields, snippet_length = parse_search_options(data)
+        where = parse_metadata_filter(data)
+
+        # Buscar
+        with search_admission.slot():
+            documents = search_knowledge(
+                query, n_results, diversity=diversity, fetch_k=fetch_k, where=where
+            )
+
+        documents = compact_documents(documents, query, fields, snippet_length)
+        return encoded_json_response(search_response(documents))
+
+    except RequestError as e:
+        return jsonify({'error': str(e)}), 400
+
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    except Exception as e:
+        print(f"Error en /search: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    Varias búsquedas en una sola llamada a ChromaDB
+
+    Body:
+        {
+            "queries": [
+                {"query": "string", "n_results": 3},   # n_results opcional
+                ...
+            ],
+            "n_results": 3  # opcional, default para queries sin n_results
+        }
+
+    Response:
+        {
+            "results": [
+                {
+                    "query": "string",
+                    "documents": [...],   # mismo formato que /search
+                    "count": 3
+                }
+            ],
+            "count": 1
+        }
+    """
+    try:
+        data = request.get_json()
+        queries = parse_search_batch_request(data)
+        fields, snippet_length = parse_search_options(data)
+        where = parse_metadata_filter(data)
+
+        # Buscar
+        with search_admission.slot():
+            batch_results = search_knowledge_batch(queries, where=where)
+
+        batch_results = [
+            compact_documents(documents, query, fields, snippet_length)
+            for (query, _), documents in zip(queries, batch_results)
+        ]
+        return encoded_json_response(search_batch_response(queries, batch_results))
+
+    except RequestError as e:
+        return jsonify({'error': str(e)}), 400
+
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    except Exception as e:
+        print(f"Error en /search/batch: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    """
+    Genera respuesta con RAG
+
+    Body:
+        {
+            "message": "string",
+            "use_rag": true,          # opcional, default true
+            "n_results": 3,           # opcional, default 3
+            "max_tokens": 1000,       # opcional, default 1000
+            "temperature": 0.7,       # opcional, default 0.7
+            "stream": false,          # opcional, default false
+            "cache": true,            # opcional, false para saltar el caché
+            "context_token_budget": 1500,  # opcional, 0 = sin límite
+            "diversity": 0.3,         # opcional, 0-1 (MMR), default 0
+            "fetch_k": 20,            # opcional, candidatos para MMR
+            "filter": {"type": "pdf"}, # opcional, filtro de metadata
+            "deadline_ms": 3000       # opcional, tiempo máximo (también header X-Deadline-Ms)
+        }
+
+    Response:
+        {
+            "response": "...",
+            "model": "meta-llama/Llama-3.1-8B-Instruct",
+            "tokens_used": 450,
+            "sources_used": 3,
+            "context_tokens": 820,  # tokens estimados del contexto empaquetado
+            "sources": [...],  # si use_rag=true
+            "cached": true     # solo si la respuesta salió del caché
+        }
+
+    Response (stream=true, text/event-stream):
+        data: {"token": "Para"}
+        data: {"token": " mejorar"}
+        ...
+        event: done
+        data: {"model": "...", "tokens_used": 450, "sources_used": 3, "sources": [...]}
+
+    Si ya hay --max-concurrent-generations en curso y la cola de espera está
+    llena (o la espera se agota), responde 429 con Retry-After; las peticiones
+    agrupadas con una generación idéntica en curso no ocupan hueco. Si la
+    petición lleva deadline y el LLM no responde a tiempo, responde 504; si
+    la búsqueda no termina a tiempo, se genera sin RAG.
+    """
+    try:
+        params = parse_generate_request(request.get_json(), request.headers.get(DEADLINE_HEADER))
+
+        context_docs, cache_key, cached = prepare_generation(params)
+
+        if cached is not None:
+            if params['stream']:
+                return sse_response(iter(cached_stream_events(cached)))
+            return jsonify(dict(cached, cached=True))
+
+        flight_key = coalescing_key(params, context_docs)
+
+        if params['stream']:
+            return stream_generate_response(params, context_docs, cache_key, flight_key)
+
+        # Generar respuesta. Solo ocupa hueco de admisión la ejecución que llega
+        # al LLM: ni las respuestas del caché ni las agrupadas con otra en curso
+        def run() -> Dict:
+            with generate_admission.slot(params['deadline']):
+                result = generate_with_llm(
+                    user_message=params['message'],
+                    context_docs=context_docs,
+                    max_tokens=params['max_tokens'],
+                    temperature=params['temperature'],
+                    deadline=params['deadline']
+                )
+            return finish_generation(result, context_docs, cache_key)
+
+        if flight_key is not None:
+            return jsonify(generation_flight.do(flight_key, run, params['deadline'], 'llm'))
+        return jsonify(run())
+
+    except RequestError as e:
+        return jsonify({'error': str(e)}), 400
+
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    except DeadlineExceeded as e:
+        metrics.inc('rag_deadline_exceeded_total', stage=e.stage)
+        return jsonify({'error': str(e)}), 504
+
+    except NoLLMBackendAvailable as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+        return response, 503
+
+    except Exception as e:
+        print(f"Error en /generate: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+def stream_generate_response(
+    params: Dict,
+    context_docs: List[Dict],
+    cache_key: Optional[Tuple] = None,
+    flight_key: Optional[Tuple] = None
+) -> Response:
+    """
+    Respuesta SSE para /generate con stream=true
+
+    El último evento ('done') lleva la misma metadata que la respuesta JSON
+    (model, tokens_used, sources_used y sources si se usó RAG). Los errores
+    del LLM a mitad de stream se notifican con un evento 'error'.
+
+    Si se pasa `cache_key`, la respuesta completa se guarda en el caché de
+    respuestas al terminar el stream sin errores. Si se pasa `flight_key`,
+    peticiones idénticas concurrentes reciben el mismo stream de tokens.
+
+    Ocupa un hueco de generate_admission mientras se produce el stream (lanza
+    Overloaded antes de empezar la respuesta); con `flight_key`, solo la
+    petición que lo produce.
+    """
+    def events():
+        tokens = []
+        try:
+            for item in stream_with_llm(
+                user_message=params['message'],
+                context_docs=context_docs,
+                max_tokens=params['max_tokens'],
+                temperature=params['temperature'],
+                deadline=params['deadline']
+            ):
+                if item.get('done'):
+                    done = finish_stream(item, tokens, context_docs, cache_key)
+                    yield sse_event(done, event='done')
+                else:
+                    tokens.append(item['token'])
+                    yield sse_event(item)
+        except DeadlineExceeded as e:
+            metrics.inc('rag_deadline_exceeded_total', stage=e.stage)
+            yield sse_event({'error': str(e)}, event='error')
+        except Exception as e:
+            print(f"Error en /generate (stream): {e}")
+            yield sse_event({'error': str(e)}, event='error')
+
+    if flight_key is not None:
+        return sse_response(stream_flight.subscribe(
+            flight_key, events, admit=lambda: generate_admission.admit(params['deadline'])
+        ))
+
+    # El hueco se libera al cerrarse el stream, no al devolver la respuesta
+    release = generate_admission.admit(params['deadline'])
+    response = sse_response(events())
+    response.call_on_close(release)
+    return response
+
+
+def encoded_json_response(body: Dict) -> Response:
+    """Respuesta JSON con encode_json y gzip según Accept-Encoding"""
+    data, headers = json_payload(body, request.headers.get('Accept-Encoding'))
+    return Response(data, headers=headers)
+
+
+def overloaded_response(error: Overloaded) -> Tuple[Response, int]:
+    """429 con Retry-After cuando el control de admisión rechaza la petición"""
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response, 429
+
+
+def sse_response(events: Iterator[str]) -> Response:
+    """Envuelve un generador de eventos SSE en una respuesta Flask"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
@@ -0,0 +1,60 @@
+"""Configuración global del servicio (main la rellena con los flags)"""
+
+
+# Configuración global
+config = {
+    'chroma_host': 'localhost',
+    'chroma_port': 8000,
+    'index_dir': None,
+    'shards': [],
+    'shard_timeout': 2.0,
+    'bm25_index': None,
+    'hybrid_weight': 0.5,
+    'hybrid_candidates': 20,
+    'diversity': 0.0,
+    'prompt_layout': 'classic',
+    'llm_cache_prompt': False,
+    'fetch_k': 20,
+    'llm_url': 'http://localhost:8080/v1/chat/completions',
+    'llm_urls': [],
+    'llm_api_key': None,
+    'model_id': 'meta-llama/Llama-3.1-8B-Instruct',
+    'response_cache_size': 256,
+    'response_cache_ttl': 3600,
+    'retrieval_cache_size': 1024,
+    'retrieval_cache_ttl': 3600,
+    'doc_count_max_age': 30.0,
+    'max_batch_queries': 50,
+    'llm_pool_size': 10,
+    'llm_connect_timeout': 5.0,
+    'llm_read_timeout': 30.0,
+    'llm_max_retries': 2,
+    'llm_backoff': 0.5,
+    'llm_failure_threshold': 3,
+    'llm_reset_timeout': 30.0,
+    'llm_concurrency': 8,
+    'status_interval': 10.0,
+    'log_timings': False,
+    'context_token_budget': 1500,
+    'context_dedup_threshold': 0.6,
+    'coalesce_requests': True,
+    'max_concurrent_generations': 8,
+    'generation_queue_size': 32,
+    'generation_queue_timeout': 10.0,
+    'max_concurrent_searches': 32,
+    'search_queue_size': 128,
+    'search_queue_timeout': 2.0,
+    'snippet_length': 200,
+    'gzip_min_size': 1024,
+    'warm_cache_file': None,
+    'faq_file': None,
+    'faq_concurrency': 2,
+    'query_log_file': None,
+    'query_log_sample_rate': 0.1,
+    'query_log_max_bytes': 50 * 1024 * 1024,
+    'query_log_backups': 5,
+    'query_log_raw_text': False,
+    'request_deadline': 0.0,
+    'retrieval_deadline_share': 0.3,
+    'hedge_percentile': 95.0
+}
@@ -0,0 +1,284 @@
+"""Colección repartida en varios ChromaDB (--shards)"""
+
+import functools
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, List, Dict, Iterator, Optional, Tuple
+
+from .lazy import chromadb
+from .metrics import metrics
+from .resilience import DeadlineExceeded, Hedger, time_left
+from .settings import config
+
+
+# === SHARDS DE CHROMADB (--shards) ===
+
+COLLECTION_NAME = 'adhd_knowledge'
+
+# Shards que no respondieron en la búsqueda en curso (None fuera de una búsqueda)
+_missing_shards: ContextVar[Optional[List[str]]] = ContextVar('missing_shards', default=None)
+
+# Deadline (time.monotonic) de la búsqueda en curso; acota las llamadas a ChromaDB
+_search_deadline: ContextVar[Optional[float]] = ContextVar('search_deadline', default=None)
+
+
+@contextmanager
+def track_search(deadline: Optional[float] = None) -> Iterator[List[str]]:
+    """
+    Ámbito de una búsqueda en ChromaDB
+
+    Fija su `deadline` para las llamadas a ChromaDB (ver search_deadline) y
+    devuelve la lista donde se anotan los shards que no respondan: si no
+    queda vacía, el resultado es parcial.
+    """
+    missing: List[str] = []
+    missing_token = _missing_shards.set(missing)
+    deadline_token = _search_deadline.set(deadline)
+    try:
+        yield missing
+    finally:
+        _search_deadline.reset(deadline_token)
+        _missing_shards.reset(missing_token)
+
+
+def search_deadline() -> Optional[float]:
+    """Deadline de la búsqueda en curso (None sin deadline o fuera de track_search)"""
+    return _search_deadline.get()
+
+
+def parse_shard_spec(spec: str, default_port: int) -> Tuple[str, int, str]:
+    """
+    'HOST[:PUERTO][/COLECCIÓN]' -> (host, puerto, colección)
+
+    process_adhd_books.py --shards la usa también para repartir los chunks.
+    """
+    address, _, name = spec.partition('/')
+    host, _, port = address.partition(':')
+    return host or 'localhost', int(port) if port else default_port, name or COLLECTION_NAME
+
+
+def shard_for_source(source: str, n_shards: int) -> int:
+    """Shard de una fuente: hash estable (crc32, igual en todos los procesos) del nombre"""
+    return zlib.crc32(source.encode('utf-8')) % n_shards
+
+
+def where_sources(where: Optional[Dict]) -> Optional[set]:
+    """Fuentes a las que restringe un filtro (None si no restringe `source`)"""
+    if not where:
+        return None
+
+    sources = None
+    for key, condition in where.items():
+        if key == '$and':
+            for clause in condition:
+                clause_sources = where_sources(clause)
+                if clause_sources is not None:
+                    sources = clause_sources if sources is None else sources & clause_sources
+        elif key == 'source' and isinstance(condition, dict):
+            if '$eq' in condition:
+                found = {condition['$eq']}
+            elif '$in' in condition:
+                found = set(condition['$in'])
+            else:
+                continue
+            sources = found if sources is None else sources & found
+    return sources
+
+
+class ChromaShard:
+    """Una colección de un host de ChromaDB; se (re)conecta bajo demanda"""
+
+    def __init__(self, host: str, port: int, name: str):
+        self.host = host
+        self.port = port
+        self.name = name
+        self.label = f"{host}:{port}/{name}"
+        self.connected = False
+        self.documents = 0  # Último recuento conocido
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.hedger = Hedger(self.label, config['hedge_percentile'])
+        self._collection = None
+        self._lock = threading.Lock()
+
+    def collection(self):
+        with self._lock:
+            if self._collection is None:
+                client = chromadb.HttpClient(host=self.host, port=self.port)
+                self._collection = client.get_or_create_collection(
+                    name=self.name,
+                    metadata={
+                        "description": "ADHD specialized books and resources",
+                        "language": "es"
+                    }
+                )
+            return self._collection
+
+    def call(self, method: str, deadline: Optional[float] = None, **kwargs) -> Any:
+        start = time.perf_counter()
+        try:
+            func = functools.partial(getattr(self.collection(), method), **kwargs)
+            result = self.hedger.call(func, deadline) if method == 'query' else func()
+        except DeadlineExceeded:
+            raise  # Se agotó la petición, no el shard
+        except Exception as e:
+            self.mark_failed(str(e) or type(e).__name__)
+            with self._lock:
+                self._collection = None  # Reconectar en la siguiente llamada
+            raise
+        metrics.observe('rag_shard_query_seconds', time.perf_counter() - start, shard=self.label)
+        if not self.connected:
+            print(f"✅ Shard de ChromaDB disponible: {self.label}")
+            self.connected = True
+        return result
+
+    def mark_failed(self, error: str) -> None:
+        self.errors += 1
+        self.last_error = error
+        if self.connected:
+            print(f"⚠️  Shard de ChromaDB sin respuesta: {self.label} ({error})")
+            self.connected = False
+
+    def status(self) -> Dict:
+        return {
+            'shard': self.label,
+            'connected': self.connected,
+            'documents': self.documents,
+            'errors': self.errors,
+            'last_error': self.last_error
+        }
+
+
+class ShardedCollection:
+    """
+    Varias colecciones de ChromaDB con la interfaz de una sola (count, query, get)
+
+    process_adhd_books.py --shards reparte los chunks por un hash estable de
+    `source` (shard_for_source). Cada consulta se envía en paralelo a todos
+    los shards (o solo a los de las fuentes del filtro `source`) y se esperan
+    como mucho `timeout` segundos (o hasta el deadline de la búsqueda, si
+    vence antes: DeadlineExceeded). Los resultados se mezclan por distancia.
+    Los shards que fallan o no llegan a tiempo se omiten: la respuesta es
+    parcial y sus nombres se anotan en la lista de track_search (las
+    búsquedas parciales no se cachean). Solo si no responde ninguno se lanza la excepción.
+    """
+
+    def __init__(self, specs: List[str], timeout: float, default_port: int = 8000):
+        self.shards = [ChromaShard(*parse_shard_spec(spec, default_port)) for spec in specs]
+        self.timeout = timeout
+        # Las llamadas que vencen el timeout siguen ocupando un worker hasta que terminan
+        self._executor = ThreadPoolExecutor(
+            max_workers=8 * len(self.shards),
+            thread_name_prefix='chroma-shard'
+        )
+
+    def shards_for(self, where: Optional[Dict]) -> List[ChromaShard]:
+        sources = where_sources(where)
+        if sources is None:
+            return self.shards
+        positions = {shard_for_source(source, len(self.shards)) for source in sources}
+        return [shard for i, shard in enumerate(self.shards) if i in positions]
+
+    def scatter(self, shards: List[ChromaShard], method: str, **kwargs) -> List[Tuple[ChromaShard, Any]]:
+        """Llama a `method` en cada shard en paralelo; devuelve [(shard, resultado)] de los que respondieron"""
+        if not shards:
+            return []
+
+        deadline = search_deadline()
+        timeout = self.timeout
+        left = time_left(deadline)
+        if left is not None and left < timeout:
+            timeout = left
+
+        futures = {self._executor.submit(shard.call, method, deadline, **kwargs): shard for shard in shards}
+        done, _ = wait_futures(futures, timeout=timeout)
+        expired = any(isinstance(future.exception(), DeadlineExceeded) for future in done)
+        if expired or (timeout < self.timeout and len(done) < len(futures)):
+            # Se agotó la búsqueda, no los shards: no se marcan caídos
+            raise DeadlineExceeded('retrieval')
+
+        answered = []
+        missing = _missing_shards.get()
+        for future, shard in futures.items():
+            if future in done and future.exception() is None:
+                answered.append((shard, future.result()))
+                continue
+            if future in done:
+                metrics.inc('rag_shard_errors_total', shard=shard.label, reason='error')
+            else:
+                shard.mark_failed(f"timeout ({self.timeout:g}s)")
+                metrics.inc('rag_shard_errors_total', shard=shard.label, reason='timeout')
+            if missing is not None:
+                missing.append(shard.label)
+
+        if not answered:
+            raise RuntimeError(f"Ningún shard de ChromaDB respondió ({len(shards)} consultados)")
+        return answered
+
+    def count(self) -> int:
+        """Suma de documentos; de los shards caídos se usa su último recuento"""
+        for shard, count in self.scatter(self.shards, 'count'):
+            shard.documents = count
+        return sum(shard.documents for shard in self.shards)
+
+    def query(
+        self,
+        query_texts: List[str],
+        n_results: int = 10,
+        where: Optional[Dict] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict:
+        """Top-k de cada shard mezclado por distancia, en el formato de collection.query"""
+        include = include or ['documents', 'metadatas', 'distances']
+        answered = self.scatter(
+            self.shards_for(where), 'query',
+            query_texts=query_texts, n_results=n_results, where=where, include=include
+        )
+
+        fields = ['ids'] + [field for field in ('documents', 'metadatas', 'embeddings') if field in include]
+        merged: Dict[str, List] = {field: [] for field in fields + ['distances']}
+        for i in range(len(query_texts)):
+            candidates = []
+            for _, results in answered:
+                for j, distance in enumerate(results['distances'][i]):
+                    candidates.append((distance, results, j))
+            candidates.sort(key=lambda candidate: candidate[0])
+
+            for field in fields:
+                merged[field].append([results[field][i][j] for _, results, j in candidates[:n_results]])
+            merged['distances'].append([distance for distance, _, _ in candidates[:n_results]])
+
+        return merged
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict:
+        """Chunks por ID o filtro de todos los shards (limit/offset sobre la concatenación)"""
+        include = include or ['documents', 'metadatas']
+        kwargs = {'ids': ids, 'where': where, 'include': include}
+        if limit is not None:
+            kwargs['limit'] = limit + (offset or 0)
+
+        answered = dict(self.scatter(self.shards_for(where), 'get', **kwargs))
+        fields = ['ids'] + [field for field in ('documents', 'metadatas', 'embeddings') if field in include]
+        merged: Dict[str, List] = {field: [] for field in fields}
+        # En el orden de los shards, para que limit/offset sean estables
+        for shard in self.shards:
+            if shard in answered:
+                for field in fields:
+                    merged[field].extend(answered[shard][field])
+
+        end = None if limit is None else (offset or 0) + limit
+        return {field: values[offset or 0:end] for field, values in merged.items()}
+
+    def status(self) -> List[Dict]:
+        return [shard.status() for shard in self.shards]
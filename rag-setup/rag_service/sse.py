@@ -0,0 +1,18 @@
+"""Formato de eventos Server-Sent Events"""
+
+import json
+from typing import Dict, Optional
+
+
+def sse_event(data: Dict, event: Optional[str] = None) -> str:
+    """Serializa un evento Server-Sent Events"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # Evita buffering en nginx
+}
@@ -0,0 +1,81 @@
+"""Seguimiento del arranque (--fast-start)"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from . import MODULE_START
+from .lazy import LazyModule
+
+
+# === ARRANQUE RÁPIDO (--fast-start) ===
+
+# Endpoints que responden mientras el servicio arranca (el resto: 503)
+STARTUP_ENDPOINTS = ('/health', '/metrics')
+
+
+class StartupTracker:
+    """
+    Estado y tiempos del arranque
+
+    `import_seconds` va del inicio de la importación del módulo a main();
+    `ready_seconds`, hasta que ChromaDB y el LLM están inicializados. Con
+    --fast-start el puerto se abre antes y la inicialización corre en un
+    thread: mientras tanto /health responde 'starting' (503) y los demás
+    endpoints 503 con Retry-After.
+    """
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.fast_start = False
+        self.import_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self._ready = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def imported(self) -> None:
+        self.import_seconds = time.perf_counter() - self.started_at
+
+    def mark_ready(self) -> None:
+        self.ready_seconds = time.perf_counter() - self.started_at
+        self._ready.set()
+
+    def run_in_background(self, init: Callable[[], None]) -> None:
+        """Ejecuta `init` en un thread y marca el servicio como listo al terminar"""
+        def run() -> None:
+            try:
+                init()
+            except BaseException as e:
+                # Mismo resultado que sin --fast-start: el proceso termina con error
+                # (os._exit: desde un thread sys.exit solo terminaría el thread)
+                if not isinstance(e, SystemExit):
+                    print(f"\n❌ Error inicializando el servicio: {e}")
+                os._exit(1)
+            self.mark_ready()
+            print(f"✅ Servicio listo ({self.ready_seconds:.2f}s desde el arranque)")
+
+        threading.Thread(target=run, name='startup', daemon=True).start()
+
+    def status(self) -> Dict:
+        body = {
+            'fast_start': self.fast_start,
+            'ready': self.ready,
+            'import_seconds': round(self.import_seconds, 3) if self.import_seconds is not None else None,
+            'ready_seconds': round(self.ready_seconds, 3) if self.ready_seconds is not None else None,
+            'lazy_imports': {name: round(elapsed, 3) for name, elapsed in LazyModule.loaded.items()}
+        }
+        if not self.ready:
+            body['elapsed_seconds'] = round(time.perf_counter() - self.started_at, 3)
+        return body
+
+
+startup = StartupTracker(MODULE_START)
+
+
+def starting_health() -> Dict:
+    """Body de /health mientras el servicio arranca (HTTP 503)"""
+    return {'status': 'starting', 'startup': startup.status()}
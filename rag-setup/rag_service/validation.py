@@ -0,0 +1,263 @@
+"""Validación de los bodies y parámetros de las peticiones"""
+
+import time
+from typing import Any, List, Dict, Optional, Tuple
+
+from .resilience import DEADLINE_HEADER
+from .settings import config
+
+
+# === LÓGICA COMÚN DE LOS ENDPOINTS ===
+# Validación, caché y formato de respuesta compartidos por el servidor
+# Flask y el servidor asíncrono (--server async).
+
+class RequestError(ValueError):
+    """Petición inválida; los endpoints la devuelven como HTTP 400"""
+
+
+def parse_search_request(data: Optional[Dict]) -> Tuple[str, int]:
+    """Valida el body de /search y devuelve (query, n_results)"""
+    if not data or 'query' not in data:
+        raise RequestError('Missing required field: query')
+
+    query = data['query']
+    n_results = data.get('n_results', 3)
+
+    if not isinstance(query, str) or len(query.strip()) == 0:
+        raise RequestError('Query must be a non-empty string')
+
+    if not isinstance(n_results, int) or n_results < 1 or n_results > 10:
+        raise RequestError('n_results must be between 1 and 10')
+
+    return query, n_results
+
+
+def parse_diversity(data: Dict, n_results: int) -> Tuple[float, int]:
+    """Valida `diversity` y `fetch_k` (MMR) y devuelve (diversity, fetch_k)"""
+    diversity = data.get('diversity', config['diversity'])
+    fetch_k = data.get('fetch_k', max(config['fetch_k'], n_results))
+
+    if isinstance(diversity, bool) or not isinstance(diversity, (int, float)) \
+            or not 0 <= diversity <= 1:
+        raise RequestError('diversity must be a number between 0 and 1')
+
+    if isinstance(fetch_k, bool) or not isinstance(fetch_k, int) \
+            or fetch_k < n_results or fetch_k > 50:
+        raise RequestError('fetch_k must be between n_results and 50')
+
+    return float(diversity), fetch_k
+
+
+# Claves de metadata que escribe process_adhd_books.py y su tipo
+FILTER_KEYS = {'source': str, 'type': str, 'page': int, 'chunk': int}
+FILTER_TYPE_NAMES = {str: 'string', int: 'integer'}
+FILTER_OPERATORS = ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$in', '$nin')
+RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte')
+
+
+def parse_metadata_filter(data: Dict) -> Optional[Dict]:
+    """
+    Valida `filter` y lo traduce a una cláusula where de ChromaDB (None sin filtro)
+
+    Formato: {"source": "libro.pdf", "type": ["pdf", "txt"], "page": {"$gte": 10}}.
+    Un valor escalar es igualdad, una lista es $in y un objeto lleva operadores
+    explícitos (FILTER_OPERATORS; los de rango solo para page/chunk). Varias
+    condiciones se combinan con $and, en orden fijo para que el mismo filtro
+    dé siempre la misma clave de caché.
+    """
+    metadata_filter = data.get('filter')
+    if metadata_filter is None:
+        return None
+
+    if not isinstance(metadata_filter, dict) or not metadata_filter:
+        raise RequestError('filter must be a non-empty object')
+
+    conditions = []
+    for key in sorted(metadata_filter):
+        if key not in FILTER_KEYS:
+            raise RequestError(f"filter keys must be among: {', '.join(FILTER_KEYS)}")
+
+        condition = metadata_filter[key]
+        if isinstance(condition, list):
+            condition = {'$in': condition}
+        elif not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        if not condition:
+            raise RequestError(f'filter.{key} must not be empty')
+
+        for op in sorted(condition):
+            conditions.append({key: {op: check_filter_operand(key, op, condition[op])}})
+
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+
+def check_filter_operand(key: str, op: str, operand: Any) -> Any:
+    """Valida el operando de una condición de `filter` según el tipo de la clave"""
+    expected = FILTER_KEYS[key]
+
+    def valid(value: Any) -> bool:
+        return isinstance(value, expected) and not isinstance(value, bool)
+
+    if op not in FILTER_OPERATORS:
+        raise RequestError(f"filter operators must be among: {', '.join(FILTER_OPERATORS)}")
+
+    if op in RANGE_OPERATORS and expected is not int:
+        raise RequestError(f'filter.{key} does not support {op}')
+
+    if op in ('$in', '$nin'):
+        if not isinstance(operand, list) or not 1 <= len(operand) <= 100 \
+                or not all(valid(value) for value in operand):
+            raise RequestError(
+                f'filter.{key} {op} must be a list of 1 to 100 {FILTER_TYPE_NAMES[expected]} values'
+            )
+    elif not valid(operand):
+        raise RequestError(f'filter.{key} must be a {FILTER_TYPE_NAMES[expected]}')
+
+    return operand
+
+
+def parse_search_batch_request(data: Optional[Dict]) -> List[Tuple[str, int]]:
+    """Valida el body de /search/batch y devuelve [(query, n_results), ...]"""
+    if not data or 'queries' not in data:
+        raise RequestError('Missing required field: queries')
+
+    queries = data['queries']
+    default_n_results = data.get('n_results', 3)
+
+    if not isinstance(queries, list) or len(queries) == 0:
+        raise RequestError('queries must be a non-empty list')
+
+    if len(queries) > config['max_batch_queries']:
+        raise RequestError(
+            f"queries must contain at most {config['max_batch_queries']} items"
+        )
+
+    parsed = []
+    for item in queries:
+        if not isinstance(item, dict):
+            raise RequestError('Each query must be an object')
+
+        parsed.append(parse_search_request({
+            'query': item.get('query'),
+            'n_results': item.get('n_results', default_n_results)
+        }))
+
+    return parsed
+
+
+def parse_deadline(data: Dict, header: Optional[str]) -> Optional[float]:
+    """
+    Deadline de la petición (time.monotonic) a partir de `deadline_ms` o del header
+
+    Ambos son milisegundos restantes; si llegan los dos se usa el menor. Sin
+    ninguno se aplica --request-deadline (None si es 0).
+    """
+    budgets = []
+    for name, value in (('deadline_ms', data.get('deadline_ms')), (DEADLINE_HEADER, header)):
+        if value is None:
+            continue
+        try:
+            if isinstance(value, bool):
+                raise ValueError
+            budget = float(value)
+        except (TypeError, ValueError):
+            budget = 0.0
+        if not 0 < budget <= 600000:
+            raise RequestError(f'{name} must be a number of milliseconds between 1 and 600000')
+        budgets.append(budget / 1000)
+
+    if not budgets and config['request_deadline'] > 0:
+        budgets.append(config['request_deadline'])
+
+    return time.monotonic() + min(budgets) if budgets else None
+
+
+def parse_generate_request(data: Optional[Dict], deadline_header: Optional[str] = None) -> Dict:
+    """Valida el body de /generate y devuelve los parámetros con defaults"""
+    if not data or 'message' not in data:
+        raise RequestError('Missing required field: message')
+
+    params = {
+        'message': data['message'],
+        'use_rag': data.get('use_rag', True),
+        'n_results': data.get('n_results', 3),
+        'max_tokens': data.get('max_tokens', 1000),
+        'temperature': data.get('temperature', 0.7),
+        'stream': data.get('stream', False),
+        'use_cache': data.get('cache', True),
+        'context_token_budget': data.get('context_token_budget', config['context_token_budget'])
+    }
+
+    if not isinstance(params['message'], str) or len(params['message'].strip()) == 0:
+        raise RequestError('Message must be a non-empty string')
+
+    if not isinstance(params['stream'], bool):
+        raise RequestError('stream must be a boolean')
+
+    if not isinstance(params['use_cache'], bool):
+        raise RequestError('cache must be a boolean')
+
+    if not isinstance(params['use_rag'], bool):
+        raise RequestError('use_rag must be a boolean')
+
+    max_tokens = params['max_tokens']
+    if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1:
+        raise RequestError('max_tokens must be a positive integer')
+
+    # float: 1 y 1.0 dan la misma clave de caché y el mismo payload al LLM
+    temperature = params['temperature']
+    if isinstance(temperature, bool) or not isinstance(temperature, (int, float)) \
+            or not 0 <= temperature <= 2:
+        raise RequestError('temperature must be a number between 0 and 2')
+    params['temperature'] = float(temperature)
+
+    budget = params['context_token_budget']
+    if isinstance(budget, bool) or not isinstance(budget, int) or budget < 0:
+        raise RequestError('context_token_budget must be a non-negative integer')
+
+    if not isinstance(params['n_results'], int) or params['n_results'] < 1:
+        raise RequestError('n_results must be a positive integer')
+
+    params['diversity'], params['fetch_k'] = parse_diversity(data, params['n_results'])
+    params['where'] = parse_metadata_filter(data)
+    params['deadline'] = parse_deadline(data, deadline_header)
+
+    return params
+
+
+# Campos que se pueden pedir con `fields` en /search ('source' y 'page' salen de metadata)
+SEARCH_FIELDS = ('id', 'text', 'snippet', 'metadata', 'source', 'page', 'relevance')
+SNIPPET_FIELDS = ('id', 'snippet', 'metadata', 'relevance')
+
+
+def parse_search_options(data: Dict) -> Tuple[Optional[Tuple[str, ...]], int]:
+    """
+    Valida `fields` y `snippet_length` y devuelve (fields, snippet_length)
+
+    fields es None si la respuesta lleva los documentos completos. Pedir
+    `snippet_length` sin `fields` equivale a SNIPPET_FIELDS.
+    """
+    fields = data.get('fields')
+    snippet_length = data.get('snippet_length')
+
+    if fields is not None:
+        if not isinstance(fields, list) or not fields \
+                or any(field not in SEARCH_FIELDS for field in fields):
+            raise RequestError(f"fields must be a non-empty list of: {', '.join(SEARCH_FIELDS)}")
+
+    if snippet_length is not None:
+        if isinstance(snippet_length, bool) or not isinstance(snippet_length, int) \
+                or not 20 <= snippet_length <= 2000:
+            raise RequestError('snippet_length must be between 20 and 2000')
+        if fields is None:
+            fields = list(SNIPPET_FIELDS)
+
+    return (
+        tuple(dict.fromkeys(fields)) if fields is not None else None,
+        snippet_length or config['snippet_length']
+    )
+
+
+def wants_fresh(args: Dict) -> bool:
+    """True si la query string pide una comprobación en vivo (?fresh=1)"""
+    return str(args.get('fresh', '')).lower() in ('1', 'true', 'yes')
@@ -0,0 +1,230 @@
+"""Arranque en caliente: volcado de cachés y precálculo de FAQ"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Hashable, List, Dict, Optional
+
+from .api import finish_generation, prepare_generation, status_monitor
+from .caching import response_cache, retrieval_cache
+from .llm import generate_with_llm
+from .retrieval import document_counter
+from .settings import config
+from .validation import parse_generate_request
+from . import retrieval
+
+
+# === ARRANQUE EN CALIENTE (--warm-cache, --faq-file) ===
+
+WARM_CACHE_VERSION = 1
+
+
+def encode_cache_key(key: Hashable) -> Any:
+    """Clave de caché serializable en JSON (las tuplas pasan a listas)"""
+    if isinstance(key, tuple):
+        return [encode_cache_key(part) for part in key]
+    return key
+
+
+def decode_cache_key(key: Any) -> Hashable:
+    """Inversa de encode_cache_key: las claves nunca contienen listas, solo tuplas"""
+    if isinstance(key, list):
+        return tuple(decode_cache_key(part) for part in key)
+    return key
+
+
+def warm_cache_settings() -> Dict:
+    """Configuración de la que dependen las entradas cacheadas (además de la colección)"""
+    return {
+        'bm25': retrieval.bm25_index is not None,
+        'hybrid_weight': config['hybrid_weight'],
+        'hybrid_candidates': config['hybrid_candidates'],
+        'prompt_layout': config['prompt_layout'],
+        'context_dedup_threshold': config['context_dedup_threshold']
+    }
+
+
+def save_warm_cache(path: str) -> int:
+    """
+    Guarda los cachés de búsquedas y respuestas en `path` (escritura atómica)
+
+    Se guardan con el número de documentos, el model_id y warm_cache_settings()
+    para descartarlos al arrancar si ya no corresponden. Devuelve las entradas
+    guardadas.
+    """
+    caches = {}
+    saved = 0
+    for name, cache in (('retrieval', retrieval_cache), ('responses', response_cache)):
+        fingerprint, entries = cache.snapshot()
+        encoded = []
+        for key, ttl_left, value in entries:
+            try:
+                # Comprobar una a una: una entrada no serializable no tira el resto
+                json.dumps(value)
+            except (TypeError, ValueError):
+                continue
+            encoded.append([encode_cache_key(key), round(ttl_left, 3), value])
+        caches[name] = {'fingerprint': encode_cache_key(fingerprint), 'entries': encoded}
+        saved += len(encoded)
+
+    snapshot = {
+        'version': WARM_CACHE_VERSION,
+        'saved_at': time.time(),
+        'documents': document_counter.cached,
+        'model_id': config['model_id'],
+        'settings': warm_cache_settings(),
+        'caches': caches
+    }
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return saved
+
+
+def load_warm_cache(path: str) -> Dict[str, int]:
+    """
+    Recarga los cachés guardados por save_warm_cache
+
+    Se descartan si cambió el número de documentos, el modelo o la
+    configuración de búsqueda, y a cada entrada se le descuenta el tiempo que
+    el servicio estuvo parado. Devuelve las entradas cargadas por caché.
+    """
+    loaded = {'retrieval': 0, 'responses': 0}
+    if not os.path.exists(path):
+        return loaded
+
+    with open(path, encoding='utf-8') as f:
+        snapshot = json.load(f)
+
+    doc_count = document_counter.refresh()
+    if snapshot.get('version') != WARM_CACHE_VERSION:
+        print(f"⚠️  Caché persistente con otra versión, se ignora: {path}")
+        return loaded
+    if snapshot.get('documents') != doc_count:
+        print(f"⚠️  Caché persistente descartado: {snapshot.get('documents')} documentos "
+              f"al guardarlo, {doc_count} ahora")
+        return loaded
+    if snapshot.get('settings') != warm_cache_settings():
+        print("⚠️  Caché persistente descartado: cambió la configuración de búsqueda")
+        return loaded
+
+    downtime = max(0.0, time.time() - snapshot.get('saved_at', 0))
+    fingerprints = {'retrieval': doc_count, 'responses': (doc_count, config['model_id'])}
+    caches = {'retrieval': retrieval_cache, 'responses': response_cache}
+
+    for name, cache in caches.items():
+        if name == 'responses' and snapshot.get('model_id') != config['model_id']:
+            print(f"⚠️  Respuestas cacheadas descartadas: eran de {snapshot.get('model_id')}")
+            continue
+        entries = snapshot['caches'].get(name, {}).get('entries', [])
+        loaded[name] = cache.restore(fingerprints[name], [
+            (decode_cache_key(key), ttl_left - downtime, value)
+            for key, ttl_left, value in entries
+        ])
+
+    return loaded
+
+
+def load_faq_file(path: str) -> List[str]:
+    """Preguntas frecuentes: una por línea (se ignoran vacías y las que empiezan por #)"""
+    with open(path, encoding='utf-8') as f:
+        questions = [line.strip() for line in f]
+    return list(dict.fromkeys(q for q in questions if q and not q.startswith('#')))
+
+
+class FAQWarmup:
+    """
+    Precalcula en segundo plano la búsqueda y la respuesta de las preguntas frecuentes
+
+    Cada pregunta pasa por el mismo camino que un /generate con los
+    parámetros por defecto, así que queda en los cachés de búsquedas y
+    respuestas. Mientras corre, /health responde 'warming' (503) para que el
+    balanceador no envíe tráfico a la instancia en frío.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        with self._lock:
+            return self._running
+
+    def start(self, questions: List[str], concurrency: int = 2) -> None:
+        if not questions:
+            return
+        with self._lock:
+            self.total = len(questions)
+            self.done = self.failed = 0
+            self.started_at = time.monotonic()
+            self.finished_at = None
+            self._running = True
+        threading.Thread(
+            target=self._run, args=(questions, max(1, concurrency)),
+            name='faq-warmup', daemon=True
+        ).start()
+
+    def _run(self, questions: List[str], concurrency: int) -> None:
+        try:
+            semaphore = threading.Semaphore(concurrency)
+            threads = []
+            for question in questions:
+                semaphore.acquire()
+                thread = threading.Thread(target=self._warm, args=(question, semaphore), daemon=True)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        finally:
+            with self._lock:
+                self._running = False
+                self.finished_at = time.monotonic()
+            print(f"✅ FAQ precalculadas: {self.done - self.failed}/{self.total} "
+                  f"en {self.finished_at - self.started_at:.1f}s")
+            if status_monitor.running:
+                status_monitor.refresh_health()
+
+    def _warm(self, question: str, semaphore: threading.Semaphore) -> None:
+        failed = False
+        try:
+            params = parse_generate_request({'message': question})
+            context_docs, cache_key, cached = prepare_generation(params)
+            if cached is None and cache_key is not None:
+                result = generate_with_llm(
+                    user_message=params['message'],
+                    context_docs=context_docs,
+                    max_tokens=params['max_tokens'],
+                    temperature=params['temperature']
+                )
+                finish_generation(result, context_docs, cache_key)
+        except Exception as e:
+            failed = True
+            print(f"Error precalculando FAQ '{question[:60]}': {e}")
+        finally:
+            with self._lock:
+                self.done += 1
+                self.failed += failed
+            semaphore.release()
+
+    def status(self) -> Dict:
+        with self._lock:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            return {
+                'state': 'running' if self._running else 'done',
+                'total': self.total,
+                'done': self.done,
+                'failed': self.failed,
+                'elapsed_seconds': round(end - self.started_at, 3) if self.started_at else 0.0
+            }
+
+
+faq_warmup = FAQWarmup()
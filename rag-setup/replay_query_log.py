@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Reproduce un log de consultas (--query-log) contra rag_api_service.py
+
+Lee los ficheros JSON lines que escribe el servicio con --query-log y
+--query-log-raw-text (también los rotados: query.log.1, query.log.2...; sin
+--query-log-raw-text el log no guarda las preguntas), los ordena por instante de
+llegada y reenvía cada petición con el mismo body respetando los intervalos
+originales, o escalados con --speed. Al terminar imprime en JSON, por
+endpoint, la distribución de latencias de la reproducción junto a la que
+registró el log, para comparar cambios de caché o de búsqueda con la forma
+real del tráfico.
+
+Uso:
+    python replay_query_log.py query.log
+    python replay_query_log.py query.log.2 query.log.1 query.log --speed 10
+    python replay_query_log.py query.log --target http://10.0.0.7:5000 --no-cache --output replay.json
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+from benchmark_load import latency_summary
+
+
+ENDPOINTS = ('/search', '/search/batch', '/generate')
+
+
+def has_text(params: Dict) -> bool:
+    """False si el log se escribió sin --query-log-raw-text (preguntas cambiadas por su hash)"""
+    values = [params.get(field) for field in ('query', 'message')]
+    queries = params.get('queries')
+    if isinstance(queries, list):
+        values += [query.get('query') for query in queries if isinstance(query, dict)]
+    return not any(isinstance(value, dict) for value in values)
+
+
+def load_records(paths: List[str], endpoints: List[str], limit: int) -> List[Dict]:
+    """Registros de los logs ordenados por llegada (se ignoran líneas corruptas y sin texto)"""
+    records = []
+    skipped = 0
+    redacted = 0
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    ts = float(record['ts'])
+                    endpoint = record['endpoint']
+                    params = record['params']
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1
+                    continue
+                if endpoint not in endpoints or not isinstance(params, dict):
+                    continue
+                if not has_text(params):
+                    redacted += 1
+                    continue
+                records.append(dict(record, ts=ts))
+
+    if skipped:
+        print(f"⚠️  {skipped} líneas ignoradas (JSON inválido o incompleto)", file=sys.stderr)
+    if redacted:
+        print(f"⚠️  {redacted} peticiones sin el texto de la pregunta ignoradas "
+              f"(el servicio debe registrar con --query-log-raw-text)", file=sys.stderr)
+
+    records.sort(key=lambda record: record['ts'])
+    return records[:limit] if limit else records
+
+
+def replay(records: List[Dict], args: argparse.Namespace) -> Dict:
+    """
+    Envía los registros con sus intervalos originales divididos por --speed
+
+    Si la reproducción no da abasto (más de --max-in-flight peticiones en
+    curso), las peticiones salen tarde; ese retraso se informa como
+    `schedule_lag_ms`.
+    """
+    results: Dict[str, Dict] = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def send(record: Dict, scheduled: float) -> None:
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+
+        body = dict(record['params'])
+        if args.no_cache and record['endpoint'] == '/generate':
+            body['cache'] = False
+
+        sent = time.perf_counter()
+        try:
+            with session.post(args.target + record['endpoint'], json=body,
+                              timeout=args.timeout, stream=True) as response:
+                for _ in response.iter_content(chunk_size=None):
+                    pass
+                status = str(response.status_code)
+                failed = response.status_code >= 400
+        except requests.exceptions.RequestException as e:
+            status = type(e).__name__
+            failed = True
+        elapsed = time.perf_counter() - sent
+
+        with lock:
+            entry = results.setdefault(record['endpoint'], {
+                'latencies': [], 'original': [], 'lag': [], 'status_codes': {}, 'errors': 0
+            })
+            entry['status_codes'][status] = entry['status_codes'].get(status, 0) + 1
+            entry['lag'].append(max(0.0, sent - scheduled))
+            if failed:
+                entry['errors'] += 1
+            else:
+                entry['latencies'].append(elapsed)
+                if record.get('status', 200) < 400:
+                    entry['original'].append(record.get('total_ms', 0.0) / 1000)
+
+    first_ts = records[0]['ts'] if records else 0.0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.max_in_flight) as executor:
+        for record in records:
+            scheduled = start + (record['ts'] - first_ts) / args.speed if args.speed > 0 else start
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, record, scheduled)
+    wall = time.perf_counter() - start
+
+    report = {}
+    for endpoint, entry in sorted(results.items()):
+        total = len(entry['latencies']) + entry['errors']
+        report[endpoint] = {
+            'requests': total,
+            'errors': entry['errors'],
+            'error_rate': round(entry['errors'] / total, 4) if total else 0.0,
+            'rps': round(total / wall, 2) if wall > 0 else 0.0,
+            'latency_ms': latency_summary(sorted(entry['latencies'])),
+            'original_latency_ms': latency_summary(sorted(entry['original'])),
+            'schedule_lag_ms': latency_summary(sorted(entry['lag'])),
+            'status_codes': entry['status_codes']
+        }
+    return {'duration_seconds': round(wall, 2), 'endpoints': report}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reproduce un log de consultas de rag_api_service.py y mide latencias",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument('logs', nargs='+', help='Ficheros del log de consultas (--query-log)')
+    parser.add_argument('--target', type=str, default='http://localhost:5000',
+                        help='URL base del servicio (default: http://localhost:5000)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Factor de velocidad: 1 = ritmo original, 10 = diez veces más rápido, '
+                             '0 = sin esperas (default: 1)')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS),
+                        help='Endpoints a reproducir (default: todos)')
+    parser.add_argument('--limit', type=int, default=0, help='Reproducir solo las N primeras peticiones')
+    parser.add_argument('--max-in-flight', type=int, default=64,
+                        help='Peticiones en curso como máximo (default: 64)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Timeout de cada petición (default: 60)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Enviar /generate con "cache": false (mide el camino completo)')
+    parser.add_argument('--output', type=str, help='Guardar el JSON también en este fichero')
+
+    args = parser.parse_args()
+    args.target = args.target.rstrip('/')
+
+    records = load_records(args.logs, args.endpoints, args.limit)
+    if not records:
+        print("❌ El log no contiene peticiones que reproducir")
+        sys.exit(1)
+
+    span = records[-1]['ts'] - records[0]['ts']
+    sample_rates = sorted({record.get('sample_rate') for record in records if record.get('sample_rate')})
+    print(
+        f"▶️  Reproduciendo {len(records)} peticiones ({span:.0f}s de tráfico original) "
+        f"contra {args.target} a x{args.speed:g}",
+        file=sys.stderr
+    )
+
+    report = {
+        'config': {
+            'logs': args.logs,
+            'target': args.target,
+            'speed': args.speed,
+            'requests': len(records),
+            'original_span_seconds': round(span, 2),
+            'sample_rates': sample_rates,
+            'max_in_flight': args.max_in_flight,
+            'no_cache': args.no_cache
+        },
+        'results': replay(records, args)
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n⚠️  Interrumpido por el usuario")
+        sys.exit(0)
@@ -0,0 +1,250 @@
+"""Configuración común de los tests (python -m pytest tests, desde rag-setup/)"""
+
+import json
+import operator
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import pytest
+
+# rag_service se importa desde rag-setup/ sin instalarlo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_service import llm  # noqa: E402
+from rag_service.resilience import LLMBackendPool  # noqa: E402
+from rag_service.settings import config  # noqa: E402
+from rag_service.startup import startup  # noqa: E402
+
+
+class FakeClock:
+    """Sustituye a time.monotonic para avanzar el tiempo sin esperar"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(time, 'monotonic', fake)
+    return fake
+
+
+def make_doc(doc_id: str, text: str, distance: float = 0.2, **metadata) -> Dict:
+    """Chunk para StubCollection (metadata por defecto: source='libro.pdf')"""
+    return {'id': doc_id, 'text': text, 'distance': distance,
+            'metadata': dict({'source': 'libro.pdf'}, **metadata)}
+
+
+FILTER_OPERATORS = {
+    '$eq': operator.eq, '$ne': operator.ne,
+    '$gt': operator.gt, '$gte': operator.ge, '$lt': operator.lt, '$lte': operator.le,
+    '$in': lambda value, options: value in options,
+    '$nin': lambda value, options: value not in options
+}
+
+
+def matches(metadata: Dict, where: Optional[Dict]) -> bool:
+    """Evalúa una cláusula where de ChromaDB sobre la metadata de un chunk"""
+    if not where:
+        return True
+    if '$and' in where:
+        return all(matches(metadata, condition) for condition in where['$and'])
+    [(key, condition)] = where.items()
+    if not isinstance(condition, dict):
+        condition = {'$eq': condition}
+    return all(
+        key in metadata and FILTER_OPERATORS[op](metadata[key], operand)
+        for op, operand in condition.items()
+    )
+
+
+class StubCollection:
+    """
+    Colección de ChromaDB en memoria
+
+    `query` devuelve los primeros `n_results` documentos (en el orden dado)
+    que cumplen `where` para cada query y guarda las llamadas en `queries`;
+    con include=['embeddings'] devuelve el 'embedding' de cada documento.
+    `get` busca por IDs y guarda los IDs pedidos en `requested`.
+    """
+
+    def __init__(self, documents: List[Dict] = ()):
+        self.documents = list(documents)
+        self.queries = []
+        self.requested = []
+
+    def count(self) -> int:
+        return len(self.documents)
+
+    def query(self, query_texts: List[str], n_results: int = 10, **kwargs) -> Dict:
+        self.queries.append(dict(kwargs, query_texts=list(query_texts), n_results=n_results))
+        docs = [d for d in self.documents if matches(d['metadata'], kwargs.get('where'))][:n_results]
+        results = {
+            'ids': [[d['id'] for d in docs] for _ in query_texts],
+            'documents': [[d['text'] for d in docs] for _ in query_texts],
+            'metadatas': [[d['metadata'] for d in docs] for _ in query_texts],
+            'distances': [[d['distance'] for d in docs] for _ in query_texts]
+        }
+        if 'embeddings' in kwargs.get('include', ()):
+            results['embeddings'] = [[d['embedding'] for d in docs] for _ in query_texts]
+        return results
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict] = None,
+        limit: Optional[int] = None,
+        **kwargs
+    ) -> Dict:
+        docs = [d for d in self.documents if matches(d['metadata'], where)]
+        if ids is not None:
+            self.requested.append(list(ids))
+            docs = [d for d in docs if d['id'] in ids]
+        else:
+            docs = docs[:limit]
+        return {
+            'ids': [d['id'] for d in docs],
+            'documents': [d['text'] for d in docs],
+            'metadatas': [d['metadata'] for d in docs]
+        }
+
+
+class StubLLM:
+    """
+    LLM OpenAI-compatible de prueba (HTTP/1.1 con keep-alive)
+
+    Con "stream": true responde un evento SSE por cada elemento de `chunks`
+    (esperando `delay` segundos antes de cada uno) y, si hay `usage`, un
+    último chunk con el uso de tokens. Sin stream responde `reply` en JSON
+    tras `delay` segundos. Mientras `errors` tenga elementos, cada petición
+    consume uno: (status, headers) se responde tal cual y 'drop' cierra la
+    conexión sin responder. `max_active` registra cuántos POST llegó a
+    atender a la vez.
+    """
+
+    def __init__(self):
+        self.chunks = ['Divide', ' la tarea']
+        self.reply = 'Divide la tarea en pasos cortos.'
+        self.usage = None
+        self.delay = 0.0
+        self.errors = []
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                stub.requests.append({'path': self.path})
+                if not self.send_error_reply():
+                    self.send_json({'status': 'ok'})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.requests.append(body)
+                with stub._lock:
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                try:
+                    self.reply(body)
+                finally:
+                    with stub._lock:
+                        stub.active -= 1
+
+            def reply(self, body):
+                if self.send_error_reply():
+                    return
+
+                if body.get('stream'):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Connection', 'close')
+                    self.end_headers()
+                    self.close_connection = True
+                    for content in stub.chunks:
+                        time.sleep(stub.delay)
+                        self.send_event({'choices': [{'delta': {'content': content}}]})
+                    if stub.usage is not None:
+                        self.send_event({'choices': [], 'usage': stub.usage})
+                    self.wfile.write(b'data: [DONE]\n\n')
+                    return
+
+                time.sleep(stub.delay)
+                self.send_json({
+                    'choices': [{'message': {'content': stub.reply}}],
+                    'usage': stub.usage or {}
+                })
+
+            def send_error_reply(self) -> bool:
+                if not stub.errors:
+                    return False
+                error = stub.errors.pop(0)
+                if error == 'drop':
+                    self.close_connection = True
+                    return True
+                status, headers = error
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return True
+
+            def send_json(self, data):
+                payload = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def send_event(self, chunk):
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+
+        return Handler
+
+
+@pytest.fixture
+def llm_server(monkeypatch):
+    """StubLLM en un puerto local, configurado como config['llm_url'] y único backend"""
+    stub = StubLLM()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), stub.handler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    monkeypatch.setitem(config, 'llm_url', url)
+    monkeypatch.setattr(llm, 'llm_backends', LLMBackendPool([url]))
+    yield stub
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def service_ready():
+    """Marca el servicio como arrancado y deja `startup` como estaba al terminar"""
+    was_ready, ready_seconds = startup.ready, startup.ready_seconds
+    startup.mark_ready()
+    yield startup
+    startup.ready_seconds = ready_seconds
+    if not was_ready:
+        startup._ready.clear()
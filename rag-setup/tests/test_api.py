@@ -0,0 +1,144 @@
+import gzip
+import json
+
+import pytest
+
+from conftest import StubCollection, make_doc
+from rag_service import api, retrieval
+from rag_service.api import (
+    StatusMonitor, accepts_gzip, compact_documents, json_payload, make_snippet, refresh_document_count
+)
+from rag_service.caching import retrieval_cache
+from rag_service.retrieval import DocumentCounter
+from rag_service.settings import config
+
+
+class StubChromaClient:
+    def __init__(self):
+        self.up = True
+
+    def heartbeat(self):
+        if not self.up:
+            raise ConnectionError('ChromaDB caído')
+        return 1
+
+
+@pytest.fixture
+def chroma(monkeypatch):
+    collection = StubCollection([make_doc('a', 'Rutinas.')])
+    client = StubChromaClient()
+    monkeypatch.setattr(retrieval, 'collection', collection)
+    monkeypatch.setattr(retrieval, 'chroma_client', client)
+    return client, collection
+
+
+@pytest.fixture
+def monitor():
+    monitor = StatusMonitor(interval=3600)
+    yield monitor
+    monitor.stop()
+
+
+def test_monitor_without_thread_has_no_snapshot(chroma, monitor):
+    assert monitor.health() is None
+    assert monitor.stats() is None
+
+
+def test_monitor_serves_last_snapshot_until_refreshed(chroma, llm_server, monitor):
+    client, collection = chroma
+    monitor.start()
+
+    body, status_code, age = monitor.health()
+    assert (body['status'], status_code) == ('healthy', 200)
+    assert body['chromadb']['documents'] == 1
+    assert age >= 0
+
+    collection.documents.append(make_doc('b', 'Pausas.'))
+    client.up = False
+    assert monitor.health()[0]['chromadb']['documents'] == 1
+
+    body, status_code = monitor.refresh_health()
+    assert (body['status'], status_code) == ('degraded', 503)
+    assert monitor.health()[0]['chromadb'] == {'connected': False, 'documents': 0}
+
+
+def test_monitor_reports_llm_down(chroma, llm_server, monitor):
+    llm_server.errors = [(500, {})]
+    body, status_code = monitor.refresh_health()
+
+    assert body['llm']['connected'] is False
+    assert status_code == 503
+    assert len(llm_server.requests) == 1
+
+
+def test_refresh_document_count_clears_caches_when_collection_changed(chroma, monkeypatch):
+    _, collection = chroma
+    monkeypatch.setattr(api, 'document_counter', DocumentCounter())
+    assert refresh_document_count() == {'documents': 1, 'previous': None, 'changed': False}
+
+    retrieval_cache.set('rutinas', {'n_results': 3, 'documents': []})
+    assert refresh_document_count()['changed'] is False
+    assert retrieval_cache.get('rutinas') is not None
+
+    collection.documents.append(make_doc('b', 'Pausas.'))
+    assert refresh_document_count() == {'documents': 2, 'previous': 1, 'changed': True}
+    assert retrieval_cache.get('rutinas') is None
+
+
+TEXT = (
+    'Las personas con TDAH suelen beneficiarse de rutinas estables. '
+    'Una técnica útil es dividir cada tarea en pasos pequeños y concretos. '
+    'El ejercicio físico regular también mejora la atención sostenida.'
+)
+
+
+def test_snippet_is_centered_on_query_terms():
+    snippet = make_snippet(TEXT, {'ejercicio', 'atencion'}, length=60)
+
+    assert snippet == '…El ejercicio físico regular también mejora la atención…'
+
+
+def test_snippet_without_matches_is_start_of_text():
+    snippet = make_snippet(TEXT, {'sueno'}, length=40)
+
+    assert snippet.startswith('Las personas') and snippet.endswith('…')
+    # Sin cortar palabras a la mitad
+    assert TEXT.startswith(snippet[:-1])
+    assert TEXT[len(snippet) - 1] == ' '
+
+
+def test_short_text_is_returned_whole():
+    assert make_snippet('Rutinas estables.', {'rutinas'}, length=40) == 'Rutinas estables.'
+
+
+def test_compact_documents_keeps_only_requested_fields():
+    documents = [dict(make_doc('a', TEXT, page=7), relevance=0.8)]
+
+    assert compact_documents(documents, 'atención', None, 60) is documents
+    compact = compact_documents(documents, 'atención', ('source', 'page', 'relevance'), 60)
+    assert compact == [{'source': 'libro.pdf', 'page': 7, 'relevance': 0.8}]
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate, br', True),
+    ('br;q=1.0, gzip;q=0.5', True),
+    ('*', True),
+    ('gzip;q=0', False),
+    ('identity', False),
+    (None, False)
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
+
+
+def test_json_payload_compresses_only_large_bodies(monkeypatch):
+    monkeypatch.setitem(config, 'gzip_min_size', 100)
+    body = {'documents': [TEXT] * 3}
+
+    data, headers = json_payload(body, 'gzip')
+    assert headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(data)) == body
+
+    data, headers = json_payload({'count': 0}, 'gzip')
+    assert 'Content-Encoding' not in headers
+    assert json.loads(data) == {'count': 0}
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from rag_service.bm25 import BM25_INDEX_VERSION, BM25Index, tokenize
+
+
+def write_index(path, chunks):
+    """Índice en el formato de process_adhd_books.py a partir de {id: texto}"""
+    postings = {}
+    for position, text in enumerate(chunks.values()):
+        terms = tokenize(text)
+        for term in sorted(set(terms)):
+            postings.setdefault(term, []).extend([position, terms.count(term)])
+    path.write_text(json.dumps({
+        'version': BM25_INDEX_VERSION,
+        'ids': list(chunks),
+        'lengths': [len(tokenize(text)) for text in chunks.values()],
+        'postings': postings
+    }), encoding='utf-8')
+    return str(path)
+
+
+def test_tokenize_drops_accents_stopwords_and_single_letters():
+    assert tokenize('¿Cómo mejorar la ATENCIÓN y el foco?') == ['mejorar', 'atencion', 'foco']
+
+
+def test_search_ranks_rare_terms_higher(tmp_path):
+    index = BM25Index(write_index(tmp_path / 'bm25.json', {
+        'a': 'rutinas diarias para la atención',
+        'b': 'la atención mejora con rutinas y con ejercicio',
+        'c': 'dormir bien mejora la memoria',
+    }))
+
+    hits = index.search('ejercicio atención', n_results=5)
+
+    assert [doc_id for doc_id, _ in hits] == ['b', 'a']
+    assert hits[0][1] > hits[1][1] > 0
+
+
+def test_search_limits_results_and_ignores_unknown_terms(tmp_path):
+    index = BM25Index(write_index(tmp_path / 'bm25.json', {
+        'a': 'rutinas', 'b': 'rutinas rutinas', 'c': 'memoria'
+    }))
+
+    assert len(index.search('rutinas', n_results=1)) == 1
+    assert index.search('procrastinación', n_results=3) == []
+
+
+def test_load_rejects_other_versions(tmp_path):
+    path = tmp_path / 'bm25.json'
+    path.write_text(json.dumps({'version': BM25_INDEX_VERSION + 1}), encoding='utf-8')
+
+    with pytest.raises(ValueError, match='versión'):
+        BM25Index(str(path))
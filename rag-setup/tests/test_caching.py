@@ -0,0 +1,283 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rag_service.caching import (
+    AsyncSingleFlight, LRUCache, SingleFlight, StreamFlight, response_cache_key
+)
+from rag_service.resilience import DeadlineExceeded
+
+
+def test_lru_cache_expires_entries_after_ttl(clock):
+    cache = LRUCache(max_size=4, ttl=10)
+    cache.set('q', 'docs')
+
+    clock.advance(9)
+    assert cache.get('q') == 'docs'
+
+    clock.advance(2)
+    assert cache.get('q') is None
+    assert cache.stats()['size'] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.parametrize('max_size, ttl', [(0, 3600), (4, 0)])
+def test_disabled_lru_cache_stores_nothing_and_counts_no_misses(max_size, ttl):
+    cache = LRUCache(max_size=max_size, ttl=ttl)
+    cache.set('q', 'docs')
+
+    assert not cache.enabled
+    assert cache.get('q') is None
+    assert (cache.stats()['size'], cache.hits, cache.misses) == (0, 0, 0)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.evictions == 1
+
+
+def test_lru_cache_validate_clears_on_new_fingerprint():
+    cache = LRUCache(max_size=4, ttl=60)
+    cache.validate((100, 'model-a'))
+    cache.set('q', 'answer')
+
+    cache.validate((100, 'model-a'))
+    assert cache.get('q') == 'answer'
+
+    cache.validate((101, 'model-a'))
+    assert cache.get('q') is None
+    assert cache.invalidations == 1
+
+
+def test_get_counts_unusable_entry_as_miss():
+    cache = LRUCache(max_size=4, ttl=60)
+    cache.set('q', {'n_results': 2})
+
+    assert cache.get('q', usable=lambda entry: entry['n_results'] >= 3) is None
+    assert cache.get('q', usable=lambda entry: entry['n_results'] >= 2) == {'n_results': 2}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disabled_cache_stores_nothing():
+    cache = LRUCache(max_size=0, ttl=60)
+    cache.set('q', 'answer')
+
+    assert not cache.enabled
+    assert cache.get('q') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_response_cache_key_normalizes_message():
+    docs = [{'id': 'a'}, {'id': 'b'}]
+    key = response_cache_key('  ¿Cómo me  CONCENTRO? ', 3, 500, 1, docs)
+
+    assert key == response_cache_key('¿cómo me concentro?', 3, 500, 1.0, docs)
+    assert key != response_cache_key('¿cómo me concentro?', 3, 500, 1.0, docs[:1])
+    assert key != response_cache_key('¿cómo me concentro?', 3, 200, 1.0, docs)
+    assert key != response_cache_key('¿cómo me concentro?', 3, 500, 1.0, docs, where={'page': 3})
+
+
+def test_lru_cache_restore_keeps_remaining_ttl(clock):
+    source = LRUCache(max_size=4, ttl=60)
+    source.validate(42)
+    source.set('old', 1)
+    clock.advance(50)
+    source.set('new', 2)
+
+    fingerprint, entries = source.snapshot()
+    target = LRUCache(max_size=4, ttl=60)
+    assert target.restore(fingerprint, entries) == 2
+
+    clock.advance(20)
+    assert target.get('old') is None
+    assert target.get('new') == 2
+
+
+def run_concurrently(flight: SingleFlight, callers: int, func):
+    """Lanza `callers` llamadas a flight.do con la misma clave; devuelve resultados y errores"""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do('key', func))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timeout esperando la condición'
+        time.sleep(0.001)
+
+
+def test_single_flight_shares_one_execution():
+    flight = SingleFlight('test')
+    release = threading.Event()
+    executions = []
+
+    def work():
+        executions.append(1)
+        release.wait(5)
+        return 'result'
+
+    threads, results, errors = run_concurrently(flight, 5, work)
+    wait_for(lambda: flight.coalesced == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(executions) == 1
+    assert results == ['result'] * 5
+    assert errors == []
+
+
+def test_single_flight_propagates_error_and_releases_key():
+    flight = SingleFlight('test')
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError('chromadb down')
+
+    threads, results, errors = run_concurrently(flight, 3, fail)
+    wait_for(lambda: flight.coalesced == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == []
+    assert [str(e) for e in errors] == ['chromadb down'] * 3
+
+    # La clave queda libre: la siguiente llamada se ejecuta de nuevo
+    assert flight.do('key', lambda: 'retry') == 'retry'
+
+
+def test_single_flight_runs_different_keys_separately():
+    flight = SingleFlight('test')
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+    assert flight.coalesced == 0
+
+
+def test_single_flight_follower_stops_waiting_at_its_deadline():
+    flight = SingleFlight('test')
+    release = threading.Event()
+    threads, results, errors = run_concurrently(flight, 1, lambda: release.wait(5) and 'result')
+    wait_for(lambda: flight._calls)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded, match='during llm'):
+        flight.do('key', lambda: 'otra', deadline=start + 0.05, stage='llm')
+    assert time.monotonic() - start < 1.0
+
+    release.set()
+    threads[0].join()
+    assert results == ['result']
+
+
+def test_async_single_flight_follower_stops_waiting_at_its_deadline():
+    async def main():
+        flight = AsyncSingleFlight('test')
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 'result'
+
+        leader = asyncio.ensure_future(flight.do('key', work))
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceeded):
+            await flight.do('key', work, deadline=time.monotonic() + 0.05)
+        release.set()
+        return await leader
+
+    assert asyncio.run(main()) == 'result'
+
+
+def test_stream_flight_replays_all_events_to_late_subscriber():
+    flight = StreamFlight('test')
+    release = threading.Event()
+    producers = []
+
+    def producer():
+        producers.append(1)
+        yield 'data: 1\n\n'
+        release.wait(5)
+        yield 'data: 2\n\n'
+
+    first = flight.subscribe('key', producer)
+    assert next(first) == 'data: 1\n\n'
+
+    second = flight.subscribe('key', producer)
+    release.set()
+
+    assert list(first) == ['data: 2\n\n']
+    assert list(second) == ['data: 1\n\n', 'data: 2\n\n']
+    assert len(producers) == 1
+    assert flight.coalesced == 1
+
+
+def test_stream_flight_admits_only_the_producing_request():
+    flight = StreamFlight('test')
+    release = threading.Event()
+    admitted, released = [], []
+
+    def admit():
+        admitted.append(1)
+        return lambda: released.append(1)
+
+    def producer():
+        yield 'data: 1\n\n'
+        release.wait(5)
+        yield 'data: 2\n\n'
+
+    first = flight.subscribe('key', producer, admit=admit)
+    assert next(first) == 'data: 1\n\n'
+    second = flight.subscribe('key', producer, admit=admit)
+    release.set()
+
+    assert list(second) == ['data: 1\n\n', 'data: 2\n\n']
+    wait_for(lambda: released == [1])
+    assert admitted == [1]
+
+
+def test_stream_flight_rejected_admission_frees_the_key():
+    flight = StreamFlight('test')
+
+    def reject():
+        raise RuntimeError('sin hueco')
+
+    def producer():
+        yield 'data: 1\n\n'
+
+    with pytest.raises(RuntimeError):
+        flight.subscribe('key', producer, admit=reject)
+    assert list(flight.subscribe('key', producer)) == ['data: 1\n\n']
+
+
+def test_stream_flight_turns_producer_error_into_error_event():
+    flight = StreamFlight('test')
+
+    def producer():
+        yield 'data: 1\n\n'
+        raise RuntimeError('LLM down')
+
+    events = list(flight.subscribe('key', producer))
+    assert events[0] == 'data: 1\n\n'
+    assert events[1].startswith('event: error\n')
+    assert 'LLM down' in events[1]
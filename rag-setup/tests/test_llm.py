@@ -0,0 +1,120 @@
+import pytest
+import requests
+
+from rag_service import llm
+from rag_service.llm import LLMHttpClient, generate_with_llm, is_connect_error
+from rag_service.resilience import LLMBackendPool
+from rag_service.settings import config
+
+# Puerto cerrado: la conexión se rechaza antes de enviar la petición
+UNREACHABLE_URL = 'http://127.0.0.1:9/v1/chat/completions'
+
+
+@pytest.fixture
+def http():
+    client = LLMHttpClient(max_retries=2, backoff=0, read_timeout=5)
+    yield client
+    client.session.close()
+
+
+def test_post_retries_503_with_retry_after(http, llm_server):
+    llm_server.errors = [(503, {'Retry-After': '0'})]
+    response = http.post(config['llm_url'], json={'messages': []})
+
+    assert response.status_code == 200
+    assert len(llm_server.requests) == 2
+    assert http.stats()['retries'] == 1
+
+
+def test_retries_stop_after_max_retries(http, llm_server):
+    llm_server.errors = [(429, {'Retry-After': '0'})] * 3
+    response = http.post(config['llm_url'], json={'messages': []})
+
+    assert response.status_code == 429
+    assert len(llm_server.requests) == 3
+    assert http.stats()['retries'] == 2
+
+
+def test_get_retries_bad_gateway(http, llm_server):
+    llm_server.errors = [(502, {})]
+    response = http.get(config['llm_url'].replace('/v1/chat/completions', '/health'))
+
+    assert response.status_code == 200
+    assert len(llm_server.requests) == 2
+
+
+def test_connection_refused_is_retried_then_raised(http):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        http.post(UNREACHABLE_URL, json={'messages': []})
+
+    stats = http.stats()
+    assert (stats['requests'], stats['retries'], stats['failures']) == (3, 2, 1)
+
+
+@pytest.mark.parametrize('error', [(502, {}), (504, {}), (503, {}), (429, {})])
+def test_post_is_not_retried_when_generation_may_be_running(http, llm_server, error):
+    llm_server.errors = [error]
+    response = http.post(config['llm_url'], json={'messages': []})
+
+    assert response.status_code == error[0]
+    assert len(llm_server.requests) == 1
+    assert http.stats()['retries'] == 0
+
+
+def test_post_is_not_retried_when_connection_drops_after_sending(http, llm_server):
+    llm_server.errors = ['drop']
+
+    with pytest.raises(requests.exceptions.ConnectionError) as raised:
+        http.post(config['llm_url'], json={'messages': []})
+    assert not is_connect_error(raised.value)
+    assert len(llm_server.requests) == 1
+
+
+def test_get_is_retried_when_connection_drops(http, llm_server):
+    llm_server.errors = ['drop']
+    response = http.get(config['llm_url'].replace('/v1/chat/completions', '/health'))
+
+    assert response.status_code == 200
+    assert len(llm_server.requests) == 2
+
+
+def test_read_timeout_on_post_is_not_retried(llm_server):
+    http = LLMHttpClient(max_retries=2, backoff=0, read_timeout=0.2)
+    llm_server.delay = 1.0
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        http.post(config['llm_url'], json={'messages': []})
+    assert len(llm_server.requests) == 1
+
+
+def test_generate_with_llm_reuses_the_connection(llm_server, monkeypatch):
+    monkeypatch.setattr(llm, 'llm_http', LLMHttpClient())
+    for _ in range(3):
+        assert generate_with_llm('hola', [])['response'] == llm_server.reply
+
+    stats = llm.llm_http.stats()
+    assert stats['new_connections'] == 1
+    assert stats['reused_connections'] == 2
+
+
+def test_generate_fails_over_when_a_backend_refuses_connections(llm_server, monkeypatch):
+    monkeypatch.setattr(llm, 'llm_http', LLMHttpClient(max_retries=0))
+    monkeypatch.setattr(llm, 'llm_backends', LLMBackendPool([UNREACHABLE_URL, config['llm_url']]))
+
+    assert generate_with_llm('hola', [])['response'] == llm_server.reply
+
+    unreachable, healthy = llm.llm_backends.backends
+    assert (unreachable.failures, healthy.failures) == (1, 0)
+    assert healthy.in_flight == 0
+
+
+def test_generate_does_not_fail_over_after_server_error(llm_server, monkeypatch):
+    monkeypatch.setattr(llm, 'llm_http', LLMHttpClient(max_retries=0))
+    monkeypatch.setattr(llm, 'llm_backends', LLMBackendPool([config['llm_url'], UNREACHABLE_URL]))
+    llm_server.errors = [(500, {})]
+
+    with pytest.raises(Exception):
+        generate_with_llm('hola', [])
+    # El LLM pudo haber procesado la petición: no se repite en otro backend
+    assert len(llm_server.requests) == 1
+    assert llm.llm_backends.backends[0].failures == 1
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from rag_service.local_index import INDEX_CHUNKS_FILE, INDEX_EMBEDDINGS_FILE, LocalVectorIndex  # noqa: E402
+
+# Vectores unitarios por chunk; la función de embeddings del test devuelve el
+# vector del chunk cuyo texto coincide con la query
+VECTORS = {
+    'rutinas': [1.0, 0.0, 0.0],
+    'pomodoro': [0.0, 1.0, 0.0],
+    'sueño': [0.0, 0.0, 1.0],
+}
+
+
+def fake_embedding(texts):
+    return [VECTORS.get(text, [0.6, 0.8, 0.0]) for text in texts]
+
+
+def write_index(path, names):
+    np.save(path / INDEX_EMBEDDINGS_FILE, np.array([VECTORS[name] for name in names], dtype=np.float32))
+    (path / INDEX_CHUNKS_FILE).write_text(json.dumps({
+        'ids': [f'id-{name}' for name in names],
+        'documents': names,
+        'metadatas': [{'source': f'{name}.pdf'} for name in names],
+    }), encoding='utf-8')
+
+
+@pytest.fixture
+def index(tmp_path):
+    write_index(tmp_path, list(VECTORS))
+    return LocalVectorIndex(str(tmp_path), embedding_function=fake_embedding)
+
+
+def test_query_returns_top_k_in_chromadb_format(index):
+    results = index.query(query_texts=['pomodoro', 'sueño'], n_results=2)
+
+    assert [ids[0] for ids in results['ids']] == ['id-pomodoro', 'id-sueño']
+    assert results['documents'][0][0] == 'pomodoro'
+    assert results['metadatas'][1][0] == {'source': 'sueño.pdf'}
+    # Distancia L2 al cuadrado entre vectores unitarios: 0 idénticos, 2 ortogonales
+    assert results['distances'][0] == pytest.approx([0.0, 2.0])
+
+
+def test_query_ranks_by_cosine_similarity(index):
+    results = index.query(query_texts=['mezcla'], n_results=3)
+
+    assert results['ids'][0] == ['id-pomodoro', 'id-rutinas', 'id-sueño']
+    assert results['distances'][0] == pytest.approx([0.4, 0.8, 2.0])
+
+
+def test_query_caps_n_results_at_index_size(index):
+    results = index.query(query_texts=['rutinas'], n_results=10)
+    assert len(results['ids'][0]) == 3
+
+
+def test_get_and_count(index):
+    assert index.count() == 3
+    assert index.get(limit=2, offset=1)['ids'] == ['id-pomodoro', 'id-sueño']
+
+
+def test_load_picks_up_new_export(index, tmp_path):
+    write_index(tmp_path, ['sueño'])
+    index.load()
+
+    assert index.count() == 1
+    assert index.query(query_texts=['rutinas'], n_results=3)['ids'] == [['id-sueño']]
+
+
+def test_load_rejects_inconsistent_index(tmp_path):
+    write_index(tmp_path, ['rutinas', 'pomodoro'])
+    (tmp_path / INDEX_CHUNKS_FILE).write_text(
+        json.dumps({'ids': ['a'], 'documents': ['a'], 'metadatas': [{}]}), encoding='utf-8'
+    )
+
+    with pytest.raises(ValueError, match='inconsistente'):
+        LocalVectorIndex(str(tmp_path), embedding_function=fake_embedding)
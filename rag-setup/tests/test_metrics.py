@@ -0,0 +1,81 @@
+from contextvars import copy_context
+
+import pytest
+
+from rag_service.metrics import Metrics, format_value, metrics, timed, track_request_timings
+
+
+def test_counter_renders_exact_large_values():
+    registry = Metrics()
+    registry.counter('rag_test_total', 'Contador de prueba')
+    registry.inc('rag_test_total', 1234567, endpoint='/search')
+    registry.inc('rag_test_total', endpoint='/search')
+
+    assert registry.render() == (
+        '# HELP rag_test_total Contador de prueba\n'
+        '# TYPE rag_test_total counter\n'
+        'rag_test_total{endpoint="/search"} 1234568\n'
+    )
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Metrics()
+    registry.histogram('rag_test_seconds', 'Latencia', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        registry.observe('rag_test_seconds', value, stage='llm')
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP rag_test_seconds Latencia', '# TYPE rag_test_seconds histogram']
+    assert lines[2:5] == [
+        'rag_test_seconds_bucket{stage="llm",le="0.1"} 1',
+        'rag_test_seconds_bucket{stage="llm",le="1"} 2',
+        'rag_test_seconds_bucket{stage="llm",le="+Inf"} 3'
+    ]
+    assert lines[5:] == [
+        'rag_test_seconds_sum{stage="llm"} 5.55',
+        'rag_test_seconds_count{stage="llm"} 3'
+    ]
+
+
+def test_labels_are_sorted_and_escaped():
+    registry = Metrics()
+    registry.counter('rag_test_total', 'Contador de prueba')
+    registry.inc('rag_test_total', reason='dice "hola"\n', endpoint='a\\b')
+
+    assert registry.render().splitlines()[-1] == (
+        'rag_test_total{endpoint="a\\\\b",reason="dice \\"hola\\"\\n"} 1'
+    )
+
+
+def test_declared_metric_without_samples_renders_only_metadata():
+    registry = Metrics()
+    registry.histogram('rag_test_seconds', 'Latencia')
+    assert registry.render().splitlines() == [
+        '# HELP rag_test_seconds Latencia',
+        '# TYPE rag_test_seconds histogram'
+    ]
+
+
+def test_format_value_keeps_full_precision():
+    assert format_value(12345678901) == '12345678901'
+    assert format_value(2.0) == '2'
+    assert format_value(0.1234567891) == '0.1234567891'
+
+
+def test_timed_adds_stage_to_request_breakdown_and_counts_errors():
+    def request():
+        timings = track_request_timings()
+        with timed('test_stage'):
+            pass
+        with pytest.raises(ValueError):
+            with timed('test_stage'):
+                raise ValueError('fallo')
+        return timings
+
+    # En su propio contexto, como cada petición, para no dejar el desglose activo
+    timings = copy_context().run(request)
+
+    assert set(timings) == {'test_stage'}
+    rendered = metrics.render()
+    assert 'rag_stage_errors_total{stage="test_stage"} 1' in rendered
+    assert 'rag_stage_duration_seconds_count{stage="test_stage"} 2' in rendered
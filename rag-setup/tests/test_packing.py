@@ -0,0 +1,81 @@
+from rag_service.packing import (
+    CHARS_PER_TOKEN, MIN_PARTIAL_TOKENS, context_tokens, estimate_tokens, pack_context
+)
+
+
+def sentences(prefix: str, count: int) -> str:
+    """Texto de `count` frases distintas (sin 5-gramas compartidos con otro prefijo)"""
+    return ' '.join(f'{prefix} frase número {i} sobre hábitos y rutinas.' for i in range(count))
+
+
+def doc(doc_id, text, relevance, source='libro.pdf'):
+    return {'id': doc_id, 'text': text, 'metadata': {'source': source}, 'relevance': relevance}
+
+
+def test_zero_budget_keeps_every_document_by_relevance():
+    docs = [doc('b', sentences('beta', 3), 0.2), doc('a', sentences('alfa', 3), 0.9)]
+    packed = pack_context(docs, token_budget=0)
+
+    assert [d['id'] for d in packed] == ['a', 'b']
+    assert all('truncated' not in d for d in packed)
+    assert context_tokens(packed) == sum(estimate_tokens(d['text']) for d in docs)
+
+
+def test_budget_below_minimum_still_truncates_first_document():
+    docs = [doc('a', sentences('alfa', 40), 0.9), doc('b', sentences('beta', 40), 0.5)]
+    packed = pack_context(docs, token_budget=MIN_PARTIAL_TOKENS // 2)
+
+    assert [d['id'] for d in packed] == ['a']
+    assert packed[0]['truncated'] is True
+    assert 0 < packed[0]['tokens'] <= MIN_PARTIAL_TOKENS // 2 + 1
+
+
+def test_small_remainder_does_not_add_partial_document():
+    first = sentences('alfa', 4)
+    budget = estimate_tokens(first) + MIN_PARTIAL_TOKENS - 1
+    docs = [doc('a', first, 0.9), doc('b', sentences('beta', 40), 0.5)]
+
+    packed = pack_context(docs, token_budget=budget)
+    assert [d['id'] for d in packed] == ['a']
+
+
+def test_large_remainder_truncates_last_document_within_budget():
+    first = sentences('alfa', 4)
+    budget = estimate_tokens(first) + 2 * MIN_PARTIAL_TOKENS
+    docs = [doc('a', first, 0.9), doc('b', sentences('beta', 40), 0.5)]
+
+    packed = pack_context(docs, token_budget=budget)
+    assert [d['id'] for d in packed] == ['a', 'b']
+    assert packed[1]['truncated'] is True
+    assert packed[1]['text'].endswith('.')
+    assert context_tokens(packed) <= budget
+    assert len(packed[1]['text']) <= 2 * MIN_PARTIAL_TOKENS * CHARS_PER_TOKEN
+
+
+def test_near_duplicate_document_is_dropped():
+    text = sentences('alfa', 6)
+    docs = [doc('a', text, 0.9), doc('a-copia', text + ' Una más.', 0.8, source='otro.pdf')]
+    assert [d['id'] for d in pack_context(docs, token_budget=0)] == ['a']
+
+
+def test_overlap_with_adjacent_chunk_is_removed():
+    shared = 'El solapamiento entre chunks contiguos repite este mismo texto.'
+    first = sentences('alfa', 2) + ' ' + shared
+    second = shared + ' ' + sentences('beta', 2)
+    packed = pack_context([doc('a', first, 0.9), doc('b', second, 0.8)], token_budget=0)
+
+    assert packed[1]['text'] == sentences('beta', 2)
+    # En fuentes distintas el texto común no es solapamiento de chunking
+    other = pack_context([doc('a', first, 0.9), doc('b', second, 0.8, source='otro.pdf')], token_budget=0)
+    assert other[1]['text'] == second
+
+
+def test_input_documents_are_not_modified():
+    docs = [doc('a', sentences('alfa', 40), 0.9)]
+    original = dict(docs[0])
+    pack_context(docs, token_budget=10)
+    assert docs[0] == original
+
+
+def test_no_documents_packs_nothing():
+    assert pack_context([], token_budget=100) == []
@@ -0,0 +1,53 @@
+import pytest
+
+from conftest import make_doc
+from rag_service.llm import build_llm_request
+from rag_service.prompts import PREFIX_SYSTEM_PROMPT, build_messages
+from rag_service.settings import config
+
+DOCS = [
+    make_doc('b', 'Dividir las tareas reduce la procrastinación.', source='libro.pdf', page=12),
+    make_doc('a', 'Las rutinas ayudan a mantener la atención.', source='libro.pdf', page=3),
+    make_doc('c', 'El ejercicio mejora la concentración.', source='guia.pdf', page=40)
+]
+
+
+@pytest.fixture
+def prefix_layout(monkeypatch):
+    monkeypatch.setitem(config, 'prompt_layout', 'prefix')
+
+
+def test_prefix_layout_keeps_system_prompt_fixed(prefix_layout):
+    with_context = build_messages('¿Cómo me concentro?', DOCS)
+    without_context = build_messages('Hola', [])
+
+    assert with_context[0] == without_context[0] == {'role': 'system', 'content': PREFIX_SYSTEM_PROMPT}
+    assert without_context[1] == {'role': 'user', 'content': 'Hola'}
+
+
+def test_prefix_layout_orders_context_by_source_and_page(prefix_layout):
+    content = build_messages('¿Cómo me concentro?', DOCS)[1]['content']
+
+    positions = [content.index(doc['text']) for doc in (DOCS[2], DOCS[1], DOCS[0])]
+    assert positions == sorted(positions)
+    assert content.endswith('Pregunta del usuario:\n¿Cómo me concentro?')
+
+
+def test_prefix_layout_ignores_retrieval_order(prefix_layout):
+    assert build_messages('pregunta', DOCS) == build_messages('pregunta', DOCS[::-1])
+
+
+def test_classic_layout_puts_context_in_system_prompt(monkeypatch):
+    monkeypatch.setitem(config, 'prompt_layout', 'classic')
+    messages = build_messages('¿Cómo me concentro?', DOCS)
+
+    assert DOCS[0]['text'] in messages[0]['content']
+    assert messages[1] == {'role': 'user', 'content': '¿Cómo me concentro?'}
+
+
+def test_cache_prompt_hint_is_opt_in(monkeypatch):
+    monkeypatch.setitem(config, 'llm_cache_prompt', False)
+    assert 'cache_prompt' not in build_llm_request('hola', [], 100, 0.7)[0]
+
+    monkeypatch.setitem(config, 'llm_cache_prompt', True)
+    assert build_llm_request('hola', [], 100, 0.7)[0]['cache_prompt'] is True
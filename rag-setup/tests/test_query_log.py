@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+from rag_service import query_log as query_log_module
+from rag_service.query_log import QueryLog, redact_params, redact_text
+from replay_query_log import load_records
+
+
+@pytest.fixture
+def log(tmp_path):
+    query_log = QueryLog()
+    query_log.configure(str(tmp_path / 'queries.jsonl'), sample_rate=1.0, max_bytes=0, backups=0)
+    yield query_log
+    query_log.close()
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_disabled_log_samples_nothing():
+    assert not QueryLog().sample('/search')
+
+
+def test_sample_only_replayable_endpoints(log):
+    assert log.sample('/search') and log.sample('/search/batch') and log.sample('/generate')
+    assert not log.sample('/health')
+    assert not log.sample('/metrics')
+
+
+def test_sample_rate_is_a_probability(log, monkeypatch):
+    log.sample_rate = 0.25
+    monkeypatch.setattr(query_log_module.random, 'random', lambda: 0.2)
+    assert log.sample('/search')
+    monkeypatch.setattr(query_log_module.random, 'random', lambda: 0.3)
+    assert not log.sample('/search')
+
+    log.sample_rate = 0.0
+    monkeypatch.setattr(query_log_module.random, 'random', lambda: 0.0)
+    assert not log.sample('/search')
+
+
+def test_write_appends_json_lines(log):
+    log.write({'endpoint': '/search', 'params': {'query': 'atención'}})
+    log.write({'endpoint': '/generate', 'params': {'message': '¿Qué es el TDAH?'}})
+
+    lines = read_lines(log.path)
+    assert [line['endpoint'] for line in lines] == ['/search', '/generate']
+    assert lines[1]['params']['message'] == '¿Qué es el TDAH?'
+    assert log.stats()['written'] == 2
+
+
+def test_rotation_keeps_configured_backups(log, tmp_path):
+    # Cada línea supera max_bytes: se rota tras cada escritura
+    log.configure(log.path, sample_rate=1.0, max_bytes=5, backups=2)
+    for i in range(4):
+        log.write({'n': i})
+
+    assert read_lines(tmp_path / 'queries.jsonl.1') == [{'n': 3}]
+    assert read_lines(tmp_path / 'queries.jsonl.2') == [{'n': 2}]
+    assert not (tmp_path / 'queries.jsonl.3').exists()
+    assert not (tmp_path / 'queries.jsonl').exists()
+
+
+def test_rotation_without_backups_starts_over(log, tmp_path):
+    log.configure(log.path, sample_rate=1.0, max_bytes=10, backups=0)
+    log.write({'n': 0})
+    log.write({'n': 1})
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_redact_params_hashes_question_texts():
+    redacted = redact_params({
+        'message': '¿Qué es el TDAH?',
+        'n_results': 3,
+        'queries': [{'query': 'rutinas', 'n_results': 1}, 'no es un objeto']
+    })
+
+    assert redacted['message'] == {'sha256': redact_text('¿Qué es el TDAH?')['sha256'], 'chars': 16}
+    assert redacted['n_results'] == 3
+    assert redacted['queries'][0] == {'query': redact_text('rutinas'), 'n_results': 1}
+    assert redacted['queries'][1] == 'no es un objeto'
+
+
+def test_redacted_hash_matches_normalized_text():
+    assert redact_text('  ¿Qué es el TDAH?')['sha256'] == redact_text('¿qué es el tdah?')['sha256']
+    assert redact_text('rutinas') != redact_text('pausas')
+
+
+def test_raw_text_is_an_explicit_opt_in(log):
+    params = {'query': 'atención'}
+    assert log.loggable_params(params)['query'] == redact_text('atención')
+
+    log.configure(log.path, sample_rate=1.0, max_bytes=0, backups=0, raw_text=True)
+    assert log.loggable_params(params) == params
+    assert log.stats()['raw_text'] is True
+
+
+def test_replay_skips_records_without_text(log):
+    log.write({'ts': 2, 'endpoint': '/search', 'params': {'query': 'atención'}})
+    log.write({'ts': 1, 'endpoint': '/search', 'params': redact_params({'query': 'atención'})})
+    log.write({'ts': 3, 'endpoint': '/search/batch', 'params': redact_params({'queries': [{'query': 'a'}]})})
+
+    records = load_records([log.path], ['/search', '/search/batch'], limit=0)
+
+    assert [record['params'] for record in records] == [{'query': 'atención'}]
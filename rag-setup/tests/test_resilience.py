@@ -0,0 +1,310 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rag_service.resilience import (
+    UNLIMITED_HEDGE_WORKERS, AdmissionController, DeadlineExceeded, Hedger, LLMBackend,
+    LLMBackendPool, NoLLMBackendAvailable, Overloaded, deadline_passed, hedge_workers, retry_delay,
+    shrink_timeout
+)
+from rag_service.settings import config
+
+
+def test_retry_delay_uses_full_jitter_below_exponential_backoff():
+    delays = [
+        retry_delay(attempt, backoff=0.5, backoff_max=8.0)
+        for attempt in (0, 1, 2, 5) for _ in range(20)
+    ]
+
+    assert all(0 <= delay <= 8.0 for delay in delays)
+    assert max(retry_delay(0, backoff=0.5) for _ in range(50)) <= 0.5
+
+
+def test_retry_delay_honours_retry_after_up_to_backoff_max():
+    assert retry_delay(0, backoff=0.1, backoff_max=8.0, retry_after='3') >= 3
+    assert retry_delay(0, backoff=0.1, backoff_max=2.0, retry_after='30') == 2.0
+    assert retry_delay(0, backoff=0.1, retry_after='Wed, 21 Oct 2026 07:28:00 GMT') <= 0.1
+
+
+# === DEADLINES ===
+
+def test_shrink_timeout_caps_at_remaining_budget(clock):
+    assert shrink_timeout((5.0, 120.0), None) == (5.0, 120.0)
+    assert shrink_timeout((5.0, 120.0), clock.now + 2.0) == (2.0, 2.0)
+    assert shrink_timeout((1.0, 120.0), clock.now + 2.0) == (1.0, 2.0)
+
+    with pytest.raises(DeadlineExceeded) as error:
+        shrink_timeout((5.0, 120.0), clock.now)
+    assert error.value.stage == 'llm'
+
+
+def test_deadline_passed_with_slack(clock):
+    assert not deadline_passed(None)
+    assert not deadline_passed(clock.now + 1.0)
+    assert deadline_passed(clock.now + 0.01)
+    assert not deadline_passed(clock.now + 0.01, slack=0.0)
+
+# === CIRCUIT BREAKER DE LOS BACKENDS DEL LLM ===
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    pool = LLMBackendPool(['http://a'], failure_threshold=2, reset_timeout=30)
+
+    backend = pool.acquire()
+    pool.release(backend, False)
+    assert backend.state == LLMBackend.CLOSED
+
+    backend = pool.acquire()
+    pool.release(backend, False)
+    assert backend.state == LLMBackend.OPEN
+
+    clock.advance(10)
+    with pytest.raises(NoLLMBackendAvailable) as error:
+        pool.acquire()
+    assert error.value.retry_after == pytest.approx(20)
+
+
+def test_breaker_half_open_admits_one_probe(clock):
+    pool = LLMBackendPool(['http://a'], failure_threshold=1, reset_timeout=30)
+    pool.release(pool.acquire(), False)
+
+    clock.advance(30)
+    probe = pool.acquire()
+    assert probe.state == LLMBackend.HALF_OPEN
+    with pytest.raises(NoLLMBackendAvailable):
+        pool.acquire()
+
+    pool.release(probe, True, latency=0.2)
+    assert probe.state == LLMBackend.CLOSED
+    assert probe.consecutive_failures == 0
+    assert pool.acquire() is probe
+
+
+def test_breaker_half_open_failure_reopens(clock):
+    pool = LLMBackendPool(['http://a'], failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        pool.release(pool.acquire(), False)
+
+    clock.advance(30)
+    probe = pool.acquire()
+    pool.release(probe, False)
+
+    assert probe.state == LLMBackend.OPEN
+    assert probe.opened_at == clock.now
+
+
+def test_breaker_neutral_result_keeps_state():
+    pool = LLMBackendPool(['http://a'], failure_threshold=1)
+    backend = pool.acquire()
+    pool.release(backend, None)
+
+    assert backend.state == LLMBackend.CLOSED
+    assert backend.in_flight == 0
+    assert backend.failures == 0
+
+
+def test_pool_prefers_least_outstanding_and_skips_open_backends():
+    pool = LLMBackendPool(['http://a', 'http://b'], failure_threshold=1)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+
+    pool.release(first, False)
+    pool.release(second, True)
+    assert pool.acquire() is second
+
+
+# === CONTROL DE ADMISIÓN ===
+
+def test_admission_rejects_when_queue_is_full():
+    controller = AdmissionController('test', limit=1, max_queue=0, max_wait=1.0)
+    admitted_at = controller.acquire()
+
+    with pytest.raises(Overloaded) as error:
+        controller.acquire()
+    assert error.value.retry_after >= 1.0
+    assert controller.stats()['rejected'] == 1
+
+    controller.release(admitted_at)
+    with controller.slot():
+        assert controller.stats()['active'] == 1
+    assert controller.stats()['active'] == 0
+
+
+def test_admission_retry_after_grows_with_service_time():
+    controller = AdmissionController('test', limit=1, max_queue=0, max_wait=1.0)
+    controller.service_time = 7.2
+    admitted_at = controller.acquire()
+
+    with pytest.raises(Overloaded) as error:
+        controller.acquire()
+    controller.release(admitted_at)
+
+    # Un hueco ocupado y nadie en cola: lo que tarda de media una petición
+    assert error.value.retry_after == pytest.approx(7.2)
+
+
+def test_admission_times_out_in_queue():
+    controller = AdmissionController('test', limit=1, max_queue=1, max_wait=0.05)
+    admitted_at = controller.acquire()
+
+    start = time.monotonic()
+    with pytest.raises(Overloaded):
+        controller.acquire()
+    assert time.monotonic() - start < 1.0
+    assert controller.stats()['queued'] == 0
+    controller.release(admitted_at)
+
+
+def test_admission_wait_is_capped_by_deadline():
+    controller = AdmissionController('test', limit=1, max_queue=1, max_wait=30.0)
+    admitted_at = controller.acquire()
+
+    start = time.monotonic()
+    with pytest.raises(Overloaded):
+        controller.acquire(deadline=time.monotonic() + 0.05)
+    assert time.monotonic() - start < 1.0
+    controller.release(admitted_at)
+
+def test_admission_hands_slot_to_first_waiter():
+    controller = AdmissionController('test', limit=1, max_queue=2, max_wait=5.0)
+    admitted_at = controller.acquire()
+    admitted = []
+
+    def waiter(name):
+        with controller.slot():
+            admitted.append(name)
+
+    first = threading.Thread(target=waiter, args=('first',))
+    first.start()
+    while controller.stats()['queued'] < 1:
+        time.sleep(0.001)
+    second = threading.Thread(target=waiter, args=('second',))
+    second.start()
+    while controller.stats()['queued'] < 2:
+        time.sleep(0.001)
+
+    controller.release(admitted_at)
+    first.join(5)
+    second.join(5)
+
+    assert admitted == ['first', 'second']
+    assert controller.stats()['active'] == 0
+
+
+def test_admission_admit_returns_the_release_function():
+    controller = AdmissionController('test', limit=1, max_queue=0, max_wait=1.0)
+    release = controller.admit()
+
+    with pytest.raises(Overloaded):
+        controller.acquire()
+    release()
+    assert controller.stats()['active'] == 0
+
+
+def test_admission_unlimited_with_zero_limit():
+    controller = AdmissionController('test', limit=0, max_queue=0, max_wait=1.0)
+    admissions = [controller.acquire() for _ in range(100)]
+    for admitted_at in admissions:
+        controller.release(admitted_at)
+    assert controller.stats()['rejected'] == 0
+
+
+# === HEDGING ===
+
+def test_hedger_threshold_is_percentile_of_latencies():
+    hedger = Hedger('test', percentile=95, min_samples=20)
+    assert hedger.threshold() is None
+
+    for ms in range(1, 101):
+        hedger._record(ms / 1000)
+    assert hedger.threshold() == pytest.approx(0.095)
+
+    hedger.percentile = 0
+    assert hedger.threshold() is None
+
+
+def test_hedger_duplicates_about_the_slowest_percentile():
+    hedger = Hedger('test', percentile=90, min_samples=20)
+    invocations = []
+
+    def query():
+        # Una de cada diez ejecuciones es lenta; la copia de una lenta es rápida
+        invocations.append(1)
+        time.sleep(0.05 if len(invocations) % 10 == 0 else 0.002)
+        return 'docs'
+
+    for _ in range(40):
+        hedger.call(query)
+    hedger.hedged = hedger.wins = 0
+
+    calls = 100
+    start = time.perf_counter()
+    results = [hedger.call(query) for _ in range(calls)]
+    elapsed = time.perf_counter() - start
+
+    assert results == ['docs'] * calls
+    assert 0.03 <= hedger.hedged / calls <= 0.3
+    assert hedger.wins > 0
+    # Sin hedging las lentas sumarían 10 x 50ms
+    assert elapsed < calls * 0.002 + 0.4
+
+
+def test_hedger_raises_when_both_copies_fail():
+    hedger = Hedger('test', percentile=50, min_samples=1)
+    hedger._record(0.001)
+
+    def fail():
+        time.sleep(0.01)
+        raise ConnectionError('chromadb down')
+
+    with pytest.raises(ConnectionError):
+        hedger.call(fail)
+    assert hedger.hedged == 1
+
+
+def test_hedger_does_not_count_pool_wait_as_latency():
+    hedger = Hedger('test', percentile=50, min_samples=1)
+    hedger._record(0.05)
+    hedger._executor = ThreadPoolExecutor(max_workers=1)
+    busy = hedger._executor.submit(time.sleep, 0.2)
+
+    def query():
+        time.sleep(0.01)
+        return 'docs'
+
+    assert hedger.call(query) == 'docs'
+    busy.result()
+    assert hedger.hedged == 0
+    assert max(list(hedger._latencies)[1:]) < 0.05
+
+
+def test_hedge_workers_follow_admission_limits(monkeypatch):
+    monkeypatch.setitem(config, 'max_concurrent_searches', 16)
+    monkeypatch.setitem(config, 'max_concurrent_generations', 8)
+    assert hedge_workers() == 48
+
+    monkeypatch.setitem(config, 'max_concurrent_searches', 0)
+    assert hedge_workers() == UNLIMITED_HEDGE_WORKERS
+
+
+def test_hedger_skips_query_when_deadline_already_passed():
+    hedger = Hedger('test')
+    calls = []
+
+    with pytest.raises(DeadlineExceeded):
+        hedger.call(lambda: calls.append(1), deadline=time.monotonic())
+    hedger._executor.shutdown(wait=True)
+    assert calls == []
+
+
+def test_hedger_stops_waiting_at_the_deadline():
+    hedger = Hedger('test')
+    release = threading.Event()
+    start = time.monotonic()
+
+    with pytest.raises(DeadlineExceeded):
+        hedger.call(lambda: release.wait(5), deadline=start + 0.1)
+    release.set()
+    assert time.monotonic() - start < 1.0
@@ -0,0 +1,238 @@
+import time
+
+import pytest
+
+from conftest import StubCollection, make_doc
+from rag_service import retrieval
+from rag_service.caching import retrieval_cache
+from rag_service.retrieval import (
+    RRF_K, DocumentCounter, fuse_rankings, mmr_select, search_knowledge, search_knowledge_batch
+)
+from rag_service.resilience import DeadlineExceeded
+from rag_service.settings import config
+
+DOCS = [
+    make_doc('a', 'Las rutinas ayudan a mantener la atención.', 0.1),
+    make_doc('b', 'Dividir las tareas reduce la procrastinación.', 0.3),
+    make_doc('c', 'El ejercicio mejora la concentración.', 0.4),
+    make_doc('d', 'Dormir bien mejora la memoria de trabajo.', 0.6, source='guia.pdf')
+]
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    stub = StubCollection(DOCS)
+    monkeypatch.setattr(retrieval, 'collection', stub)
+    retrieval_cache.clear()
+    yield stub
+    retrieval_cache.clear()
+
+
+def test_search_knowledge_converts_distance_to_relevance(collection):
+    documents = search_knowledge('atención', n_results=2, doc_count=4)
+
+    assert [d['id'] for d in documents] == ['a', 'b']
+    assert documents[0]['relevance'] == pytest.approx(0.9)
+    assert documents[0]['metadata'] == {'source': 'libro.pdf'}
+
+
+def test_repeated_search_is_served_from_cache(collection):
+    first = search_knowledge('¿Cómo me concentro?', n_results=3, doc_count=4)
+    second = search_knowledge('  ¿cómo me CONCENTRO?', n_results=3, doc_count=4)
+
+    assert second == first
+    assert len(collection.queries) == 1
+
+
+def test_cached_search_serves_fewer_results_but_not_more(collection):
+    search_knowledge('atención', n_results=3, doc_count=4)
+
+    assert [d['id'] for d in search_knowledge('atención', n_results=2, doc_count=4)] == ['a', 'b']
+    assert len(collection.queries) == 1
+
+    assert len(search_knowledge('atención', n_results=4, doc_count=4)) == 4
+    assert len(collection.queries) == 2
+
+
+def test_cache_is_cleared_when_document_count_changes(collection):
+    search_knowledge('atención', n_results=2, doc_count=4)
+    search_knowledge('atención', n_results=2, doc_count=5)
+
+    assert len(collection.queries) == 2
+
+
+def test_batch_search_sends_one_query_for_all_misses(collection):
+    results = search_knowledge_batch([('atención', 2), ('sueño', 3), ('  ATENCIÓN', 1)], doc_count=4)
+
+    assert len(collection.queries) == 1
+    assert collection.queries[0]['query_texts'] == ['atención', 'sueño']
+    assert collection.queries[0]['n_results'] == 3
+    assert [[d['id'] for d in documents] for documents in results] == [['a', 'b'], ['a', 'b', 'c'], ['a']]
+
+
+def test_batch_search_only_sends_queries_missing_from_cache(collection):
+    search_knowledge('atención', n_results=3, doc_count=4)
+    results = search_knowledge_batch([('atención', 2), ('sueño', 2)], doc_count=4)
+
+    assert [query['query_texts'] for query in collection.queries] == [['atención'], ['sueño']]
+    assert [len(documents) for documents in results] == [2, 2]
+
+    search_knowledge_batch([('sueño', 1), ('atención', 3)], doc_count=4)
+    assert len(collection.queries) == 2
+
+
+def test_document_counter_recounts_after_max_age(collection, clock):
+    counter = DocumentCounter(max_age=30)
+    assert counter.cached is None
+    assert counter.get() == 4
+
+    collection.documents.append(make_doc('e', 'Listas de tareas.'))
+    clock.advance(29)
+    assert counter.get() == 4
+
+    clock.advance(2)
+    assert counter.get() == 5
+
+
+def test_document_counter_set_counts_as_fresh_value(collection, clock):
+    counter = DocumentCounter(max_age=30)
+    counter.set(10)
+
+    assert counter.get() == 10
+    clock.advance(31)
+    assert counter.get() == 4
+
+
+class StubBM25:
+    def __init__(self, hits):
+        self.hits = hits
+
+    def search(self, query, n_results):
+        return self.hits[:n_results]
+
+
+@pytest.fixture
+def hybrid(collection, monkeypatch):
+    """Activa la búsqueda híbrida con los hits BM25 que se pasen"""
+    monkeypatch.setitem(config, 'hybrid_weight', 0.5)
+    monkeypatch.setitem(config, 'hybrid_candidates', 20)
+
+    def set_hits(hits):
+        monkeypatch.setattr(retrieval, 'bm25_index', StubBM25(hits))
+    return set_hits
+
+
+def vector_docs(*ids):
+    return [dict(make_doc(doc_id, f'texto {doc_id}'), relevance=0.5) for doc_id in ids]
+
+
+def test_fuse_rankings_orders_by_reciprocal_rank(hybrid, collection):
+    hybrid([('b', 9.0), ('c', 4.0)])
+
+    fused = fuse_rankings('foco', vector_docs('a', 'b'), n_results=3)
+
+    assert [d['id'] for d in fused] == ['b', 'a', 'c']
+    # Solo se pide a la colección el chunk que no trajo la búsqueda vectorial
+    assert collection.requested == [['c']]
+    assert fused[2]['text'] == 'El ejercicio mejora la concentración.'
+    expected_b = (0.5 / (RRF_K + 2) + 0.5 / (RRF_K + 1)) * (RRF_K + 1)
+    assert fused[0]['relevance'] == pytest.approx(expected_b)
+
+
+def test_fuse_rankings_first_in_both_rankings_scores_one(hybrid):
+    hybrid([('a', 9.0)])
+    fused = fuse_rankings('foco', vector_docs('a', 'b'), n_results=2)
+    assert fused[0]['id'] == 'a'
+    assert fused[0]['relevance'] == pytest.approx(1.0)
+
+
+def test_fuse_rankings_drops_bm25_hits_missing_from_collection(hybrid):
+    hybrid([('borrado', 9.0), ('d', 1.0)])
+    fused = fuse_rankings('foco', vector_docs('a'), n_results=5)
+    assert [d['id'] for d in fused] == ['a', 'd']
+
+
+def test_fuse_rankings_weight_zero_keeps_vector_order(hybrid, monkeypatch):
+    monkeypatch.setitem(config, 'hybrid_weight', 0.0)
+    hybrid([('b', 9.0)])
+    fused = fuse_rankings('foco', vector_docs('a', 'b'), n_results=2)
+    assert [d['id'] for d in fused] == ['a', 'b']
+
+
+def candidate(doc_id, relevance, embedding):
+    return {'id': doc_id, 'text': doc_id, 'metadata': {}, 'relevance': relevance, 'embedding': embedding}
+
+
+@pytest.fixture
+def candidates():
+    pytest.importorskip('numpy')
+    return [
+        candidate('tdah', 0.9, [1.0, 0.0]),
+        candidate('tdah-repetido', 0.88, [1.0, 0.01]),
+        candidate('rutinas', 0.5, [0.0, 1.0])
+    ]
+
+
+def test_mmr_without_diversity_is_relevance_order(candidates):
+    selected = mmr_select(candidates, 2, diversity=0.0)
+    assert [d['id'] for d in selected] == ['tdah', 'tdah-repetido']
+
+
+def test_mmr_skips_near_duplicates(candidates):
+    selected = mmr_select(candidates, 2, diversity=0.5)
+    assert [d['id'] for d in selected] == ['tdah', 'rutinas']
+    assert all('embedding' not in d for d in selected)
+
+
+def test_mmr_smaller_selection_is_prefix(candidates):
+    full = [d['id'] for d in mmr_select(candidates, 3, diversity=0.5)]
+    assert [d['id'] for d in mmr_select(candidates, 2, diversity=0.5)] == full[:2]
+    assert sorted(full) == ['rutinas', 'tdah', 'tdah-repetido']
+
+
+def test_mmr_empty_and_oversized_requests(candidates):
+    assert mmr_select([], 3, diversity=0.5) == []
+    assert len(mmr_select(candidates, 10, diversity=0.5)) == 3
+
+
+def test_search_with_diversity_selects_from_larger_pool(collection):
+    pytest.importorskip('numpy')
+    for doc, embedding in zip(collection.documents, ([1, 0], [1, 0.01], [0, 1], [0.7, 0.7])):
+        doc['embedding'] = embedding
+
+    documents = search_knowledge('atención', n_results=2, doc_count=4, diversity=0.5, fetch_k=4)
+
+    assert collection.queries[0]['n_results'] == 4
+    assert 'embeddings' in collection.queries[0]['include']
+    assert [d['id'] for d in documents] == ['a', 'c']
+    assert 'embedding' not in documents[0]
+
+
+def test_search_passes_metadata_filter_to_collection(collection):
+    where = {'source': {'$eq': 'guia.pdf'}}
+    documents = search_knowledge('memoria', n_results=3, doc_count=4, where=where)
+
+    assert collection.queries[0]['where'] == where
+    assert [d['id'] for d in documents] == ['d']
+
+
+def test_filtered_and_unfiltered_searches_are_cached_separately(collection):
+    unfiltered = search_knowledge('memoria', n_results=2, doc_count=4)
+    filtered = search_knowledge('memoria', n_results=2, doc_count=4, where={'source': {'$eq': 'guia.pdf'}})
+
+    assert [d['id'] for d in unfiltered] == ['a', 'b']
+    assert [d['id'] for d in filtered] == ['d']
+    assert len(collection.queries) == 2
+
+
+def test_fuse_rankings_filters_bm25_candidates_with_where(hybrid):
+    hybrid([('d', 9.0), ('c', 4.0)])
+    fused = fuse_rankings('foco', vector_docs('a'), n_results=5, where={'source': {'$eq': 'libro.pdf'}})
+    assert [d['id'] for d in fused] == ['a', 'c']
+
+
+def test_search_with_expired_deadline_does_not_query(collection):
+    with pytest.raises(DeadlineExceeded):
+        search_knowledge('rutinas', n_results=2, doc_count=3, deadline=time.monotonic())
+
+    assert collection.queries == []
@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+from conftest import StubCollection, make_doc  # noqa: E402
+from rag_service import retrieval, server_async  # noqa: E402
+from rag_service.caching import response_cache, retrieval_cache  # noqa: E402
+from rag_service.resilience import async_generate_admission  # noqa: E402
+from rag_service.server_async import create_async_app  # noqa: E402
+from rag_service.settings import config  # noqa: E402
+from test_server_flask import sse_events  # noqa: E402
+
+DOCS = [
+    make_doc('a', 'Las rutinas ayudan a mantener la atención.'),
+    make_doc('b', 'Pausas cortas.')
+]
+
+
+@pytest.fixture
+def service(monkeypatch, service_ready):
+    monkeypatch.setattr(retrieval, 'collection', StubCollection(DOCS))
+    response_cache.clear()
+    retrieval_cache.clear()
+    yield
+    response_cache.clear()
+    retrieval_cache.clear()
+
+
+def run(*requests):
+    """Lanza las peticiones (method, path, json) a la vez y devuelve (status, headers, body)"""
+    async def main():
+        async with TestClient(TestServer(create_async_app())) as client:
+            async def one(method, path, body=None):
+                response = await client.request(method, path, json=body)
+                return response.status, response.headers, await response.text()
+            return await asyncio.gather(*(one(*request) for request in requests))
+
+    return asyncio.run(main())
+
+
+def test_async_generate_returns_llm_reply(service, llm_server):
+    [(status, headers, body)] = run(('POST', '/generate', {'message': 'hola', 'use_rag': False}))
+
+    assert status == 200
+    assert json.loads(body)['response'] == llm_server.reply
+    assert headers['Access-Control-Allow-Origin'] == '*'
+
+
+def test_async_generate_streams_sse_events(service, llm_server):
+    request = {'message': 'hola', 'use_rag': False, 'stream': True}
+    [(status, headers, body)] = run(('POST', '/generate', request))
+
+    assert status == 200
+    assert headers['Content-Type'].startswith('text/event-stream')
+    events = sse_events(body)
+    assert events[:2] == [('message', {'token': 'Divide'}), ('message', {'token': ' la tarea'})]
+    assert events[-1][0] == 'done'
+
+
+def test_async_llm_concurrency_is_bounded(service, llm_server, monkeypatch):
+    monkeypatch.setitem(config, 'llm_concurrency', 2)
+    llm_server.delay = 0.2
+    body = {'message': 'hola', 'use_rag': False, 'cache': False}
+
+    results = run(*[('POST', '/generate', body)] * 5)
+
+    assert [status for status, _, _ in results] == [200] * 5
+    assert llm_server.max_active == 2
+
+
+def test_async_search_and_validation(service):
+    (search_status, _, search_body), (bad_status, _, _), (options_status, _, _) = run(
+        ('POST', '/search', {'query': 'atención', 'n_results': 1}),
+        ('POST', '/generate', {'use_rag': False}),
+        ('OPTIONS', '/generate')
+    )
+
+    assert search_status == 200
+    assert json.loads(search_body)['count'] == 1
+    assert bad_status == 400
+    assert options_status == 200
+
+
+def test_async_generate_returns_429_when_saturated(service, monkeypatch):
+    # Hueco ocupado y cola sin sitio: se rechaza sin esperar
+    monkeypatch.setattr(async_generate_admission, 'limit', 1)
+    monkeypatch.setattr(async_generate_admission, 'max_queue', 0)
+    monkeypatch.setattr(async_generate_admission, 'active', 1)
+
+    [(status, headers, body)] = run(('POST', '/generate', {'message': 'hola', 'use_rag': False}))
+
+    assert status == 429
+    assert int(headers['Retry-After']) >= 1
+    assert 'retry later' in body
+
+
+def test_async_stream_failure_after_headers_becomes_error_event(service, monkeypatch):
+    async def failing_events():
+        yield 'data: {"token": "Divide"}\n\n'
+        raise RuntimeError('el productor se cayó')
+
+    async def failing_subscribe(key, events, admit=None):
+        return failing_events()
+
+    monkeypatch.setattr(server_async.async_stream_flight, 'subscribe', failing_subscribe)
+    request = {'message': 'hola', 'use_rag': False, 'stream': True}
+    [(status, _, body)] = run(('POST', '/generate', request))
+
+    assert status == 200
+    assert sse_events(body) == [
+        ('message', {'token': 'Divide'}),
+        ('error', {'error': 'el productor se cayó'})
+    ]
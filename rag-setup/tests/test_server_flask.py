@@ -0,0 +1,304 @@
+import gzip
+import json
+import threading
+import time
+
+import pytest
+
+from conftest import StubCollection, make_doc
+from rag_service import retrieval
+from rag_service.caching import response_cache, retrieval_cache
+from rag_service.query_log import query_log, redact_text
+from rag_service.resilience import generate_admission, search_admission
+from rag_service.settings import config
+from rag_service.server_flask import app
+
+
+@pytest.fixture
+def client(monkeypatch, service_ready):
+    monkeypatch.setattr(retrieval, 'collection', StubCollection())
+    response_cache.clear()
+    retrieval_cache.clear()
+    yield app.test_client()
+    response_cache.clear()
+    retrieval_cache.clear()
+
+
+def sse_events(body: str):
+    """(evento, data) de cada evento SSE del body"""
+    events = []
+    for block in body.strip().split('\n\n'):
+        event, data = 'message', None
+        for line in block.split('\n'):
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: '):
+                data = json.loads(line[len('data: '):])
+        events.append((event, data))
+    return events
+
+
+def test_generate_stream_sends_tokens_and_done_event(client, llm_server):
+    response = client.post('/generate', json={'message': 'hola', 'use_rag': False, 'stream': True})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    events = sse_events(response.get_data(as_text=True))
+    assert events[:2] == [('message', {'token': 'Divide'}), ('message', {'token': ' la tarea'})]
+    assert events[-1][0] == 'done'
+    assert events[-1][1]['sources_used'] == 0
+
+
+def test_generate_stream_must_be_boolean(client):
+    response = client.post('/generate', json={'message': 'hola', 'stream': 'yes'})
+    assert response.status_code == 400
+
+
+def test_search_batch_returns_results_in_request_order(client, monkeypatch):
+    collection = StubCollection([make_doc('a', 'Rutinas.'), make_doc('b', 'Pausas.')])
+    monkeypatch.setattr(retrieval, 'collection', collection)
+
+    response = client.post('/search/batch', json={
+        'queries': [{'query': 'rutinas', 'n_results': 1}, {'query': 'pausas'}],
+        'n_results': 2
+    })
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [(r['query'], r['count']) for r in body['results']] == [('rutinas', 1), ('pausas', 2)]
+    assert body['count'] == 2
+    assert len(collection.queries) == 1
+
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'queries': []},
+    {'queries': ['rutinas']},
+    {'queries': [{'query': ''}]},
+    {'queries': [{'query': 'rutinas', 'n_results': 11}]},
+    {'queries': [{'query': f'q{i}'} for i in range(100)]}
+])
+def test_search_batch_rejects_invalid_bodies(client, body):
+    assert client.post('/search/batch', json=body).status_code == 400
+
+
+def test_identical_generate_is_served_from_cache(client, llm_server):
+    body = {'message': '¿Cómo me concentro?', 'use_rag': False}
+    first = client.post('/generate', json=body).get_json()
+    second = client.post('/generate', json=dict(body, message='  ¿cómo me CONCENTRO? ')).get_json()
+
+    assert 'cached' not in first
+    assert second == dict(first, cached=True)
+    assert len(llm_server.requests) == 1
+
+
+def test_equivalent_temperatures_share_the_cache_entry(client, llm_server):
+    body = {'message': '¿Cómo me concentro?', 'use_rag': False}
+    client.post('/generate', json=dict(body, temperature=1))
+    second = client.post('/generate', json=dict(body, temperature=1.0)).get_json()
+
+    assert second['cached'] is True
+    assert llm_server.requests[0]['temperature'] == 1.0
+    assert client.post('/generate', json=dict(body, temperature='1')).status_code == 400
+
+
+def test_generate_with_cache_false_calls_the_llm(client, llm_server):
+    body = {'message': '¿Cómo me concentro?', 'use_rag': False}
+    client.post('/generate', json=body)
+    response = client.post('/generate', json=dict(body, cache=False)).get_json()
+
+    assert 'cached' not in response
+    assert len(llm_server.requests) == 2
+
+
+def test_cached_answer_is_replayed_as_stream(client, llm_server):
+    body = {'message': '¿Cómo me concentro?', 'use_rag': False}
+    client.post('/generate', json=body)
+    response = client.post('/generate', json=dict(body, stream=True))
+
+    events = sse_events(response.get_data(as_text=True))
+    assert events[0] == ('message', {'token': llm_server.reply})
+    assert events[-1][0] == 'done'
+    assert events[-1][1]['cached'] is True
+    assert len(llm_server.requests) == 1
+
+
+def test_metrics_endpoint_counts_requests(client):
+    # La petición se registra al cerrar la respuesta (al final del stream en SSE)
+    first = client.post('/search/batch', json={}, headers={'X-Request-ID': 'req-1'})
+    first.close()
+    assert first.headers['X-Request-ID'] == 'req-1'
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert '# TYPE rag_http_requests_total counter' in body
+    assert 'rag_http_requests_total{endpoint="/search/batch",method="POST",status="400"}' in body
+
+
+def test_generate_packs_retrieved_context_into_token_budget(client, llm_server, monkeypatch):
+    long_text = ' '.join(f'Frase {i} sobre rutinas y listas de tareas.' for i in range(60))
+    docs = [make_doc('a', long_text, 0.1), make_doc('b', long_text.replace('rutinas', 'pausas'), 0.2)]
+    monkeypatch.setattr(retrieval, 'collection', StubCollection(docs))
+
+    response = client.post('/generate', json={'message': 'rutinas', 'context_token_budget': 120})
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert 0 < body['context_tokens'] <= 120
+    assert body['sources_used'] == 1
+    system_prompt = llm_server.requests[0]['messages'][0]['content']
+    assert 'Frase 0 sobre rutinas' in system_prompt
+    assert 'pausas' not in system_prompt
+
+
+def test_generate_rejects_negative_context_budget(client):
+    response = client.post('/generate', json={'message': 'rutinas', 'context_token_budget': -1})
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def saturated_search(monkeypatch):
+    """Ocupa el único hueco de /search y deja la cola sin sitio"""
+    monkeypatch.setattr(search_admission, 'limit', 1)
+    monkeypatch.setattr(search_admission, 'max_queue', 0)
+    admitted_at = search_admission.acquire()
+    yield
+    search_admission.release(admitted_at)
+
+
+def test_search_returns_429_with_retry_after_when_saturated(client, saturated_search, monkeypatch):
+    monkeypatch.setattr(search_admission, 'service_time', 2.5)
+    response = client.post('/search', json={'query': 'concentración'})
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '3'
+    assert 'retry later' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_coalesced_generations_share_one_admission_slot(client, llm_server, monkeypatch, stream):
+    monkeypatch.setattr(generate_admission, 'limit', 1)
+    monkeypatch.setattr(generate_admission, 'max_queue', 0)
+    llm_server.delay = 0.3
+    body = {'message': '¿Cómo me concentro?', 'use_rag': False, 'stream': stream}
+    statuses = []
+
+    def post():
+        response = app.test_client().post('/generate', json=body)
+        response.get_data()
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=post) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * 3
+    assert len(llm_server.requests) == 1
+    assert generate_admission.stats()['active'] == 0
+
+
+def test_invalid_search_is_rejected_before_admission(client, saturated_search):
+    assert client.post('/search', json={'query': ''}).status_code == 400
+
+
+def test_search_returns_selected_fields_gzipped(client, monkeypatch):
+    text = ' '.join(['Las rutinas estables ayudan a mantener la atención.'] * 20)
+    monkeypatch.setattr(retrieval, 'collection', StubCollection([make_doc('a', text, page=3)]))
+    monkeypatch.setitem(config, 'gzip_min_size', 64)
+
+    response = client.post(
+        '/search',
+        json={'query': 'atención', 'n_results': 1, 'fields': ['snippet', 'page'], 'snippet_length': 80},
+        headers={'Accept-Encoding': 'gzip'}
+    )
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    [document] = json.loads(gzip.decompress(response.data))['documents']
+    assert set(document) == {'snippet', 'page'}
+    assert document['page'] == 3
+    assert 'atención' in document['snippet'] and len(document['snippet']) <= 82
+
+
+def test_search_rejects_unknown_fields(client):
+    response = client.post('/search', json={'query': 'atención', 'fields': ['embedding']})
+    assert response.status_code == 400
+
+
+def test_search_filter_restricts_sources(client, monkeypatch):
+    collection = StubCollection([make_doc('a', 'Rutinas.'), make_doc('b', 'Pausas.', source='guia.pdf')])
+    monkeypatch.setattr(retrieval, 'collection', collection)
+
+    response = client.post('/search', json={'query': 'pausas', 'filter': {'source': 'guia.pdf'}})
+
+    assert response.status_code == 200
+    assert [d['id'] for d in response.get_json()['documents']] == ['b']
+    assert collection.queries[0]['where'] == {'source': {'$eq': 'guia.pdf'}}
+
+
+def test_search_rejects_invalid_filter(client):
+    response = client.post('/search', json={'query': 'pausas', 'filter': {'author': 'x'}})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('raw_text', [False, True])
+def test_sampled_requests_are_written_to_query_log(client, tmp_path, raw_text):
+    path = tmp_path / 'queries.jsonl'
+    query_log.configure(str(path), sample_rate=1.0, max_bytes=0, backups=0, raw_text=raw_text)
+    try:
+        client.post('/search', json={'query': 'atención', 'n_results': 2}).close()
+        client.get('/metrics').close()
+    finally:
+        query_log.configure(None, sample_rate=0.0, max_bytes=0, backups=0)
+
+    [record] = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert record['endpoint'] == '/search'
+    assert record['status'] == 200
+    query = 'atención' if raw_text else redact_text('atención')
+    assert record['params'] == {'query': query, 'n_results': 2}
+    assert record['sample_rate'] == 1.0
+
+
+class SlowCollection(StubCollection):
+    def query(self, *args, **kwargs):
+        time.sleep(0.3)
+        return super().query(*args, **kwargs)
+
+
+def test_generate_returns_504_when_llm_misses_deadline(client, llm_server):
+    llm_server.delay = 1.0
+    response = client.post('/generate', json={'message': 'hola', 'use_rag': False, 'deadline_ms': 200})
+
+    assert response.status_code == 504
+    assert response.get_json()['error'] == 'Deadline exceeded during llm'
+
+
+def test_generate_answers_without_context_when_retrieval_is_slow(client, llm_server, monkeypatch):
+    # Con chroma_client la consulta pasa por el Hedger, que deja de esperar al deadline
+    monkeypatch.setattr(retrieval, 'chroma_client', object())
+    monkeypatch.setattr(retrieval, 'collection', SlowCollection([make_doc('a', 'Rutinas.')]))
+
+    start = time.monotonic()
+    response = client.post('/generate', json={'message': 'rutinas'}, headers={'X-Deadline-Ms': '400'})
+    elapsed = time.monotonic() - start
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body['sources_used'] == 0
+    assert 'sources' not in body
+    assert elapsed < 0.3
+    assert retrieval_cache.stats()['size'] == 0
+
+
+def test_generate_rejects_invalid_deadline(client):
+    response = client.post('/generate', json={'message': 'hola', 'deadline_ms': 0})
+    assert response.status_code == 400
+
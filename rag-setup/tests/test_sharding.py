@@ -0,0 +1,154 @@
+import threading
+import time
+
+import pytest
+
+from conftest import StubCollection, make_doc
+from rag_service import retrieval
+from rag_service.caching import retrieval_cache
+from rag_service.resilience import DeadlineExceeded
+from rag_service.retrieval import search_knowledge
+from rag_service.sharding import (
+    COLLECTION_NAME, ShardedCollection, parse_shard_spec, search_deadline, shard_for_source, track_search,
+    where_sources
+)
+
+
+class FailingCollection:
+    def __init__(self, error: Exception = None, block: threading.Event = None):
+        self.error = error
+        self.block = block
+
+    def query(self, **kwargs):
+        if self.block is not None:
+            self.block.wait(5)
+        raise self.error or ConnectionError('shard caído')
+
+    count = get = query
+
+
+@pytest.fixture
+def sharded():
+    """Dos shards con StubCollection; el segundo tiene los documentos más cercanos"""
+    collection = ShardedCollection(['chroma-a', 'chroma-b:9000/otra'], timeout=1.0)
+    first, second = collection.shards
+    first._collection = StubCollection([make_doc('a1', 'Rutinas.', 0.3), make_doc('a2', 'Listas.', 0.5)])
+    second._collection = StubCollection([make_doc('b1', 'Pausas.', 0.1), make_doc('b2', 'Sueño.', 0.4)])
+    yield collection
+    collection._executor.shutdown(wait=False)
+
+
+def test_parse_shard_spec_defaults():
+    assert parse_shard_spec('chroma-a', 8000) == ('chroma-a', 8000, COLLECTION_NAME)
+    assert parse_shard_spec('chroma-b:9000/otra', 8000) == ('chroma-b', 9000, 'otra')
+    assert parse_shard_spec(':9001', 8000) == ('localhost', 9001, COLLECTION_NAME)
+
+
+def test_shard_for_source_is_stable_and_in_range():
+    # crc32: el mismo valor en todos los procesos (a diferencia de hash())
+    assert shard_for_source('libro.pdf', 4) == shard_for_source('libro.pdf', 4)
+    assert {shard_for_source(f'libro-{i}.pdf', 3) for i in range(50)} == {0, 1, 2}
+
+
+def test_where_sources_intersects_source_conditions():
+    assert where_sources(None) is None
+    assert where_sources({'page': {'$gte': 3}}) is None
+    assert where_sources({'source': {'$eq': 'a.pdf'}}) == {'a.pdf'}
+    assert where_sources({'$and': [
+        {'source': {'$in': ['a.pdf', 'b.pdf']}},
+        {'source': {'$ne': 'c.pdf'}},
+        {'page': {'$eq': 3}}
+    ]}) == {'a.pdf', 'b.pdf'}
+
+
+def test_track_search_scopes_the_deadline():
+    assert search_deadline() is None
+    with track_search(123.0) as missing:
+        assert search_deadline() == 123.0
+        assert missing == []
+    assert search_deadline() is None
+
+
+def test_query_merges_shards_by_distance(sharded):
+    results = sharded.query(query_texts=['foco', 'sueño'], n_results=3)
+
+    assert results['ids'] == [['b1', 'a1', 'b2'], ['b1', 'a1', 'b2']]
+    assert results['distances'][0] == [0.1, 0.3, 0.4]
+    assert results['documents'][0][0] == 'Pausas.'
+    assert sharded.count() == 4
+
+
+def test_source_filter_only_queries_its_shard(sharded):
+    source = 'libro.pdf'
+    target = sharded.shards[shard_for_source(source, 2)]
+    other = sharded.shards[1 - shard_for_source(source, 2)]
+
+    sharded.query(query_texts=['foco'], n_results=2, where={'source': {'$eq': source}})
+
+    assert len(target._collection.queries) == 1
+    assert other._collection.queries == []
+
+
+def test_failed_shard_gives_partial_result(sharded):
+    sharded.shards[1]._collection = FailingCollection()
+
+    with track_search() as missing:
+        results = sharded.query(query_texts=['foco'], n_results=3)
+
+    assert results['ids'] == [['a1', 'a2']]
+    assert missing == ['chroma-b:9000/otra']
+    assert sharded.shards[1].errors == 1
+
+
+def test_slow_shard_is_dropped_after_timeout(sharded):
+    release = threading.Event()
+    sharded.timeout = 0.05
+    sharded.shards[0]._collection = FailingCollection(block=release)
+
+    try:
+        results = sharded.query(query_texts=['foco'], n_results=3)
+    finally:
+        release.set()
+
+    assert results['ids'] == [['b1', 'b2']]
+    assert 'timeout' in sharded.shards[0].last_error
+
+
+def test_no_shard_answering_raises(sharded):
+    for shard in sharded.shards:
+        shard._collection = FailingCollection()
+
+    with pytest.raises(RuntimeError, match='Ningún shard'):
+        sharded.query(query_texts=['foco'], n_results=3)
+
+
+def test_partial_search_is_not_cached(sharded, monkeypatch):
+    monkeypatch.setattr(retrieval, 'collection', sharded)
+    retrieval_cache.clear()
+    healthy = sharded.shards[1]._collection
+    sharded.shards[1]._collection = FailingCollection()
+
+    assert [d['id'] for d in search_knowledge('foco', n_results=2, doc_count=4)] == ['a1', 'a2']
+
+    sharded.shards[1]._collection = healthy
+    assert [d['id'] for d in search_knowledge('foco', n_results=2, doc_count=4)] == ['b1', 'a1']
+    retrieval_cache.clear()
+
+
+def test_search_deadline_caps_scatter_without_marking_shards_down(sharded, monkeypatch):
+    monkeypatch.setattr(retrieval, 'collection', sharded)
+    retrieval_cache.clear()
+    release = threading.Event()
+    sharded.shards[0]._collection = FailingCollection(block=release)
+    start = time.monotonic()
+
+    try:
+        with pytest.raises(DeadlineExceeded):
+            search_knowledge('foco', n_results=2, doc_count=4, deadline=start + 0.2)
+        elapsed = time.monotonic() - start
+    finally:
+        release.set()
+
+    assert elapsed < sharded.timeout
+    assert [shard.errors for shard in sharded.shards] == [0, 0]
+    retrieval_cache.clear()
@@ -0,0 +1,97 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+from urllib3.exceptions import ProtocolError
+
+from rag_service.llm import iter_stream_lines, stream_with_llm
+from rag_service.settings import config
+from rag_service.sse import sse_event
+
+DOC = {'id': 'a', 'text': 'Las rutinas ayudan a mantener la atención.', 'metadata': {'source': 'libro.pdf'}}
+
+
+def test_sse_event_frames_data_lines():
+    assert sse_event({'token': 'Hola'}) == 'data: {"token": "Hola"}\n\n'
+    assert sse_event({'model': 'm'}, event='done') == 'event: done\ndata: {"model": "m"}\n\n'
+
+
+def test_sse_event_keeps_non_ascii_text():
+    assert sse_event({'token': 'atención'}) == 'data: {"token": "atención"}\n\n'
+
+
+def test_stream_with_llm_yields_tokens_then_done(llm_server):
+    llm_server.usage = {'total_tokens': 12}
+    items = list(stream_with_llm('¿Cómo me concentro?', [DOC], max_tokens=50))
+
+    assert items[:-1] == [{'token': 'Divide'}, {'token': ' la tarea'}]
+    done = items[-1]
+    assert done['done'] is True
+    assert done['model'] == config['model_id']
+    assert done['tokens_used'] == 12
+    assert done['sources_used'] == 1
+
+    request = llm_server.requests[0]
+    assert request['stream'] is True
+    assert request['max_tokens'] == 50
+
+
+def test_stream_without_usage_counts_chunks(llm_server):
+    llm_server.chunks = ['a', '', 'b', 'c']
+    items = list(stream_with_llm('hola', []))
+
+    assert [item['token'] for item in items[:-1]] == ['a', 'b', 'c']
+    assert items[-1]['tokens_used'] == 3
+
+
+class FakeRaw:
+    """response.raw que entrega el body en los trozos dados (read1) o por líneas"""
+
+    def __init__(self, pieces, with_read1=True, error=None):
+        self.pieces = list(pieces)
+        self.error = error
+        if with_read1:
+            self.read1 = self._next
+        else:
+            self.readline = self._next
+
+    def _next(self, *args):
+        if self.pieces:
+            return self.pieces.pop(0)
+        if self.error is not None:
+            raise self.error
+        return b''
+
+
+def stream_lines(*pieces, **kwargs):
+    return list(iter_stream_lines(SimpleNamespace(raw=FakeRaw(pieces, **kwargs))))
+
+
+def test_iter_stream_lines_joins_lines_split_across_reads():
+    text = 'data: {"token": "atención"}\n\n'.encode()
+    lines = stream_lines(text[:10], text[10:17], text[17:] + b'data: [DONE]')
+
+    assert lines == ['data: {"token": "atención"}', '', 'data: [DONE]']
+
+
+def test_iter_stream_lines_strips_crlf_and_falls_back_to_readline():
+    assert stream_lines(b'data: a\r\n', b'\r\n') == ['data: a', '']
+    assert stream_lines(b'data: a\r\n', b'\n', with_read1=False) == ['data: a', '']
+
+
+def test_iter_stream_lines_raises_requests_errors():
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        stream_lines(b'data: a\n', error=ProtocolError('conexión cortada'))
+
+
+def test_stream_relays_first_token_before_the_llm_finishes(llm_server):
+    llm_server.chunks = ['Divide', ' la', ' tarea']
+    llm_server.delay = 0.3
+    started = time.perf_counter()
+    items = stream_with_llm('hola', [])
+
+    assert next(items) == {'token': 'Divide'}
+    first_token = time.perf_counter() - started
+    assert list(items)[-1]['done'] is True
+    assert first_token < 0.6 < time.perf_counter() - started
@@ -0,0 +1,71 @@
+import sys
+
+import pytest
+
+from rag_service.lazy import LazyModule, installed
+from rag_service.startup import StartupTracker, startup
+
+
+def test_lazy_module_imports_on_first_attribute_access(monkeypatch):
+    monkeypatch.delitem(sys.modules, 'colorsys', raising=False)
+    monkeypatch.setattr(LazyModule, 'loaded', {})
+    colorsys = LazyModule('colorsys')
+
+    assert 'colorsys' not in sys.modules
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert 'colorsys' in sys.modules
+    assert list(LazyModule.loaded) == ['colorsys']
+
+
+def test_installed_does_not_import():
+    assert installed('json')
+    assert not installed('paquete_que_no_existe')
+
+
+def test_tracker_reports_startup_times():
+    tracker = StartupTracker(started_at=0.0)
+    assert not tracker.ready
+    assert 'elapsed_seconds' in tracker.status()
+
+    tracker.imported()
+    tracker.mark_ready()
+    status = tracker.status()
+
+    assert status['ready'] is True
+    assert 0 < status['import_seconds'] <= status['ready_seconds']
+    assert 'elapsed_seconds' not in status
+
+
+def test_run_in_background_marks_ready_after_init():
+    tracker = StartupTracker(started_at=0.0)
+    calls = []
+
+    tracker.run_in_background(lambda: calls.append('init'))
+
+    assert tracker._ready.wait(5)
+    assert calls == ['init']
+
+
+@pytest.fixture
+def starting():
+    """Servicio aún arrancando; restaura el estado de `startup` al terminar"""
+    was_ready = startup.ready
+    startup._ready.clear()
+    yield startup
+    if was_ready:
+        startup._ready.set()
+
+
+def test_flask_rejects_requests_while_starting(starting):
+    pytest.importorskip('flask')
+    from rag_service.server_flask import app
+
+    client = app.test_client()
+    search = client.post('/search', json={'query': 'atención'})
+    health = client.get('/health')
+
+    assert search.status_code == 503
+    assert search.headers['Retry-After'] == '1'
+    assert health.status_code == 503
+    assert health.get_json()['status'] == 'starting'
+    assert client.options('/search').status_code == 200
@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+from rag_service.settings import config
+from rag_service.validation import (
+    RequestError, parse_deadline, parse_generate_request, parse_metadata_filter
+)
+
+
+def test_no_filter_is_none():
+    assert parse_metadata_filter({'query': 'rutinas'}) is None
+
+
+def test_scalar_list_and_operators_become_where_clause():
+    where = parse_metadata_filter({'filter': {
+        'source': 'libro.pdf',
+        'type': ['pdf', 'txt'],
+        'page': {'$lte': 40, '$gte': 10}
+    }})
+
+    # Orden fijo (clave y operador) para que el mismo filtro dé la misma clave de caché
+    assert where == {'$and': [
+        {'page': {'$gte': 10}},
+        {'page': {'$lte': 40}},
+        {'source': {'$eq': 'libro.pdf'}},
+        {'type': {'$in': ['pdf', 'txt']}}
+    ]}
+
+
+def test_single_condition_is_not_wrapped_in_and():
+    assert parse_metadata_filter({'filter': {'page': 3}}) == {'page': {'$eq': 3}}
+
+
+@pytest.mark.parametrize('metadata_filter, message', [
+    ([], 'non-empty object'),
+    ({}, 'non-empty object'),
+    ({'author': 'x'}, 'filter keys'),
+    ({'source': {}}, 'must not be empty'),
+    ({'source': {'$regex': 'x'}}, 'filter operators'),
+    ({'source': {'$gt': 'a'}}, 'does not support $gt'),
+    ({'page': '3'}, 'must be a integer'),
+    ({'page': True}, 'must be a integer'),
+    ({'type': []}, 'list of 1 to 100 string'),
+    ({'type': ['pdf', 3]}, 'list of 1 to 100 string')
+])
+def test_invalid_filters_are_rejected(metadata_filter, message):
+    with pytest.raises(RequestError, match=message.replace('$', r'\$')):
+        parse_metadata_filter({'filter': metadata_filter})
+
+
+def test_deadline_uses_smaller_of_body_and_header(clock):
+    assert parse_deadline({'deadline_ms': 3000}, None) == pytest.approx(clock.now + 3.0)
+    assert parse_deadline({'deadline_ms': 3000}, '1500') == pytest.approx(clock.now + 1.5)
+    assert parse_deadline({}, '250') == pytest.approx(clock.now + 0.25)
+
+
+def test_deadline_defaults_to_request_deadline(clock, monkeypatch):
+    monkeypatch.setitem(config, 'request_deadline', 0)
+    assert parse_deadline({}, None) is None
+
+    monkeypatch.setitem(config, 'request_deadline', 20)
+    assert parse_deadline({}, None) == pytest.approx(clock.now + 20)
+    assert parse_deadline({'deadline_ms': 500}, None) == pytest.approx(clock.now + 0.5)
+
+
+@pytest.mark.parametrize('body, header', [
+    ({'deadline_ms': 0}, None),
+    ({'deadline_ms': -5}, None),
+    ({'deadline_ms': 600001}, None),
+    ({'deadline_ms': True}, None),
+    ({'deadline_ms': 'pronto'}, None),
+    ({}, 'abc')
+])
+def test_invalid_deadlines_are_rejected(body, header):
+    with pytest.raises(RequestError, match='milliseconds'):
+        parse_deadline(body, header)
+
+
+def test_deadline_is_monotonic():
+    deadline = parse_deadline({'deadline_ms': 1000}, None)
+    assert 0.9 < deadline - time.monotonic() <= 1.0
+
+
+def test_generate_request_defaults_and_coercion():
+    params = parse_generate_request({'message': 'hola', 'temperature': 1})
+
+    assert params['temperature'] == 1.0 and isinstance(params['temperature'], float)
+    assert (params['use_rag'], params['max_tokens']) == (True, 1000)
+    assert parse_generate_request({'message': 'hola'})['temperature'] == 0.7
+
+
+@pytest.mark.parametrize('field, value', [
+    ('use_rag', 'false'),
+    ('use_rag', 0),
+    ('max_tokens', '500'),
+    ('max_tokens', 0),
+    ('max_tokens', 12.5),
+    ('max_tokens', True),
+    ('temperature', 'caliente'),
+    ('temperature', -0.1),
+    ('temperature', 2.5),
+    ('temperature', None)
+])
+def test_invalid_generate_parameters_are_rejected(field, value):
+    with pytest.raises(RequestError, match=field):
+        parse_generate_request({'message': 'hola', field: value})
@@ -0,0 +1,138 @@
+import json
+import time
+
+import pytest
+
+from conftest import StubCollection, make_doc
+from rag_service import api, retrieval, warmup
+from rag_service.caching import LRUCache, response_cache, retrieval_cache
+from rag_service.retrieval import DocumentCounter
+from rag_service.settings import config
+from rag_service.validation import parse_generate_request
+
+
+class StubCounter:
+    """document_counter sin ChromaDB: `cached` y `refresh` devuelven `count`"""
+
+    def __init__(self, count):
+        self.count = count
+
+    @property
+    def cached(self):
+        return self.count
+
+    def refresh(self):
+        return self.count
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    """Cachés vacíos y colección de 42 documentos para save/load_warm_cache"""
+    monkeypatch.setitem(config, 'model_id', 'llama-test')
+    counter = StubCounter(42)
+    monkeypatch.setattr(warmup, 'document_counter', counter)
+
+    def fresh():
+        retrieval = LRUCache(max_size=16, ttl=3600)
+        responses = LRUCache(max_size=16, ttl=3600)
+        monkeypatch.setattr(warmup, 'retrieval_cache', retrieval)
+        monkeypatch.setattr(warmup, 'response_cache', responses)
+        return retrieval, responses
+
+    return counter, fresh
+
+
+RETRIEVAL_KEY = ('¿cómo mejorar la concentración?', 3, None, ('source', None))
+RESPONSE_KEY = ('¿cómo mejorar la concentración?', 3, 500, 0.7, ('a', 'b'), 0, None)
+
+
+def test_warm_cache_round_trip(caches, tmp_path):
+    _, fresh = caches
+    retrieval, responses = fresh()
+    retrieval.validate(42)
+    retrieval.set(RETRIEVAL_KEY, [{'id': 'a', 'text': 'texto'}])
+    responses.validate((42, 'llama-test'))
+    responses.set(RESPONSE_KEY, {'response': 'Divide la tarea en pasos cortos.'})
+
+    path = str(tmp_path / 'warm.json')
+    assert warmup.save_warm_cache(path) == 2
+
+    retrieval, responses = fresh()
+    assert warmup.load_warm_cache(path) == {'retrieval': 1, 'responses': 1}
+    assert retrieval.get(RETRIEVAL_KEY) == [{'id': 'a', 'text': 'texto'}]
+    assert responses.get(RESPONSE_KEY) == {'response': 'Divide la tarea en pasos cortos.'}
+
+    # Las entradas restauradas siguen siendo válidas para el mismo fingerprint
+    retrieval.validate(42)
+    assert retrieval.get(RETRIEVAL_KEY) is not None
+
+
+def test_warm_cache_discarded_when_documents_change(caches, tmp_path):
+    counter, fresh = caches
+    retrieval, _ = fresh()
+    retrieval.set(RETRIEVAL_KEY, [])
+    path = str(tmp_path / 'warm.json')
+    warmup.save_warm_cache(path)
+
+    counter.count = 43
+    fresh()
+    assert warmup.load_warm_cache(path) == {'retrieval': 0, 'responses': 0}
+
+
+def test_warm_cache_drops_responses_from_another_model(caches, tmp_path, monkeypatch):
+    _, fresh = caches
+    retrieval, responses = fresh()
+    retrieval.set(RETRIEVAL_KEY, [])
+    responses.set(RESPONSE_KEY, {'response': 'hola'})
+    path = str(tmp_path / 'warm.json')
+    warmup.save_warm_cache(path)
+
+    monkeypatch.setitem(config, 'model_id', 'otro-modelo')
+    fresh()
+    assert warmup.load_warm_cache(path) == {'retrieval': 1, 'responses': 0}
+
+
+def test_warm_cache_skips_unserializable_entries(caches, tmp_path):
+    _, fresh = caches
+    retrieval, _ = fresh()
+    retrieval.set(('ok',), ['a'])
+    retrieval.set(('bad',), object())
+    path = tmp_path / 'warm.json'
+
+    assert warmup.save_warm_cache(str(path)) == 1
+    entries = json.loads(path.read_text(encoding='utf-8'))['caches']['retrieval']['entries']
+    assert [entry[0] for entry in entries] == [['ok']]
+
+
+def test_missing_warm_cache_file_loads_nothing(caches, tmp_path):
+    assert warmup.load_warm_cache(str(tmp_path / 'no-existe.json')) == {'retrieval': 0, 'responses': 0}
+
+
+def test_load_faq_file_skips_comments_blanks_and_duplicates(tmp_path):
+    path = tmp_path / 'faq.txt'
+    path.write_text('# Preguntas frecuentes\n¿Cómo me concentro?\n\n  ¿Qué es el TDAH?\n¿Cómo me concentro?\n',
+                    encoding='utf-8')
+
+    assert warmup.load_faq_file(str(path)) == ['¿Cómo me concentro?', '¿Qué es el TDAH?']
+
+
+def test_faq_warmup_leaves_answers_in_response_cache(llm_server, monkeypatch):
+    monkeypatch.setattr(retrieval, 'collection', StubCollection([make_doc('a', 'Rutinas estables.')]))
+    monkeypatch.setattr(api, 'document_counter', DocumentCounter())
+    response_cache.clear()
+    retrieval_cache.clear()
+
+    faq = warmup.FAQWarmup()
+    faq.start(['¿Cómo me concentro?', '¿Qué es el TDAH?'])
+    deadline = time.monotonic() + 5
+    while faq.running:
+        assert time.monotonic() < deadline, 'la precarga de FAQ no terminó'
+        time.sleep(0.01)
+
+    assert faq.status()['done'] == 2 and faq.status()['failed'] == 0
+    assert len(llm_server.requests) == 2
+    _, _, cached = api.prepare_generation(parse_generate_request({'message': '¿cómo me CONCENTRO?'}))
+    assert cached['response'] == llm_server.reply
+
+    response_cache.clear()
+    retrieval_cache.clear()